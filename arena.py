@@ -0,0 +1,186 @@
+# coding: UTF-8
+
+"""
+Arena (region of interest) of a video for pyABC.
+An arena is a rectangle or a polygon in a video frame, where
+  the animal can be. Frames are cropped to the bounding rectangle
+  of the arena right after decoding (pixels outside of a polygon are
+  set to zero), so that all processing, including background
+  subtraction and motion detection, is done only on the arena.
+  Positions in result data are stored in coordinates of the full frame.
+An arena is stored in a sidecar JSON file of the video,
+  [video-file-path]_arena.json, such as {"rect": [x, y, w, h]} or
+  {"poly": [[x1, y1], [x2, y2], ...]}.
+
+Usage:
+    python arena.py [video-file-path] [x] [y] [w] [h]
+
+Dependency:
+    NumPy (1.17)
+    OpenCV (4.1)
+"""
+
+import json
+from os import path, remove
+from sys import argv
+
+import cv2
+import numpy as np
+
+DEBUG = False
+
+#-----------------------------------------------------------------------
+
+def get_arena_fp(vFP):
+    """ Get file path of arena file of a video.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (str): File path of arena file.
+
+    Examples:
+        >>> get_arena_fp("data/rat1.mp4")
+        'data/rat1.mp4_arena.json'
+    """
+    if DEBUG: print("arena.get_arena_fp()")
+
+    return vFP + "_arena.json"
+
+#-----------------------------------------------------------------------
+
+def make_arena(fSz, rect=None, poly=None):
+    """ Make arena info with a rectangle or a polygon.
+
+    Args:
+        fSz (tuple): Width and height of full frame.
+        rect (None/tuple): (x, y, w, h) of arena.
+        poly (None/list): Vertices of polygon arena; [[x1, y1], ...].
+
+    Returns:
+        (None/dict): Arena info. None, when arena is not given or
+          it covers the full frame.
+          rect (tuple): (x, y, w, h) of cropping rectangle.
+          offset (tuple): (x, y) of top-left corner of cropped frame
+            in the full frame.
+          fSz (tuple): Width and height of full frame.
+          mask (None/numpy.ndarray): Mask (size of cropped frame) of
+            the polygon; 255 inside.
+          poly (None/list): Vertices of polygon arena.
+
+    Examples:
+        >>> make_arena((640, 480), rect=(100, 50, 200, 100))["rect"]
+        (100, 50, 200, 100)
+        >>> make_arena((640, 480), rect=(600, 400, 200, 200))["rect"]
+        (600, 400, 40, 80)
+        >>> make_arena((640, 480), rect=(0, 0, 640, 480)) is None
+        True
+    """
+    if DEBUG: print("arena.make_arena()")
+
+    mask = None
+    if poly != None:
+        pts = np.asarray(poly, dtype=np.int32).reshape((-1, 1, 2))
+        rect = cv2.boundingRect(pts)
+    if rect == None: return None
+    ### clip rect into frame
+    x1 = max(0, int(rect[0])); y1 = max(0, int(rect[1]))
+    x2 = min(fSz[0], int(rect[0]+rect[2]))
+    y2 = min(fSz[1], int(rect[1]+rect[3]))
+    if x2 <= x1 or y2 <= y1: return None
+    if poly == None and (x1, y1, x2, y2) == (0, 0, fSz[0], fSz[1]):
+        return None
+    if poly != None:
+        mask = np.zeros((y2-y1, x2-x1), dtype=np.uint8)
+        cv2.fillPoly(mask, [pts - np.int32([x1, y1])], 255)
+    return dict(rect=(x1, y1, x2-x1, y2-y1),
+                offset=(x1, y1),
+                fSz=tuple(fSz),
+                mask=mask,
+                poly=poly)
+
+#-----------------------------------------------------------------------
+
+def load_arena(vFP, fSz):
+    """ Load arena of a video from its arena file, if it exists.
+
+    Args:
+        vFP (str): File path of video.
+        fSz (tuple): Width and height of full frame.
+
+    Returns:
+        (None/dict): Arena info (make_arena).
+    """
+    if DEBUG: print("arena.load_arena()")
+
+    fp = get_arena_fp(vFP)
+    if not path.isfile(fp): return None
+    with open(fp, "r") as f: d = json.load(f)
+    return make_arena(fSz, rect=d.get("rect", None), poly=d.get("poly", None))
+
+#-----------------------------------------------------------------------
+
+def save_arena(vFP, rect=None, poly=None):
+    """ Save arena of a video to its arena file.
+    When neither 'rect' nor 'poly' is given, the arena file is removed.
+
+    Args:
+        vFP (str): File path of video.
+        rect (None/tuple): (x, y, w, h) of arena.
+        poly (None/list): Vertices of polygon arena; [[x1, y1], ...].
+
+    Returns:
+        None
+    """
+    if DEBUG: print("arena.save_arena()")
+
+    fp = get_arena_fp(vFP)
+    if rect == None and poly == None:
+        if path.isfile(fp): remove(fp)
+        return
+    d = {}
+    if poly != None: d["poly"] = [[int(v) for v in pt] for pt in poly]
+    else: d["rect"] = [int(v) for v in rect]
+    with open(fp, "w") as f: json.dump(d, f)
+
+#-----------------------------------------------------------------------
+
+def crop_frame(frame, arena, flagCopy=False):
+    """ Crop a frame image to arena.
+
+    Args:
+        frame (numpy.ndarray): Full frame image (or memory-mapped frame).
+        arena (None/dict): Arena info (make_arena).
+        flagCopy (bool): Whether to return a copy of 'frame', 
+          when arena is None (such as for memory-mapped frame).
+
+    Returns:
+        (numpy.ndarray): Cropped frame image. Pixels outside of
+          polygon arena are zero.
+
+    Examples:
+        >>> a = make_arena((4, 3), poly=[[1, 0], [2, 0], [2, 1]])
+        >>> crop_frame(np.full((3, 4, 3), 9, np.uint8), a)[:,:,0]
+        array([[9, 9],
+               [0, 9]], dtype=uint8)
+    """
+    if DEBUG: print("arena.crop_frame()")
+
+    if arena == None:
+        if flagCopy: return np.array(frame)
+        return frame
+    x, y, w, h = arena["rect"]
+    img = np.array(frame[y:y+h, x:x+w]) # copy; contiguous
+    if arena["mask"] is not None: img[arena["mask"] == 0] = 0
+    return img
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    if len(argv) < 6:
+        print("Usage: python arena.py [video-file-path] [x] [y] [w] [h]")
+    else:
+        save_arena(argv[1], rect=[int(v) for v in argv[2:6]])
+        print("%s was written."%(get_arena_fp(argv[1])))
+
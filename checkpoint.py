@@ -0,0 +1,414 @@
+# coding: UTF-8
+
+"""
+Checkpoints of tracker state of a video for pyABC.
+States of CVProc, kept over frames (last motion frame, temporal filter of
+  head direction, optical flow tracking and panel area of Macaque19),
+  are written every N frames during analysis, with the frame-index,
+  output data row of the frame and a hash of the analysis parameters.
+  Analysis, started from the frame after a checkpoint with the state
+  of the checkpoint, gives the same results as an uninterrupted run.
+A checkpoint is used only when the parameter hash and the data row of
+  the frame match the current ones.
+Checkpoints are appended to a sidecar file of the video,
+  [video-file-path]_ckpt.bin, as pairs of NumPy arrays; a header
+  (JSON text) and a state blob (compressed .npz), therefore
+  a checkpoint is written without rewriting the file and read
+  without unpickling. The file is compacted (rewritten with only 
+  the last checkpoint of each frame and parameter hash), when 
+  a number of checkpoints were superseded, or when checkpoints of 
+  other parameters are cleared (CVProc.saveCheckpoint).
+
+Usage:
+    python checkpoint.py [video-file-path]
+
+Dependency:
+    NumPy (1.17)
+"""
+
+import json
+from hashlib import md5
+from io import BytesIO
+from os import path, remove, replace, fdopen, stat
+from sys import argv
+from tempfile import mkstemp
+
+import numpy as np
+
+DEBUG = False
+HDR_MEMO = {} # headers of checkpoint files, read the last time;
+  # {file-path: (size, modification time, headers)}
+
+#-----------------------------------------------------------------------
+
+def get_ckpt_fp(vFP):
+    """ Get file path of checkpoint file of a video.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (str): File path of checkpoint file.
+
+    Examples:
+        >>> get_ckpt_fp("data/rat1.mp4")
+        'data/rat1.mp4_ckpt.bin'
+    """
+    if DEBUG: print("checkpoint.get_ckpt_fp()")
+
+    return vFP + "_ckpt.bin"
+
+#-----------------------------------------------------------------------
+
+def param_hash(animalECase, aecParam, arena=None, bg=None):
+    """ Get hash of parameters, which determine analysis results.
+
+    Args:
+        animalECase (str): Animal experiment case.
+        aecParam (dict): Parameters of the case.
+        arena (None/dict): Arena info (arena.make_arena).
+        bg (None/numpy.ndarray): Background image.
+
+    Returns:
+        (str): Hash string.
+
+    Examples:
+        >>> h = param_hash("Rat05", {"uDegTh": {"value": 20}})
+        >>> h == param_hash("Rat05", {"uDegTh": {"value": 20}})
+        True
+        >>> h == param_hash("Rat05", {"uDegTh": {"value": 30}})
+        False
+    """
+    if DEBUG: print("checkpoint.param_hash()")
+
+    d = dict(case=animalECase,
+             param=dict([(k, aecParam[k]["value"]) for k in aecParam.keys()]))
+    if arena != None: d["arena"] = [arena["rect"], arena["poly"]]
+    h = md5(json.dumps(d, sort_keys=True, default=str).encode("utf-8"))
+    if type(bg) == np.ndarray: h.update(np.ascontiguousarray(bg).tobytes())
+    return h.hexdigest()
+
+#-----------------------------------------------------------------------
+
+def pack_state(state):
+    """ Serialize a state (nested dictionaries, lists and tuples of
+    numbers, strings, None and NumPy arrays) to bytes.
+
+    Args:
+        state (dict): State.
+
+    Returns:
+        (bytes): Compressed .npz data.
+
+    Examples:
+        >>> st = dict(a=(1, 2.5), b=None, c=np.arange(3), d=[dict(e="f")])
+        >>> st2 = unpack_state(pack_state(st))
+        >>> st2["a"], st2["b"], st2["c"], st2["d"]
+        ((1, 2.5), None, array([0, 1, 2]), [{'e': 'f'}])
+    """
+    if DEBUG: print("checkpoint.pack_state()")
+
+    arrs = {}
+    def enc(v):
+        if type(v) == np.ndarray:
+            k = "a%i"%(len(arrs))
+            arrs[k] = v
+            return {"__nd__": k}
+        elif type(v) == dict:
+            return dict([(k, enc(v[k])) for k in v.keys()])
+        elif type(v) == tuple:
+            return {"__tuple__": [enc(_v) for _v in v]}
+        elif type(v) == list:
+            return [enc(_v) for _v in v]
+        elif isinstance(v, np.generic):
+            return v.item()
+        return v
+    meta = json.dumps(enc(state)).encode("utf-8")
+    arrs["meta"] = np.frombuffer(meta, dtype=np.uint8)
+    buf = BytesIO()
+    np.savez_compressed(buf, **arrs)
+    return buf.getvalue()
+
+#-----------------------------------------------------------------------
+
+def unpack_state(blob):
+    """ Deserialize a state, serialized with pack_state.
+
+    Args:
+        blob (bytes): Compressed .npz data.
+
+    Returns:
+        (dict): State.
+    """
+    if DEBUG: print("checkpoint.unpack_state()")
+
+    arrs = np.load(BytesIO(blob), allow_pickle=False)
+    def dec(v):
+        if type(v) == dict:
+            if "__nd__" in v.keys(): return arrs[v["__nd__"]]
+            if "__tuple__" in v.keys():
+                return tuple([dec(_v) for _v in v["__tuple__"]])
+            return dict([(k, dec(v[k])) for k in v.keys()])
+        elif type(v) == list:
+            return [dec(_v) for _v in v]
+        return v
+    return dec(json.loads(arrs["meta"].tobytes().decode("utf-8")))
+
+#-----------------------------------------------------------------------
+
+def state_to_json(state):
+    """ Serialize a small state (nested dictionaries, lists and tuples of
+    numbers, strings, None and small NumPy arrays) to JSON text,
+    with arrays inline, so that equal states give equal text.
+
+    Args:
+        state (dict): State.
+
+    Returns:
+        (str): JSON text.
+
+    Examples:
+        >>> st = dict(a=(1, 2.5), b=None, c=np.float32([[0.1, 2]]))
+        >>> st2 = state_from_json(state_to_json(st))
+        >>> st2["a"], st2["b"], st2["c"], st2["c"].dtype
+        ((1, 2.5), None, array([[0.1, 2. ]], dtype=float32), dtype('float32'))
+    """
+    if DEBUG: print("checkpoint.state_to_json()")
+
+    def enc(v):
+        if type(v) == np.ndarray:
+            return {"__arr__": [v.dtype.str, list(v.shape), v.ravel().tolist()]}
+        elif type(v) == dict:
+            return dict([(k, enc(v[k])) for k in v.keys()])
+        elif type(v) == tuple:
+            return {"__tuple__": [enc(_v) for _v in v]}
+        elif type(v) == list:
+            return [enc(_v) for _v in v]
+        elif isinstance(v, np.generic):
+            return v.item()
+        return v
+    return json.dumps(enc(state), sort_keys=True, separators=(",", ":"))
+
+#-----------------------------------------------------------------------
+
+def state_from_json(s):
+    """ Deserialize a state, serialized with state_to_json.
+
+    Args:
+        s (str): JSON text.
+
+    Returns:
+        (dict): State.
+    """
+    if DEBUG: print("checkpoint.state_from_json()")
+
+    def dec(v):
+        if type(v) == dict:
+            if "__arr__" in v.keys():
+                dt, shape, data = v["__arr__"]
+                return np.array(data, dtype=dt).reshape(shape)
+            if "__tuple__" in v.keys():
+                return tuple([dec(_v) for _v in v["__tuple__"]])
+            return dict([(k, dec(v[k])) for k in v.keys()])
+        elif type(v) == list:
+            return [dec(_v) for _v in v]
+        return v
+    return dec(json.loads(s))
+
+#-----------------------------------------------------------------------
+
+def save_ckpt(vFP, fi, pHash, row, state, maxSuperseded=10):
+    """ Append a checkpoint to checkpoint file of a video.
+    A checkpoint with the same frame-index and parameter hash
+      supersedes the previous one. When 'maxSuperseded' checkpoints 
+      were superseded, the file is compacted.
+
+    Args:
+        vFP (str): File path of video.
+        fi (int): Frame-index, after processing of which,
+          'state' was taken.
+        pHash (str): Hash of parameters (param_hash).
+        row (tuple): Output data row (strings) of the frame 'fi'.
+        state (dict): State (CVProc.getState).
+        maxSuperseded (int): Number of superseded checkpoints, 
+          at which the file is compacted.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("checkpoint.save_ckpt()")
+
+    hdr = json.dumps(dict(fi=int(fi),
+                          pHash=pHash,
+                          row=[str(v) for v in row])).encode("utf-8")
+    blob = pack_state(state)
+    with open(get_ckpt_fp(vFP), "ab") as f:
+        np.save(f, np.frombuffer(hdr, dtype=np.uint8))
+        np.save(f, np.frombuffer(blob, dtype=np.uint8))
+    hdrs = read_ckpt_headers(vFP)
+    keys = set([(hdr["fi"], hdr["pHash"]) for hdr, __ in hdrs])
+    if len(hdrs) - len(keys) >= maxSuperseded: compact_ckpt(vFP)
+
+#-----------------------------------------------------------------------
+
+def read_ckpt_headers(vFP):
+    """ Read headers of all checkpoints of a video,
+    skipping their state blobs.
+    Headers are read again only when the file changed.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (list): Headers; (header (dict), file position of state blob).
+    """
+    if DEBUG: print("checkpoint.read_ckpt_headers()")
+
+    fp = get_ckpt_fp(vFP)
+    hdrs = []
+    if not path.isfile(fp): return hdrs
+    st = stat(fp)
+    fSz = st.st_size
+    memo = HDR_MEMO.get(fp, None)
+    if memo != None and memo[:2] == (fSz, st.st_mtime_ns): 
+        return list(memo[2])
+    with open(fp, "rb") as f:
+        while f.tell() < fSz:
+            try:
+                hdr = json.loads(np.load(f).tobytes().decode("utf-8"))
+                pos = f.tell()
+                ### skip state blob
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape = np.lib.format.read_array_header_1_0(f)[0]
+                else:
+                    shape = np.lib.format.read_array_header_2_0(f)[0]
+                f.seek(shape[0], 1)
+            except Exception:
+                break # incomplete checkpoint at the end; ignore
+            if f.tell() > fSz: break
+            hdrs.append((hdr, pos))
+    HDR_MEMO[fp] = (fSz, st.st_mtime_ns, list(hdrs))
+    return hdrs
+
+#-----------------------------------------------------------------------
+
+def list_ckpt(vFP, pHash):
+    """ Get frame-indices of checkpoints with the given parameter hash.
+
+    Args:
+        vFP (str): File path of video.
+        pHash (str): Hash of parameters (param_hash).
+
+    Returns:
+        (list): Sorted frame-indices.
+    """
+    if DEBUG: print("checkpoint.list_ckpt()")
+
+    fis = [hdr["fi"] for hdr, __ in read_ckpt_headers(vFP) \
+             if hdr["pHash"] == pHash]
+    return sorted(set(fis))
+
+#-----------------------------------------------------------------------
+
+def load_ckpt(vFP, fi, pHash, row=None):
+    """ Load state of a checkpoint of a frame.
+    When there're multiple checkpoints of the frame,
+      the last written one is used.
+
+    Args:
+        vFP (str): File path of video.
+        fi (int): Frame-index.
+        pHash (str): Hash of parameters (param_hash).
+        row (None/tuple): Output data row (strings) of the frame 'fi'.
+          When it's given, the checkpoint is used only if its row
+          is the same.
+
+    Returns:
+        (None/dict): State. None, when there's no matching checkpoint.
+    """
+    if DEBUG: print("checkpoint.load_ckpt()")
+
+    if row != None: row = [str(v) for v in row]
+    pos = None
+    for hdr, _pos in read_ckpt_headers(vFP):
+        if hdr["fi"] != fi or hdr["pHash"] != pHash: continue
+        if row != None and hdr["row"] != row: continue
+        pos = _pos
+    if pos == None: return None
+    with open(get_ckpt_fp(vFP), "rb") as f:
+        f.seek(pos)
+        blob = np.load(f).tobytes()
+    return unpack_state(blob)
+
+#-----------------------------------------------------------------------
+
+def compact_ckpt(vFP, pHash=None):
+    """ Rewrite checkpoint file of a video with only the last checkpoint
+    of each frame-index and parameter hash.
+    The file is written to a temporary file, then replaced, 
+      so that it's never half-written.
+
+    Args:
+        vFP (str): File path of video.
+        pHash (None/str): When it's given, only checkpoints with 
+          this parameter hash are kept.
+
+    Returns:
+        (int): Number of removed checkpoints.
+    """
+    if DEBUG: print("checkpoint.compact_ckpt()")
+
+    hdrs = read_ckpt_headers(vFP)
+    keep = {} # the last checkpoint of each key; {(fi, pHash): index}
+    for i, (hdr, __) in enumerate(hdrs):
+        if pHash != None and hdr["pHash"] != pHash: continue
+        keep[(hdr["fi"], hdr["pHash"])] = i
+    nRemoved = len(hdrs) - len(keep)
+    if nRemoved == 0: return 0
+    if len(keep) == 0:
+        remove_ckpt(vFP)
+        return nRemoved
+    fp = get_ckpt_fp(vFP)
+    tmpFP = None
+    try:
+        fd, tmpFP = mkstemp(suffix=".tmp", dir=path.dirname(path.abspath(fp)))
+        with open(fp, "rb") as fR, fdopen(fd, "wb") as fW:
+            for i in sorted(keep.values()):
+                hdr, pos = hdrs[i]
+                hdr = json.dumps(hdr).encode("utf-8")
+                fR.seek(pos)
+                blob = np.load(fR)
+                np.save(fW, np.frombuffer(hdr, dtype=np.uint8))
+                np.save(fW, blob)
+        replace(tmpFP, fp)
+    except OSError:
+        if tmpFP != None and path.isfile(tmpFP): remove(tmpFP)
+        return 0
+    return nRemoved
+
+#-----------------------------------------------------------------------
+
+def remove_ckpt(vFP):
+    """ Remove checkpoint file of a video, if it exists.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("checkpoint.remove_ckpt()")
+
+    fp = get_ckpt_fp(vFP)
+    if path.isfile(fp): remove(fp)
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    if len(argv) < 2:
+        print("Usage: python checkpoint.py [video-file-path]")
+    else:
+        for hdr, __ in read_ckpt_headers(argv[1]):
+            print("%i\t%s\t%s"%(hdr["fi"], hdr["pHash"], ", ".join(hdr["row"])))
+
@@ -1,5 +1,7 @@
+import queue
+from multiprocessing import Pool, TimeoutError as MPTimeoutError
 from time import time, sleep
-from copy import copy
+from copy import copy, deepcopy
 from glob import glob
 from random import randint, choice
 
@@ -12,8 +14,14 @@ from scipy.spatial.distance import pdist # Pairwise distances
 
 from fFuncNClasses import get_time_stamp, writeFile
 from fFuncNClasses import calc_pt_line_dist, calc_line_angle, calc_angle_diff
-from fFuncNClasses import calc_pt_w_angle_n_dist
+from fFuncNClasses import calc_pt_w_angle_n_dist, calc_signed_angle_diff
+from fFuncNClasses import convt_360_to_180, parse_int_col
 from fFuncNClasses import load_img, rot_pt, getColorInfo
+from frameCache import open_frame_cache
+from arena import crop_frame
+from checkpoint import param_hash, save_ckpt, load_ckpt, compact_ckpt
+from checkpoint import state_to_json, state_from_json
+from resultCache import ResultCache, row_digest
 
 DEBUG = False 
 
@@ -46,12 +54,490 @@ class CVProc:
                                 (0,255,255), 
                                 (127,127,127), 
                             ] # BGR color for each cluster in clustering
+        ### for Macaque19
+        self.mPanelStableN = 5 # panel rect is cached after this number of 
+          # consecutive detections of similar rects
+        self.mPanelTol = 10 # tolerance (in pixels) of rect coordinates 
+          # to consider two panel rects as similar
+        self.mPanelRevalInterval = 300 # interval (in frames) to re-validate
+          # the cached panel rect
+        self.mHeadWinGrowth = 2.0 # growth rate of head search window, 
+          # when the head color was not found in the window
+        self.mHeadWinMaxSteps = 8 # max. number of searches in growing
+          # head search window, before searching the whole panel area
+        self.mColClasses = ["uCol0", "uCol1", "uCol2", "uCol3", "uCol4"] 
+          # color ranges (parameters of HSV min & max values), which are
+          # classified at once with a lookup table; bit i is i-th class
+        self.colLUT = dict(param=None, lut=None) # lookup table from 
+          # 24-bit BGR color to bits of color classes
+        self.colCls = dict(rect=None, img=None) # color classes of pixels
+          # of the current frame, classified in 'rect'
+        ### for confidence of head direction ('hDConf' column)
+        self.confDegTh = 90 # change of head direction (in degrees) 
+          # between frames, where confidence becomes zero;
+          # used when 'uDegTh' is not a parameter of the case
+        self.confFaceAreaR = 0.05 # ratio of face color area to head area,
+          # below which confidence decreases (Macaque19)
+        self.bgSub = BGSubtractor() # background subtraction pipeline
+        self.parallelCases = ['Marmoset04', 'Rat05'] # cases, of which
+          # candidates can be extracted from a frame without data of 
+          # other frames (extractCandidates)
+        self.preCand = {} # candidates, extracted beforehand 
+          # (such as in worker processes); {frame-index: candidates}
+        ### for tracking with optical flow between full detections
+        self.lkParam = dict(
+                        winSize=(15, 15),
+                        maxLevel=3,
+                        criteria=(cv2.TERM_CRITERIA_EPS | \
+                                    cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+                        ) # parameters of cv2.calcOpticalFlowPyrLK
+        self.lkFeatParam = dict(
+                        maxCorners=20,
+                        qualityLevel=0.01,
+                        minDistance=5,
+                        ) # parameters of cv2.goodFeaturesToTrack
+        self.lkFBErrTh = 1.0 # threshold of forward-backward error 
+          # (in pixels) of a tracked feature point
+        self.lkROIMargin = 64 # margin (in pixels) of region of interest 
+          # around feature points for motion until the next frame
+        self.last_motion_frame = None # the last frame image, 
+          # where motion was detected
+        self.lmFI = -2 # frame-index of 'last_motion_frame'; 
+          # None when it's unknown
+        ### for result cache
+        self.rCache = None # result cache of the current video 
+          # (resultCache.ResultCache); None means not using it
+        self.rcIgnoredParams = ["uAdaptStep", 
+                                "adaptDegTh", 
+                                "adaptMinConf"] # parameters, which don't
+          # change result of a frame with given data of its previous frame
+        self.rcPKey = None # (frame-index, key of result cache) of 
+          # the frame being processed; key is a digest of data of 
+          # the previous frame and tracker state before the frame
+        self.pHashMemo = dict(key=None, bg=None, hash=None) # the last 
+          # calculated parameter hash
+        self.ckptPHash = None # parameter hash of the last written 
+          # checkpoint
+        self.resetState()
         #self.storage = {} # storage for previsouly calculated parameters 
         #  or temporary frame image sotrage, etc...
         ##### [end] setting up attributes -----
 
     #-------------------------------------------------------------------
     
+    def resetState(self):
+        """ Reset states, kept over frames of a video. 
+        Should be called when a new video is loaded.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("CVProc.resetState()")
+
+        self.resetPanelState()
+        self.hdf = dict(
+                        fi=-2, # frame index of the current state
+                        hD=None, # filtered head direction
+                        vel=0.0, # change rate of head direction 
+                        bPos=None, # filtered base position (x, y)
+                        bVel=(0.0, 0.0), # change rate of base position
+                        nMiss=0, # number of consecutive frames, where
+                          # measurement was missing or rejected
+                       ) # state of temporal head direction filter
+        self.lkt = dict(
+                        fi=-2, # frame index of the current state
+                        detFI=-2, # frame index of the last full detection
+                        roi=None, # region of interest (x1, y1, x2, y2)
+                        grey=None, # greyscale image of 'roi' 
+                          # of the frame 'fi'
+                        greyFI=-2, # frame-index of the frame of 'grey'
+                        pts=None, # feature points to track
+                        nInit=0, # number of feature points at detection
+                        bh=None, # base and head position (float) 
+                        out=None, # data (hD, bPos, hPos) of the frame 'fi' 
+                       ) # state of optical flow tracking
+
+    #-------------------------------------------------------------------
+    
+    def resetPanelState(self):
+        """ Reset cached panel area of Macaque19.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("CVProc.resetPanelState()")
+
+        self.mPanel = dict(
+                            rect=None, # cached panel rect (x1, y1, x2, y2)
+                            fi=-1, # frame index where the rect was validated
+                            nStable=0, # number of consecutive detections
+                              # of similar rects
+                            param=None, # parameters used for detection
+                          ) # panel area of Macaque19
+
+    #-------------------------------------------------------------------
+    
+    def getState(self):
+        """ Get a copy of states, kept over frames of a video.
+
+        Args: None
+
+        Returns:
+            (dict): States.
+        """
+        if DEBUG: print("CVProc.getState()")
+
+        lmFrame = self.last_motion_frame
+        if type(lmFrame) == np.ndarray: lmFrame = lmFrame.copy()
+        return dict(lmFrame=lmFrame,
+                    lmFI=self.lmFI,
+                    mPanel=deepcopy(self.mPanel),
+                    hdf=deepcopy(self.hdf),
+                    lkt=deepcopy(self.lkt))
+
+    #-------------------------------------------------------------------
+    
+    def setState(self, state):
+        """ Set states, kept over frames of a video, with a state 
+        from getState (or a checkpoint).
+
+        Args:
+            state (dict): States.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.setState()")
+
+        self.resetState()
+        self.last_motion_frame = state["lmFrame"]
+        self.lmFI = state.get("lmFI", None)
+        ### update with stored items 
+        ###   (kept state might have fewer items than the current one)
+        for k in ["mPanel", "hdf", "lkt"]:
+            getattr(self, k).update(deepcopy(state[k]))
+
+    #-------------------------------------------------------------------
+    
+    def getCompactState(self):
+        """ Get states, kept over frames of a video, as JSON text 
+        without images; an image is represented by index of 
+        the frame, from which it was taken.
+
+        Args: None
+
+        Returns:
+            (None/str): JSON text. None, when frame-index of 
+              the last motion frame is unknown.
+        """
+        if DEBUG: print("CVProc.getCompactState()")
+
+        if self.lmFI == None: return None
+        lkt = dict([(k, self.lkt[k]) for k in self.lkt.keys() if k != "grey"])
+        return state_to_json(dict(lmFI=self.lmFI,
+                                  mPanel=self.mPanel,
+                                  hdf=self.hdf,
+                                  lkt=lkt))
+
+    #-------------------------------------------------------------------
+    
+    def setCompactState(self, s, frame_arr):
+        """ Set states with JSON text from getCompactState, which was
+        taken after processing the current frame. 
+        Images, which were taken from the current frame, are taken 
+          from 'frame_arr' again. Other images are kept, 
+          therefore states before the current frame should be
+          the same as the ones, when 's' was taken.
+
+        Args:
+            s (str): JSON text.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.setCompactState()")
+
+        fi = self.p.vRW.fi
+        st = state_from_json(s)
+        if st["lmFI"] == fi and self.lmFI != fi:
+            self.last_motion_frame = frame_arr.copy()
+        self.lmFI = st["lmFI"]
+        self.mPanel.update(st["mPanel"])
+        self.hdf.update(st["hdf"])
+        greyFI = self.lkt["greyFI"]
+        self.lkt.update(st["lkt"])
+        if self.lkt["greyFI"] == fi and greyFI != fi:
+            roi = self.lkt["roi"]
+            self.lkt["grey"] = cv2.cvtColor(
+                                    frame_arr[roi[1]:roi[3], roi[0]:roi[2]],
+                                    cv2.COLOR_BGR2GRAY)
+
+    #-------------------------------------------------------------------
+    
+    def getParamHash(self, ignored=[]):
+        """ Get hash of the current parameters, which determine 
+        analysis results, to match checkpoints of tracker state 
+        or cached results.
+        The hash is re-calculated only when parameters changed.
+
+        Args:
+            ignored (list): Parameters to leave out of the hash.
+
+        Returns:
+            (str): Hash string.
+        """
+        if DEBUG: print("CVProc.getParamHash()")
+
+        p = self.p # parent
+        aecParam = dict([(k, p.aecParam[k]) for k in p.aecParam.keys() \
+                           if not k in ignored])
+        arena = p.vRW.arena
+        if arena != None: arena = (arena["rect"], arena["poly"])
+        key = repr((p.animalECase, 
+                    sorted([(k, aecParam[k]["value"]) for k in aecParam]), 
+                    arena))
+        memo = self.pHashMemo
+        if memo["key"] != key or memo["bg"] is not self.bg:
+            memo["key"] = key
+            memo["bg"] = self.bg
+            memo["hash"] = param_hash(p.animalECase, 
+                                      aecParam, 
+                                      p.vRW.arena, 
+                                      self.bg)
+        return memo["hash"]
+
+    #-------------------------------------------------------------------
+    
+    def saveCheckpoint(self, vFP):
+        """ Write checkpoint of tracker state after processing 
+        the current frame.
+        When parameters changed since the last written checkpoint,
+          checkpoints of other parameters are cleared first.
+
+        Args:
+            vFP (str): File path of video.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.saveCheckpoint()")
+
+        p = self.p # parent
+        pHash = self.getParamHash()
+        if pHash != self.ckptPHash:
+            compact_ckpt(vFP, pHash)
+            self.ckptPHash = pHash
+        save_ckpt(vFP, 
+                  p.vRW.fi, 
+                  pHash, 
+                  tuple(p.oData[p.vRW.fi]), 
+                  self.getState())
+
+    #-------------------------------------------------------------------
+    
+    def loadCheckpoint(self, vFP, fi):
+        """ Restore tracker state from checkpoint of a frame, 
+        so that processing of the next frame gives the same result 
+        as an uninterrupted run.
+        The checkpoint is used only when the current parameters and 
+          output data of the frame are the same as the ones 
+          at the checkpoint.
+
+        Args:
+            vFP (str): File path of video.
+            fi (int): Frame-index of checkpoint.
+
+        Returns:
+            (bool): Whether state was restored.
+        """
+        if DEBUG: print("CVProc.loadCheckpoint()")
+
+        p = self.p # parent
+        if fi < 0: return False
+        state = load_ckpt(vFP, fi, self.getParamHash(), tuple(p.oData[fi]))
+        if state == None: return False
+        self.setState(state)
+        return True
+
+    #-------------------------------------------------------------------
+    
+    def getXDict(self, mInput=None, pFI=None):
+        """ Make a temporary dictionary to store values for processing
+        the current frame, with data of the current and previous frame
+        in the parent's output data (oData).
+        
+        Args:
+            mInput (None/dict): Manual user input such as 
+              mouse click & drag.
+            pFI (None/int): Frame-index of the frame to refer to 
+              as the previous frame. None means (current frame-index - 1).
+
+        Returns:
+            x (dict): temporary data to process such as hD, hPos, etc..
+            flagMHPos (bool): Whether manual input was given.
+        """
+        if DEBUG: print("CVProc.getXDict()")
+
+        p = self.p # parent
+        fi = p.vRW.fi
+        if pFI == None: pFI = fi-1
+        x = {} # temp. dictionary
+        flagMHPos = False 
+        for dIdx, dCol in enumerate(p.dataCols):
+            if mInput != None and dCol in mInput.keys():
+            # manual input is given (in coordinates of the frame image)
+                x[dCol] = mInput[dCol]
+                flagMHPos = True
+            elif p.oData[fi][dIdx] != 'None':
+            # already calculated data available
+                x[dCol] = self.arenaCoord(dCol, p.oData[fi][dIdx])
+            else:
+                x[dCol] = p.dataInitVal[dIdx]
+            ### convert value to integer if applicable
+            try: x[dCol] = int(x[dCol])
+            except: pass
+            ### data from previous frame
+            pk = "p_" + dCol
+            if pFI < 0:
+                x[pk] = p.dataInitVal[dIdx] 
+            else:
+                x[pk] = self.arenaCoord(dCol, p.oData[pFI][dIdx])
+        return x, flagMHPos
+
+    #-------------------------------------------------------------------
+    
+    def arenaCoord(self, col, val, toArena=True):
+        """ Convert a value of output data (oData) to an integer 
+        if applicable, and translate it between coordinates of 
+        full frame (stored in oData) and frame cropped to arena,
+        when it's a position column (such as hPosX).
+
+        Args:
+            col (str): Data column.
+            val (str/int): Value.
+            toArena (bool): True to translate from full frame to arena,
+              False for the opposite direction.
+
+        Returns:
+            val (str/int): Converted value.
+        """
+        if DEBUG: print("CVProc.arenaCoord()")
+
+        if not val in ['None', 'D', 'True', 'False']:
+            try: val = int(val)
+            except: pass
+        arena = self.p.vRW.arena
+        if arena == None or type(val) != int: return val
+        sign = -1 if toArena else 1
+        if 'PosX' in col: val += sign * arena["offset"][0]
+        elif 'PosY' in col: val += sign * arena["offset"][1]
+        return val
+
+    #-------------------------------------------------------------------
+    
+    def getODataRow(self, x):
+        """ Get a row of output data (oData) from processed data 'x',
+        with positions in coordinates of full frame.
+
+        Args:
+            x (dict): Processed data (such as returned by proc_img).
+
+        Returns:
+            (tuple): Row of output data.
+        """
+        if DEBUG: print("CVProc.getODataRow()")
+
+        dCols = self.p.dataCols
+        return tuple([str(self.arenaCoord(c, x[c], False)) for c in dCols])
+
+    #-------------------------------------------------------------------
+    
+    def getCachedResult(self, x, frame_arr):
+        """ Fill data of the current frame with its result in result cache,
+        when there's a result with the same parameters, the same data
+        of the previous frame and the same tracker state before 
+        the frame.
+        Tracker state is updated with the state after the frame,
+          stored with the result, so that the following frames give 
+          the same results as an uninterrupted run without the cache.
+
+        Args:
+            x (dict): temporary data of the current frame.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            (bool): Whether the result was served from the cache.
+        """
+        if DEBUG: print("CVProc.getCachedResult()")
+
+        self.rcPKey = None
+        if self.rCache == None: return False
+        p = self.p # parent
+        fi = p.vRW.fi
+        state = self.getCompactState()
+        if state == None: return False
+        pKey = row_digest([x["p_"+col] for col in p.dataCols] + [state])
+        self.rcPKey = (fi, pKey)
+        ret = self.rCache.get(p.animalECase, 
+                              self.getParamHash(self.rcIgnoredParams),
+                              fi,
+                              pKey)
+        if ret == None: return False
+        row, state = ret
+        for dIdx, dCol in enumerate(p.dataCols):
+            x[dCol] = self.arenaCoord(dCol, row[dIdx])
+        self.setCompactState(state, frame_arr)
+        return True
+
+    #-------------------------------------------------------------------
+    
+    def putCachedResult(self, x):
+        """ Store result of the current frame in result cache,
+        with tracker state after the frame.
+
+        Args:
+            x (dict): processed data of the current frame.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.putCachedResult()")
+
+        if self.rCache == None: return
+        p = self.p # parent
+        if self.rcPKey == None or self.rcPKey[0] != p.vRW.fi: return
+        state = self.getCompactState()
+        if state == None: return
+        self.rCache.put(p.animalECase, 
+                        self.getParamHash(self.rcIgnoredParams),
+                        p.vRW.fi,
+                        self.rcPKey[1],
+                        self.getODataRow(x),
+                        state)
+
+    #-------------------------------------------------------------------
+    
+    def getFullFrameH(self, frame_arr):
+        """ Get height of full frame, of which 'frame_arr' might be 
+        a cropped (to arena) image.
+
+        Args:
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            (int): Height of full frame.
+        """
+        if DEBUG: print("CVProc.getFullFrameH()")
+
+        arena = self.p.vRW.arena
+        if arena == None: return frame_arr.shape[0]
+        return arena["fSz"][1]
+
+    #-------------------------------------------------------------------
+    
     def proc_img(self, frame_arr, animalECase, 
                  x, flagMHPos=False, imgType='RGB-image'):
         """ Process frame image to code animal position/direction/behaviour
@@ -90,6 +576,7 @@ class CVProc:
             # calculate head direction
             x["hD"] = calc_line_angle((x["bPosX"],x["bPosY"]), 
                                       (x["hPosX"],x["hPosY"])) 
+            self.setHDConf(x, 1.0)
             if 'bD' in x.keys(): # body direction
             # Currently, user interface doesn't allow body direction 
             # to be manually marked and given to this function.
@@ -129,26 +616,41 @@ class CVProc:
                 pk = "p_" + k
                 x[k] = x[pk] 
         
+        elif self.getCachedResult(x, frame_arr):
+        # result of this frame (with the same data of the previous frame)
+        #   was served from result cache
+            pass
+
         else:
         # else
-            if p.vRW.fi > 0:
+            # no frame to compare with (the 1st frame, or 
+            #   the last motion frame is not available)
+            isFirst = p.vRW.fi == 0 or self.last_motion_frame is None
+            if not isFirst:
                 ### motion detection
                 ###   with difference between the current and last motion frame
                 m_diff = cv2.absdiff(frame_arr, self.last_motion_frame)
                 m_diff = cv2.cvtColor(m_diff, cv2.COLOR_BGR2GRAY)
                 m_val = np.sqrt(np.sum(m_diff)/255)
                 m_val_min, m_val_max = ecp["motionTh"]["value"]
-            if (p.vRW.fi == 0) or (m_val_min <= m_val < m_val_max):
+            if isFirst or (m_val_min <= m_val < m_val_max):
             # 1st frame or motion detected
                 self.last_motion_frame = frame_arr.copy()
+                self.lmFI = p.vRW.fi
+                if self.isLKTrackOn() and self.trackLK(x, frame_arr):
+                # head was tracked from the previous frame
+                    pass
                 ### process the current frame, using computer vision algorithms
-                if animalECase == 'Marmoset04':
+                elif animalECase == 'Marmoset04':
                     if not isBGMissing: 
                         x, diff = self.proc_marmoset04(x, frame_arr)
                 elif animalECase == 'Macaque19':
                     x, frame_arr, diff = self.proc_macaque19(x, frame_arr)
                 elif animalECase == 'Rat05':
                     x, diff, frame_arr = self.proc_rat05(x, frame_arr)
+                if self.isLKTrackOn() and self.lkt["fi"] != p.vRW.fi:
+                # full detection was done; start tracking from this frame
+                    self.initLKTrack(x, frame_arr)
                 '''
                 elif animalECase == 'Dove19':
                     x = self.proc_dove19(frame_arr, diff)
@@ -162,6 +664,14 @@ class CVProc:
                         if k.startswith("p_"): continue
                         pk = "p_" + k
                         x[k] = x[pk] 
+                    if m_val >= m_val_max:
+                    # too much change (such as lighting change) 
+                    #   rather than no motion; copied data is suspicious
+                        self.setHDConf(x, 0.0)
+                    elif self.lkt["fi"] == p.vRW.fi-1:
+                    # no motion; tracking can continue from this frame
+                        self.lkt["fi"] = p.vRW.fi
+            if not isBGMissing: self.putCachedResult(x)
         ##### [end] calculate data of the current frame ---
      
         if imgType == 'Greyscale(Diff)' and type(diff) == np.ndarray:
@@ -213,22 +723,463 @@ class CVProc:
             # write a frame of analysis video recording
             self.p.vRW.writeFrame(frame_arr)
 
-        return x, frame_arr 
-   
+        return x, frame_arr 
+   
+    #-------------------------------------------------------------------
+    
+    def extractCandidates(self, animalECase, frame_arr):
+        """ Extract candidates from a frame, without referring to data of
+        other frames, for cases in self.parallelCases.
+        Candidates are stored in self.preCand of CVProc, which processes
+          frames sequentially, to be resolved with data of 
+          the previous frame.
+
+        Args:
+            animalECase (str): Animal experiment case.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            (None/dict): Candidates.
+        """
+        if DEBUG: print("CVProc.extractCandidates()")
+
+        if animalECase == 'Marmoset04':
+            cand, __ = self.extract_marmoset04(frame_arr)
+        elif animalECase == 'Rat05':
+            cand, __ = self.extract_rat05(frame_arr)
+        return cand
+
+    #-------------------------------------------------------------------
+    
+    def isHDFilterOn(self):
+        """ Whether temporal head direction filter is used.
+
+        Args: None
+
+        Returns:
+            (bool): Whether the filter is used.
+        """
+        if DEBUG: print("CVProc.isHDFilterOn()")
+
+        ecp = self.p.aecParam
+        return "uHDFilter" in ecp.keys() and ecp["uHDFilter"]["value"] == 1
+
+    #-------------------------------------------------------------------
+    
+    def isLKTrackOn(self):
+        """ Whether tracking with optical flow between full detections 
+        is used.
+
+        Args: None
+
+        Returns:
+            (bool): Whether the tracking is used.
+        """
+        if DEBUG: print("CVProc.isLKTrackOn()")
+
+        ecp = self.p.aecParam
+        return "uLKTrack" in ecp.keys() and ecp["uLKTrack"]["value"] == 1
+
+    #-------------------------------------------------------------------
+    
+    def initLKTrack(self, x, frame_arr):
+        """ Start optical flow tracking with feature points around 
+        head and base position, found by full detection.
+        Tracking doesn't start, when the detection failed or 
+          its confidence is lower than 'lkMinConf'.
+
+        Args:
+            x (dict): temporary data of the current frame.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.initLKTrack()")
+
+        ecp = self.p.aecParam
+        st = self.lkt
+        st["fi"] = self.p.vRW.fi
+        st["detFI"] = self.p.vRW.fi
+        st["pts"] = None
+        for k in ["hD", "hPosX", "bPosX"]:
+            if type(x[k]) != int: return
+        if "hDConf" in x.keys():
+            try: conf = float(x["hDConf"])
+            except: conf = 0.0
+            if conf < ecp["lkMinConf"]["value"]: return
+        bh = np.array([[x["bPosX"], x["bPosY"]], 
+                       [x["hPosX"], x["hPosY"]]], dtype=np.float64)
+        ### find feature points in a circle, 
+        ###   which contains head and base position
+        ct = np.mean(bh, axis=0)
+        r = max(ecp["hdLineLen"]["value"], np.sqrt(np.sum((bh[1]-bh[0])**2)))
+        roi = self.getLKROI(np.array([ct-r, ct+r]), frame_arr.shape)
+        grey = cv2.cvtColor(frame_arr[roi[1]:roi[3], roi[0]:roi[2]], 
+                            cv2.COLOR_BGR2GRAY)
+        mask = np.zeros(grey.shape, dtype=np.uint8)
+        cv2.circle(mask, (int(ct[0])-roi[0], int(ct[1])-roi[1]), int(r), 
+                   255, -1)
+        pts = cv2.goodFeaturesToTrack(grey, mask=mask, **self.lkFeatParam)
+        if pts is None or len(pts) < 3: return
+        pts += np.array(roi[:2], dtype=np.float32) # to frame coordinates
+        st["pts"] = pts
+        st["nInit"] = len(pts)
+        st["bh"] = bh
+        st["out"] = self.getLKOutput(x)
+        self.storeLKROI(frame_arr)
+
+    #-------------------------------------------------------------------
+    
+    def getLKROI(self, pts, shape):
+        """ Get region of interest (rect) for optical flow tracking,
+        which contains the given points with margin for motion 
+        in the next frame.
+
+        Args:
+            pts (numpy.ndarray): Points (x, y) in frame image.
+            shape (tuple): Shape of frame image.
+
+        Returns:
+            (tuple): x1, y1, x2, y2 of region of interest.
+        """
+        if DEBUG: print("CVProc.getLKROI()")
+
+        pts = pts.reshape((-1, 2))
+        mg = self.lkROIMargin
+        x1 = int(max(0, np.floor(np.min(pts[:,0]))-mg))
+        y1 = int(max(0, np.floor(np.min(pts[:,1]))-mg))
+        x2 = int(min(shape[1], np.ceil(np.max(pts[:,0]))+mg+1))
+        y2 = int(min(shape[0], np.ceil(np.max(pts[:,1]))+mg+1))
+        return (x1, y1, x2, y2)
+    
+    #-------------------------------------------------------------------
+    
+    def storeLKROI(self, frame_arr):
+        """ Store greyscale image of region of interest around the current 
+        feature points, to track them in the next frame.
+
+        Args:
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.storeLKROI()")
+
+        st = self.lkt
+        roi = self.getLKROI(np.vstack((st["pts"].reshape((-1,2)), st["bh"])), 
+                            frame_arr.shape)
+        st["roi"] = roi
+        st["grey"] = cv2.cvtColor(frame_arr[roi[1]:roi[3], roi[0]:roi[2]], 
+                                  cv2.COLOR_BGR2GRAY)
+        st["greyFI"] = self.p.vRW.fi
+
+    #-------------------------------------------------------------------
+    
+    def getLKOutput(self, x):
+        """ Get data of a frame, which tracking state refers to.
+
+        Args:
+            x (dict): temporary data of a frame.
+
+        Returns:
+            (tuple): head direction, base and head position.
+        """
+        if DEBUG: print("CVProc.getLKOutput()")
+
+        return tuple([x[k] for k in ["hD", "bPosX", "bPosY", 
+                                     "hPosX", "hPosY"]])
+
+    #-------------------------------------------------------------------
+    
+    def trackLK(self, x, frame_arr):
+        """ Move head and base position of the previous frame with 
+        pyramidal Lucas-Kanade optical flow of feature points around
+        the head, instead of full detection.
+        Only region of interest around the feature points is processed.
+        Tracking fails (then, full detection should be done), when 
+          tracking state of the previous frame is not available, 
+          'lkInterval' frames passed since the last full detection, or 
+          confidence (ratio of feature points, which still move 
+          consistently) became lower than 'lkMinConf'.
+
+        Args:
+            x (dict): temporary data of the current frame.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            (bool): Whether tracking succeeded. 
+        """
+        if DEBUG: print("CVProc.trackLK()")
+
+        ecp = self.p.aecParam
+        st = self.lkt
+        fi = self.p.vRW.fi
+        if st["fi"] != fi-1 or st["pts"] is None: return False
+        if fi-st["detFI"] >= ecp["lkInterval"]["value"]: return False
+        pOut = tuple([x["p_"+k] for k in ["hD", "bPosX", "bPosY", 
+                                          "hPosX", "hPosY"]])
+        if pOut != st["out"]: return False # data of the previous frame
+          # was changed (such as manual input)
+        
+        roi = st["roi"]
+        org = np.array(roi[:2], dtype=np.float32) # origin of the ROI
+        grey = cv2.cvtColor(frame_arr[roi[1]:roi[3], roi[0]:roi[2]], 
+                            cv2.COLOR_BGR2GRAY)
+        pts0 = st["pts"] - org
+        pts1, status, __ = cv2.calcOpticalFlowPyrLK(st["grey"], grey, pts0, 
+                                                    None, **self.lkParam)
+        ### track back to the previous frame 
+        ###   to drop points, which were not tracked reliably
+        bPts, bStatus, __ = cv2.calcOpticalFlowPyrLK(grey, st["grey"], pts1,
+                                                     None, **self.lkParam)
+        fbErr = np.sqrt(np.sum((bPts-pts0).reshape((-1,2))**2, axis=1))
+        isGood = (status.ravel() == 1) & (bStatus.ravel() == 1) & \
+                   (fbErr < self.lkFBErrTh)
+        st["pts"] = None
+        if np.sum(isGood) < 3: return False
+        ### estimate motion (rotation, translation and scale) of the head
+        m, inliers = cv2.estimateAffinePartial2D(pts0[isGood], pts1[isGood])
+        if m is None: return False
+        inliers = inliers.ravel() == 1
+        conf = np.sum(inliers) / float(st["nInit"])
+        if conf < ecp["lkMinConf"]["value"]: return False
+        
+        ### move head and base position 
+        ###   (kept in float, so that rounding errors don't accumulate)
+        bh = st["bh"] - org
+        st["bh"] = bh.dot(m[:,:2].T) + m[:,2] + org
+        bh = np.round(st["bh"]).astype(int)
+        x["bPosX"], x["bPosY"] = int(bh[0,0]), int(bh[0,1])
+        x["hPosX"], x["hPosY"] = int(bh[1,0]), int(bh[1,1])
+        x["hD"] = calc_line_angle(st["bh"][0], st["bh"][1])
+        if self.isHDFilterOn(): x = self.filterHD(x, x["hD"], conf)
+        else: self.setHDConf(x, conf)
+        
+        st["fi"] = fi
+        st["pts"] = pts1[isGood][inliers] + org
+        st["out"] = self.getLKOutput(x)
+        self.storeLKROI(frame_arr)
+        return True
+
+    #-------------------------------------------------------------------
+    
+    def setHDConf(self, x, conf):
+        """ Store confidence of head direction of the current frame 
+        in 'hDConf', when the case has the column.
+
+        Args:
+            x (dict): temporary data of the current frame.
+            conf (float): Confidence; clipped to 0.0 - 1.0.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.setHDConf()")
+
+        if "hDConf" in x.keys():
+            x["hDConf"] = "%.2f"%(min(1.0, max(0.0, conf)))
+
+    #-------------------------------------------------------------------
+    
+    def calcJumpConf(self, pHD, hD):
+        """ Confidence factor from change of head direction 
+        between the previous and the current frame.
+        It's 1.0 without change, and 0.0 when the change reaches 
+          'uDegTh' (or 'confDegTh', when the case doesn't have 'uDegTh').
+
+        Args:
+            pHD (int/str): Head direction of the previous frame.
+            hD (int/str): Head direction of the current frame.
+
+        Returns:
+            (float): Confidence factor.
+        """
+        if DEBUG: print("CVProc.calcJumpConf()")
+
+        if type(pHD) != int or type(hD) != int: return 1.0
+        ecp = self.p.aecParam
+        if "uDegTh" in ecp.keys(): degTh = float(ecp["uDegTh"]["value"])
+        else: degTh = float(self.confDegTh)
+        return max(0.0, 1.0 - calc_angle_diff(pHD, hD)/degTh)
+
+    #-------------------------------------------------------------------
+    
+    def predictHD(self, x):
+        """ Predict head direction of the current frame.
+
+        Args:
+            x (dict): temporary data of the current frame.
+
+        Returns:
+            (None/float): Predicted head direction.
+        """
+        if DEBUG: print("CVProc.predictHD()")
+
+        st = self.hdf
+        if st["fi"] == self.p.vRW.fi-1 and st["hD"] != None:
+        # filter state of the previous frame is available
+            return convt_360_to_180((st["hD"]+st["vel"]) % 360)
+        elif type(x["p_hD"]) == int:
+            return x["p_hD"]
+        return None
+
+    #-------------------------------------------------------------------
+    
+    def filterHD(self, x, z, zConf=1.0):
+        """ Temporal filter (circular alpha-beta filter) of head direction 
+        and base position, which costs O(1) per frame.
+        A measurement is accepted when it's within the gate (uDegTh) 
+          from the predicted head direction. The gate widens with each 
+          consecutive missing/rejected measurement, so that tracking 
+          doesn't stay locked to a wrong direction.
+        Confidence (0.0 - 1.0) is stored in 'hDConf'; the lower one of 
+          the measurement confidence and the filter confidence.
+        
+        Args:
+            x (dict): temporary data of the current frame.
+            z (None/int): Measured head direction. 
+              None, when it was not measured in this frame.
+            zConf (float): Confidence of the measurement.
+        
+        Returns:
+            x (dict): received 'x' dictionary, with filtered data.
+        """
+        if DEBUG: print("CVProc.filterHD()")
+
+        ecp = self.p.aecParam
+        alpha = ecp["hdfAlpha"]["value"]
+        beta = ecp["hdfBeta"]["value"]
+        fi = self.p.vRW.fi
+        st = self.hdf
+        if type(x["bPosX"]) == int: zB = (x["bPosX"], x["bPosY"])
+        else: zB = None # measured base position
+        
+        if st["fi"] != fi-1 or st["hD"] == None:
+        # filter state of the previous frame is not available
+            st["vel"] = 0.0
+            st["bVel"] = (0.0, 0.0)
+            st["nMiss"] = 0
+            if type(x["p_hD"]) == int:
+            # init with data of the previous frame
+                st["hD"] = float(x["p_hD"])
+                if type(x["p_bPosX"]) == int:
+                    st["bPos"] = (float(x["p_bPosX"]), float(x["p_bPosY"]))
+                else:
+                    st["bPos"] = None
+            elif z != None:
+            # init with the measurement; no filter confidence yet
+                st["hD"] = float(z)
+                if zB != None: st["bPos"] = (float(zB[0]), float(zB[1]))
+                else: st["bPos"] = None
+                st["fi"] = fi
+                self.setHDConf(x, zConf)
+                return x
+            else:
+                st["fi"] = fi
+                st["hD"] = None
+                self.setHDConf(x, 0.0)
+                return x
+        
+        ### predict
+        pred = st["hD"] + st["vel"]
+        if st["bPos"] != None:
+            bPred = (st["bPos"][0]+st["bVel"][0], st["bPos"][1]+st["bVel"][1])
+        else:
+            bPred = zB
+        gate0 = ecp["uDegTh"]["value"]
+        gate = min(180, gate0 * (1+st["nMiss"]))
+        
+        ### update
+        if z != None: r = calc_signed_angle_diff(pred, z) # residual
+        if z != None and abs(r) <= gate:
+        # measurement is accepted
+            st["hD"] = pred + alpha*r
+            st["vel"] += beta*r
+            st["nMiss"] = 0
+            # confidence, which is lower, when the gate was widened
+            conf = (1.0 - abs(r)/float(gate)) * (gate0/float(gate))
+            conf = min(conf, zConf)
+            if zB != None and bPred != None:
+                rb = (zB[0]-bPred[0], zB[1]-bPred[1])
+                st["bPos"] = (bPred[0]+alpha*rb[0], bPred[1]+alpha*rb[1])
+                st["bVel"] = (st["bVel"][0]+beta*rb[0], 
+                              st["bVel"][1]+beta*rb[1])
+            else:
+                st["bPos"] = bPred
+        else:
+        # measurement is missing or rejected; keep the prediction
+            st["hD"] = pred
+            st["vel"] *= 0.5
+            st["nMiss"] += 1
+            conf = 0.0
+            st["bPos"] = bPred
+            st["bVel"] = (st["bVel"][0]*0.5, st["bVel"][1]*0.5)
+        st["hD"] = convt_360_to_180(st["hD"] % 360)
+        st["fi"] = fi
+        
+        ### store filtered data
+        if type(x["hPosX"]) == int and zB != None:
+            # keep the measured distance between head and base position
+            dist = np.sqrt((x["hPosX"]-zB[0])**2 + (x["hPosY"]-zB[1])**2)
+        else:
+            dist = ecp["hdLineLen"]["value"]
+        x["hD"] = convt_360_to_180(int(np.round(st["hD"])) % 360)
+        if st["bPos"] != None:
+            x["bPosX"] = int(np.round(st["bPos"][0]))
+            x["bPosY"] = int(np.round(st["bPos"][1]))
+            x["hPosX"], x["hPosY"] = calc_pt_w_angle_n_dist(x["hD"], 
+                                                            dist, 
+                                                            x["bPosX"], 
+                                                            x["bPosY"], 
+                                                            True)
+        self.setHDConf(x, conf)
+        return x
+
+    #-------------------------------------------------------------------
+    
+    def proc_marmoset04(self, x, frame_arr):
+        """ Calculate head direction of a common marmoset monkey
+        
+        Args:
+            x (dict): dictionary to retrieve/store calculated data
+            frame_arr (numpy.ndarray): Frame image array.
+        
+        Returns:
+            x (dict): received 'x' dictionary, but with calculated data.
+            diff (None/numpy.ndarray): grey image after background 
+              subtraction. None, when candidates were extracted beforehand.
+        """
+        if DEBUG: print("CVProc.proc_marmoset04()")
+
+        fi = self.p.vRW.fi
+        if fi in self.preCand.keys():
+            cand = self.preCand.pop(fi)
+            diff = None
+        else:
+            cand, diff = self.extract_marmoset04(frame_arr)
+        x = self.resolve_marmoset04(x, cand)
+        return x, diff
+
     #-------------------------------------------------------------------
     
-    def proc_marmoset04(self, x, frame_arr):
-        """ Calculate head direction of a common marmoset monkey
+    def extract_marmoset04(self, frame_arr):
+        """ Extract candidates of head direction of a common marmoset 
+        monkey from a frame, without referring to data of other frames
+        (therefore, this can run on frames in parallel).
         
         Args:
-            x (dict): dictionary to retrieve/store calculated data
             frame_arr (numpy.ndarray): Frame image array.
         
         Returns:
-            x (dict): received 'x' dictionary, but with calculated data.
+            cand (None/dict): Candidates; None when ears were not found.
+              'bPos': middle point between ears, 
+              'hDs': two possible head directions,
+              'conf': confidence from sizes of ear contours.
             diff (numpy.ndarray): grey image after background subtraction.
         """
-        if DEBUG: print("CVProc.proc_marmoset04()")
+        if DEBUG: print("CVProc.extract_marmoset04()")
 
         diffCol, diff = self.procBGSubtraction(frame_arr, self.bg)
         edged = self.getEdged(diff)
@@ -236,6 +1187,7 @@ class CVProc:
        
         # center points of left and right ear
         lEar = [-1, -1]; rEar = [-1, -1] 
+        conf = 0.0 # confidence of head direction
         # sort contours by size (largest first)
         cnt_info = sorted(cnt_info, reverse=True)
         if len(cnt_info) >= 2:
@@ -243,6 +1195,12 @@ class CVProc:
             ### consider two largest contours as contours of ears
             lEar = (cnt_info[0][1], cnt_info[0][2]) 
             rEar = (cnt_info[1][1], cnt_info[1][2])
+            ### confidence is lower, when the 3rd largest contour is 
+            ###   similar in size to the ear contours (ambiguous ears)
+            if len(cnt_info) >= 3:
+                conf = 1.0 - float(cnt_info[2][0])/cnt_info[1][0]
+            else:
+                conf = 1.0
             ### determine left/right ear
             # left ear means it's positioned closer to left side of screen
             if lEar[0] > rEar[0]:
@@ -250,32 +1208,63 @@ class CVProc:
                 rEar = copy(lEar)
                 lEar = tmp
 
-        if lEar != [-1, -1]:
+        if lEar == [-1, -1]: return None, diff
         # contours considered to be ears are found
-            # calculate angle of a line connecting two ears
-            e_ang = calc_line_angle(lEar, rEar)
-            
-            ### calculate bPos as a middle point between two ear contours
-            s = np.sin(np.deg2rad(e_ang))
-            c = np.cos(np.deg2rad(e_ang))
-            # calculate length of line
-            lL = np.sqrt( (lEar[0]-rEar[0])**2+(lEar[1]-rEar[1])**2 ) / 2
-            x["bPosX"] = int(lEar[0]+lL*c)
-            x["bPosY"] = int(lEar[1]-lL*s)
-
-            ### determine two possible head directions
-            if -90 <= e_ang <= 90: 
-                hD1 = e_ang+90
-                hD2 = e_ang-90
-            elif 91 <= e_ang <= 180:
-                hD1 = -(360-(e_ang+90))
-                hD2 = e_ang-90
-            elif -91 > e_ang >= -180:
-                hD1 = e_ang+90
-                hD2 = (e_ang-90)%180 
+        # calculate angle of a line connecting two ears
+        e_ang = calc_line_angle(lEar, rEar)
+        
+        ### calculate bPos as a middle point between two ear contours
+        s = np.sin(np.deg2rad(e_ang))
+        c = np.cos(np.deg2rad(e_ang))
+        # calculate length of line
+        lL = np.sqrt( (lEar[0]-rEar[0])**2+(lEar[1]-rEar[1])**2 ) / 2
+        bPos = (int(lEar[0]+lL*c), int(lEar[1]-lL*s))
+
+        ### determine two possible head directions
+        if -90 <= e_ang <= 90: 
+            hD1 = e_ang+90
+            hD2 = e_ang-90
+        elif 91 <= e_ang <= 180:
+            hD1 = -(360-(e_ang+90))
+            hD2 = e_ang-90
+        elif -91 > e_ang >= -180:
+            hD1 = e_ang+90
+            hD2 = (e_ang-90)%180 
+        return dict(bPos=bPos, hDs=(hD1, hD2), conf=conf), diff
+
+    #-------------------------------------------------------------------
+    
+    def resolve_marmoset04(self, x, cand):
+        """ Determine head direction of a common marmoset monkey 
+        in the current frame, choosing one of candidates with 
+        data of the previous frame.
+        
+        Args:
+            x (dict): dictionary to retrieve/store calculated data
+            cand (None/dict): Candidates from extract_marmoset04.
+        
+        Returns:
+            x (dict): received 'x' dictionary, but with calculated data.
+        """
+        if DEBUG: print("CVProc.resolve_marmoset04()")
+
+        conf = 0.0 # confidence of head direction
+        if cand != None:
+        # contours considered to be ears are found
+            x["bPosX"], x["bPosY"] = cand["bPos"]
+            hD1, hD2 = cand["hDs"]
+            conf = cand["conf"]
             
             ### determine head direction which is closer to the previous one
-            if type(x["p_hD"]) == int:
+            if self.isHDFilterOn():
+            # temporal filter is used; the filter will reject outliers
+                predHD = self.predictHD(x)
+                if predHD == None or \
+                  calc_angle_diff(predHD, hD1) <= calc_angle_diff(predHD, hD2):
+                    x["hD"] = hD1
+                else:
+                    x["hD"] = hD2
+            elif type(x["p_hD"]) == int:
             # head direction in the previous hD is available
                 ang_diff1 = calc_angle_diff(x["p_hD"], hD1)
                 ang_diff2 = calc_angle_diff(x["p_hD"], hD2)
@@ -288,12 +1277,15 @@ class CVProc:
                     else:
                     # else, keep the head direction from the previous frame
                         x["hD"] = x["p_hD"]
+                        conf = 0.0
                 elif ang_diff1 > ang_diff2:
                 # hD2 is closer to the previous head direction
                     if ang_diff2 <= self.p.aecParam["uDegTh"]["value"]:
                         x["hD"] = hD2
                     else:
                         x["hD"] = x["p_hD"]
+                        conf = 0.0
+                conf *= self.calcJumpConf(x["p_hD"], x["hD"])
             else:
             # no previous frame available
                 x["hD"] = hD1
@@ -305,6 +1297,13 @@ class CVProc:
                 if type(x["hD"]) == int:
                     x["bPosX"] = x["p_bPosX"] 
                     x["bPosY"] = x["p_bPosY"]
+
+        if self.isHDFilterOn():
+            if cand != None: z = x["hD"] # measured head direction
+            else: z = None
+            x = self.filterHD(x, z, conf)
+        else:
+            self.setHDConf(x, conf)
          
         if type(x["hD"]) == int: # hD is available
             if x["bPosX"] == 'None' and x["p_bPosX"] != 'None': 
@@ -319,7 +1318,7 @@ class CVProc:
                                         x["bPosY"],
                                         True,
                                         ) # calculate hPos
-        return x, diff
+        return x
 
     #-------------------------------------------------------------------
     
@@ -338,6 +1337,9 @@ class CVProc:
         if DEBUG: print("CVProc.proc_macaque19()") 
 
         fSh = frame_arr.shape
+        # sizes are relative to height of the full (not cropped) frame
+        fH = self.getFullFrameH(frame_arr)
+        self.colCls = dict(rect=None, img=None) # new frame
 
         ### determine state of the computer screen,
         ###   which can change color of macaque face
@@ -348,8 +1350,10 @@ class CVProc:
           #   changes macaque's face color from pinkish to purplish.
           # Non-affecting color is [H: 110-117, S: 98-108]
           # Affecting color is [H: 116-119, S: 46-52]
-        pt = (5, int(fSh[0]/2))
         m = 5 # margin around 'pt'
+        pt = (self.arenaCoord("PosX", 5), self.arenaCoord("PosY", int(fH/2)))
+        # keep it in the frame image, when it's cropped out of arena
+        pt = (min(max(m, pt[0]), fSh[1]-m-1), min(max(m, pt[1]), fSh[0]-m-1))
         colInfo = getColorInfo(frame_arr, pt=pt, m=m)
         hm = colInfo["hue_med"]
         sm = colInfo["sat_med"]
@@ -362,35 +1366,47 @@ class CVProc:
                       (100,100,100), 
                       2)
 
-        rect = (0, 0, fSh[1], fSh[0]) # rect for searching colors
-        
         ### find approximate blueish wooden panel area
-        colMin = tuple(self.p.aecParam["uCol0Min"]["value"])
-        colMax = tuple(self.p.aecParam["uCol0Max"]["value"])
-        fcRslt = self.find_color(rect, frame_arr, colMin, colMax)
-        edged = self.getEdged(fcRslt)
-        cnt_info, cnt_pts, cnt_br, cnt_cpt = self.getCntData(edged)
-        ### update rect as the panel area
-        bpx1 = cnt_br[0]+cnt_br[2] - int(fSh[0]*0.65)
-        bpy1 = cnt_cpt[1] - int(fSh[0]/4)
-        bpx2 = cnt_br[0]+cnt_br[2]
-        bpy2 = cnt_cpt[1] + int(fSh[0]/4)
-        rect = (bpx1, bpy1, bpx2, bpy2)
+        rect = self.getMacaquePanelRect(frame_arr)
+        bpx1, bpy1, bpx2, bpy2 = rect
         # draw the found area
-        cv2.rectangle(frame_arr, (bpx1,bpy1), (bpx2,bpy2), (150,150,150), 3)
+        self.drawClsRect(frame_arr, (bpx1,bpy1), (bpx2,bpy2), (150,150,150), 3)
         
         ### find hair color of head
         if flagScreen:
         # screen color changed to a color that changes macaque's head color
-            colMin = tuple(self.p.aecParam["uCol2Min"]["value"])
-            colMax = tuple(self.p.aecParam["uCol2Max"]["value"])
-            fcRslt_h = self.find_color(rect, frame_arr, colMin, colMax)
+            cBits = 1 << self.mColClasses.index("uCol2")
         else:
         # normal color 
-            colMin = tuple(self.p.aecParam["uCol1Min"]["value"])
-            colMax = tuple(self.p.aecParam["uCol1Max"]["value"])
-            fcRslt_h = self.find_color(rect, frame_arr, colMin, colMax)
-        M = cv2.moments(fcRslt_h)
+            cBits = 1 << self.mColClasses.index("uCol1")
+        if type(x["p_bPosX"]) == int and type(x["p_bPosY"]) == int and \
+          rect[0] <= x["p_bPosX"] <= rect[2] and \
+          rect[1] <= x["p_bPosY"] <= rect[3]:
+        # head position in the previous frame is available
+            ### search the head color in a window around the previous 
+            ###   head position, growing the window when it's not found
+            hr = max(1, fH*self.p.aecParam["uHRSz"]["value"]) 
+              # half window size
+            for __ in range(self.mHeadWinMaxSteps):
+                wRect = (max(rect[0], int(x["p_bPosX"]-hr)),
+                         max(rect[1], int(x["p_bPosY"]-hr)),
+                         min(rect[2], int(x["p_bPosX"]+hr)),
+                         min(rect[3], int(x["p_bPosY"]+hr)))
+                fcRslt_h = self.find_color_class(wRect, frame_arr, cBits)
+                M = self.getMoments(fcRslt_h, wRect)
+                if M['m00'] > 0 or wRect == tuple(rect): break
+                hr *= self.mHeadWinGrowth
+            else:
+            # not found in the window (or the window doesn't grow,
+            #   such as with growth rate of 1 or less); 
+            #   search the whole panel area
+                fcRslt_h = self.find_color_class(rect, frame_arr, cBits)
+                M = self.getMoments(fcRslt_h, rect)
+        else:
+            fcRslt_h = self.find_color_class(rect, frame_arr, cBits)
+            M = self.getMoments(fcRslt_h, rect)
+        fcRslt = fcRslt_h
+        conf = 0.0 # confidence of head direction
         if M['m00'] > 0: 
             bx = int(M['m10']/M['m00'])
             by = int(M['m01']/M['m00'])
@@ -398,27 +1414,23 @@ class CVProc:
             x["bPosY"] = by
             ## update rect as approximate head area
             r = self.p.aecParam["uHRSz"]["value"]/2 
-            bx1 = int(bx - fSh[0]*r)
-            by1 = int(by - fSh[0]*r)
-            bx2 = int(bx + fSh[0]*r)
-            by2 = int(by + fSh[0]*r)
+            bx1 = int(bx - fH*r)
+            by1 = int(by - fH*r)
+            bx2 = int(bx + fH*r)
+            by2 = int(by + fH*r)
             rect = (bx1, by1, bx2, by2)
             # draw the found area
-            cv2.rectangle(frame_arr, (bx1,by1), (bx2,by2), (200,200,200), 3)
+            self.drawClsRect(frame_arr, (bx1,by1), (bx2,by2), (200,200,200), 3)
             
             ### find face color (pinkish-reddish/ purplish)
             # face color is in its normal color 
-            colMin = tuple(self.p.aecParam["uCol3Min"]["value"])
-            colMax = tuple(self.p.aecParam["uCol3Max"]["value"])
-            fcRslt = self.find_color(rect, frame_arr, colMin, colMax)
+            cBits = 1 << self.mColClasses.index("uCol3")
             if flagScreen:
-            # screen color changed to a color that changes macaque's face color
-                colMin = tuple(self.p.aecParam["uCol4Min"]["value"])
-                colMax = tuple(self.p.aecParam["uCol4Max"]["value"])
-                fcr = self.find_color(rect, frame_arr, colMin, colMax)
-                # add the secondary color result on the normal color result 
-                fcRslt = cv2.add(fcRslt, fcr)
-            M = cv2.moments(fcRslt)
+            # screen color changed to a color that changes macaque's face color;
+            #   the secondary color is found together with the normal color
+                cBits |= 1 << self.mColClasses.index("uCol4")
+            fcRslt = self.find_color_class(rect, frame_arr, cBits)
+            M = self.getMoments(fcRslt, rect)
             if M['m00'] > 0:
                 x["hPosX"] = int(M['m10']/M['m00'])
                 x["hPosY"] = int(M['m01']/M['m00'])
@@ -427,6 +1439,12 @@ class CVProc:
                     # calculate head direction
                     x["hD"] = calc_line_angle((x["bPosX"],x["bPosY"]), 
                                                (x["hPosX"],x["hPosY"]))
+                    ### confidence is lower with small face color area
+                    ###   and with big change of head direction
+                    hArea = (fH*self.p.aecParam["uHRSz"]["value"])**2
+                    conf = M['m00'] / (hArea*self.confFaceAreaR)
+                    conf = min(1.0, conf)
+                    conf *= self.calcJumpConf(x["p_hD"], x["hD"])
          
         if self.p.vRW.fi > 1 and x["hD"] == "None":
         # not the 1st frame and head direction was not calculated
@@ -436,11 +1454,95 @@ class CVProc:
             x["hPosY"] = x["p_hPosY"]
             x["bPosX"] = x["p_bPosX"]
             x["bPosY"] = x["p_bPosY"]
+        self.setHDConf(x, conf)
          
         return x, frame_arr, fcRslt
 
     #-------------------------------------------------------------------
 
+    def getMacaquePanelRect(self, frame_arr):
+        """ Get the area of the bluish wooden panel in Macaque19.
+        The panel doesn't move in a session, therefore its rect is cached 
+          once it's stable (detected similarly in consecutive frames),
+          then re-validated only periodically.
+        
+        Args:
+            frame_arr (numpy.ndarray): Frame image array.
+        
+        Returns:
+            rect (tuple): (x1, y1, x2, y2) of the panel area.
+        """
+        if DEBUG: print("CVProc.getMacaquePanelRect()")
+
+        fi = self.p.vRW.fi
+        mp = self.mPanel
+        colMin = tuple(self.p.aecParam["uCol0Min"]["value"])
+        colMax = tuple(self.p.aecParam["uCol0Max"]["value"])
+        param = (colMin, 
+                 colMax, 
+                 tuple(self.p.aecParam["cannyTh"]["value"]),
+                 self.p.aecParam["contourTh"]["value"])
+        if mp["param"] != param: # parameters changed
+            self.resetPanelState()
+            mp = self.mPanel
+            mp["param"] = param
+        elif mp["nStable"] >= self.mPanelStableN and \
+          0 <= fi-mp["fi"] < self.mPanelRevalInterval:
+        # stable panel rect was validated recently
+            return mp["rect"]
+
+        ### detect the panel area in the whole frame
+        fSh = frame_arr.shape
+        # sizes are relative to height of the full (not cropped) frame
+        fH = self.getFullFrameH(frame_arr)
+        fcRslt = self.find_color_class((0, 0, fSh[1], fSh[0]), 
+                                       frame_arr, 
+                                       1 << self.mColClasses.index("uCol0"))
+        edged = self.getEdged(fcRslt)
+        cnt_info, cnt_pts, cnt_br, cnt_cpt = self.getCntData(edged)
+        rect = (cnt_br[0]+cnt_br[2] - int(fH*0.65),
+                cnt_cpt[1] - int(fH/4),
+                cnt_br[0]+cnt_br[2],
+                cnt_cpt[1] + int(fH/4))
+        
+        ### update stability of the panel rect
+        if mp["rect"] != None and \
+          max([abs(rect[i]-mp["rect"][i]) for i in range(4)]) <= self.mPanelTol:
+            mp["nStable"] += 1
+        else:
+            mp["nStable"] = 1
+        mp["rect"] = rect
+        mp["fi"] = fi
+        return rect
+
+    #-------------------------------------------------------------------
+
+    def getMoments(self, img, rect):
+        """ Calculate moments of a binary image, 
+        processing only pixels in 'rect'.
+        
+        Args:
+            img (numpy.ndarray): Greyscale image.
+            rect (tuple): (x1, y1, x2, y2); x2 and y2 are inclusive.
+        
+        Returns:
+            M (dict): m00, m10 and m01 in coordinates of 'img'.
+        """
+        if DEBUG: print("CVProc.getMoments()")
+
+        x1 = max(0, min(rect[0], rect[2])); y1 = max(0, min(rect[1], rect[3]))
+        x2 = max(rect[0], rect[2]); y2 = max(rect[1], rect[3])
+        roi = img[y1:y2+1,x1:x2+1]
+        if roi.size == 0: return dict(m00=0, m10=0, m01=0)
+        _M = cv2.moments(roi, True)
+        M = dict(m00=_M['m00'])
+        # convert to coordinates of 'img'
+        M['m10'] = _M['m10'] + x1*_M['m00'] 
+        M['m01'] = _M['m01'] + y1*_M['m00']
+        return M
+
+    #-------------------------------------------------------------------
+
     def proc_rat05(self, x, frame_arr):
         """ Calculate head direction of a rat 
         
@@ -455,11 +1557,75 @@ class CVProc:
         """
         if DEBUG: print("CVProc.proc_rat05()")
 
+        fi = self.p.vRW.fi
+        if fi in self.preCand.keys():
+            cand = self.preCand.pop(fi)
+            diff = None
+        elif type(x["p_hD"]) == int: 
+            cand, diff = self.extract_rat05(frame_arr)
+        else:
+            ### clustering is not necessary without the previous hD
+            diffCol, diff = self.procBGSubtraction(frame_arr, self.bg)
+            cand = None
+        x, frame_arr = self.resolve_rat05(x, cand, frame_arr)
+        return x, diff, frame_arr
+
+    #-------------------------------------------------------------------
+    
+    def extract_rat05(self, frame_arr):
+        """ Extract clusters of subject points of a rat from a frame, 
+        without referring to data of other frames
+        (therefore, this can run on frames in parallel).
+        
+        Args:
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            cand (dict): Candidates. 
+              'dPts': coordinates of subject points (foreground pixels),
+              'centroids': centroids of k-means clusters of 'dPts',
+              'cnt_br': rect bounding all contours.
+            diff (numpy.ndarray): grey image after background subtraction.
+        """
+        if DEBUG: print("CVProc.extract_rat05()")
+
         diffCol, diff = self.procBGSubtraction(frame_arr, self.bg)
         edged = self.getEdged(diff)
         cnt_info, cnt_pts, cnt_br, cnt_cpt = self.getCntData(edged)
+        ### cluster subject points 
+        dPts = np.where(diff==255)
+        # coordinates of all the 255 pixels of diff
+        dPts = np.hstack((dPts[1].reshape((dPts[1].shape[0],1)),
+                          dPts[0].reshape((dPts[0].shape[0],1)))) 
+        t_dPts = dPts.astype(np.float32)
+        centroids, __ = kmeans(
+                            obs=t_dPts,
+                            k_or_guess=self.p.aecParam["uNKMC"]["value"]
+                            ) # kmeans clustering
+        cand = dict(dPts=dPts, centroids=centroids, cnt_br=cnt_br)
+        return cand, diff
+
+    #-------------------------------------------------------------------
+    
+    def resolve_rat05(self, x, cand, frame_arr):
+        """ Determine head direction of a rat in the current frame,
+        choosing the head cluster with data of the previous frame.
+        
+        Args:
+            x (dict): dictionary to retrieve/store calculated data
+            cand (None/dict): Candidates from extract_rat05.
+            frame_arr (numpy.ndarray): Frame image array.
+
+        Returns:
+            x (dict): received 'x' dictionary, but with calculated data.
+            frame_arr (numpy.ndarray): Frame image array.
+        """
+        if DEBUG: print("CVProc.resolve_rat05()")
 
-        if type(x["p_hD"]) == int: 
+        if type(x["p_hD"]) == int and cand != None: 
+            dPts = cand["dPts"]
+            centroids = cand["centroids"]
+            cnt_br = cand["cnt_br"]
             ### draw a far point with the known head direction 
             ###   from previous base point (bPos) 
             s = np.sin(np.deg2rad(x["p_hD"]))
@@ -468,16 +1634,6 @@ class CVProc:
             fpt = (int(x["p_bPosX"]+lL*c),
                    int(x["p_bPosY"]-lL*s)) # far front point away from head
             cv2.circle(frame_arr, fpt, 5, (50,50,50), -1)
-            ### cluster subject points 
-            dPts = np.where(diff==255)
-            # coordinates of all the 255 pixels of diff
-            dPts = np.hstack((dPts[1].reshape((dPts[1].shape[0],1)),
-                              dPts[0].reshape((dPts[0].shape[0],1)))) 
-            t_dPts = dPts.astype(np.float32)
-            centroids, __ = kmeans(
-                                obs=t_dPts,
-                                k_or_guess=self.p.aecParam["uNKMC"]["value"]
-                                ) # kmeans clustering
             ### calculate distances between the fpt and centroids of clusters,
             ### the closest cluster is supposed to be the head cluster
             d_cents = [] # (distance to fpt, x, y)
@@ -496,10 +1652,10 @@ class CVProc:
             for hci in range(len(t_pts)):
                 ptx, pty = t_pts[hci]
                 dists.append(np.sqrt((ptx-fpt[0])**2 + (pty-fpt[1])**2))
-            idx = dists.index(min(dists))
+            hpi = dists.index(min(dists)) # index of the head point
             ### store hPos
-            x["hPosX"] = int(t_pts[idx][0])
-            x["hPosY"] = int(t_pts[idx][1])
+            x["hPosX"] = int(t_pts[hpi][0])
+            x["hPosY"] = int(t_pts[hpi][1])
             col = (200, 200, 200)
             cv2.circle(frame_arr, (x["hPosX"],x["hPosY"]), 3, col, -1)
             ### draw each cluster centroids and 
@@ -520,15 +1676,24 @@ class CVProc:
             x["bPosY"] = int(centroids[bi][1])
         if x["hPosX"] == 'None' or x["bPosX"] == 'None':
             x["hD"] = x["p_hD"] 
+            if self.isHDFilterOn(): x = self.filterHD(x, None)
+            else: self.setHDConf(x, 0.0)
         else:
             x["hD"] = calc_line_angle((x["bPosX"],x["bPosY"]), 
                                  (x["hPosX"],x["hPosY"]))
-            if self.p.vRW.fi > 1: # not the first frame
-                if type(x["p_hD"]) == int:
-                    degDiffTol = self.p.aecParam["uDegTh"]["value"]
-                    if calc_angle_diff(x["p_hD"], x["hD"]) > degDiffTol:
-                    # differnce is too big. keep the previous hD
-                        x["hD"] = x["p_hD"]
+            if self.isHDFilterOn():
+                # temporal filter will reject outliers
+                x = self.filterHD(x, x["hD"])
+            else:
+                conf = self.calcJumpConf(x["p_hD"], x["hD"])
+                if self.p.vRW.fi > 1: # not the first frame
+                    if type(x["p_hD"]) == int:
+                        degDiffTol = self.p.aecParam["uDegTh"]["value"]
+                        if calc_angle_diff(x["p_hD"], x["hD"]) > degDiffTol:
+                        # differnce is too big. keep the previous hD
+                            x["hD"] = x["p_hD"]
+                            conf = 0.0
+                self.setHDConf(x, conf)
         """ 
         if type(x["hD"]) == int and x["bPosX"] != None:
             hPos = calc_pt_w_angle_n_dist(x["hD"],
@@ -537,7 +1702,7 @@ class CVProc:
                                           x["bPosY"],
                                           True)
         """
-        return x, diff, frame_arr
+        return x, frame_arr
 
     '''
     #-------------------------------------------------------------------
@@ -895,18 +2060,185 @@ class CVProc:
     #-------------------------------------------------------------------
     
     def find_color(self, rect, inImage, HSV_min, HSV_max):
-    # Find a color(range: 'HSV_min' ~ 'HSV_max') in an area('rect') of an image('inImage')
-    # 'rect' here is (x1,y1,x2,y2)
+        """ Find a color(range: 'HSV_min' ~ 'HSV_max') in an area('rect') 
+        of an image('inImage').
+        Only the area of 'rect' is converted to HSV and thresholded.
+
+        Args:
+            rect (tuple): (x1, y1, x2, y2) of the area to search.
+              x2 and y2 are inclusive. 
+            inImage (numpy.ndarray): BGR image.
+            HSV_min (tuple): Minimum HSV values of the color.
+            HSV_max (tuple): Maximum HSV values of the color.
+
+        Returns:
+            fcRslt (numpy.ndarray): Greyscale image (same size as 'inImage'),
+              where found color is 255.
+        """
         if DEBUG: print("CVProc.find_color()")
-        pts_ = [ (rect[0], rect[1]), (rect[0], rect[3]), (rect[2], rect[3]), (rect[2], rect[1]) ] # Upper Left, Lower Left, Lower Right, Upper Right
-        mask = np.zeros( (inImage.shape[0], inImage.shape[1]) , dtype=np.uint8 )
-        tmp_grey_img = np.zeros( (inImage.shape[0], inImage.shape[1]) , dtype=np.uint8 )
-        cv2.fillConvexPoly(mask, np.asarray(pts_), 255)
-        tmp_col_img = cv2.bitwise_and(inImage, inImage, mask=mask )
-        HSV_img = cv2.cvtColor(tmp_col_img, cv2.COLOR_BGR2HSV)
-        tmp_grey_img = cv2.inRange(HSV_img, HSV_min, HSV_max)
-        ret, tmp_grey_img = cv2.threshold(tmp_grey_img, 50, 255, cv2.THRESH_BINARY)
-        return tmp_grey_img
+        
+        iH, iW = inImage.shape[:2]
+        fcRslt = np.zeros((iH, iW), dtype=np.uint8)
+        ### clip rect into image
+        x1 = max(0, min(rect[0], rect[2])); y1 = max(0, min(rect[1], rect[3]))
+        x2 = min(iW-1, max(rect[0], rect[2]))
+        y2 = min(iH-1, max(rect[1], rect[3]))
+        if x2 < x1 or y2 < y1: return fcRslt
+        HSV_img = cv2.cvtColor(inImage[y1:y2+1,x1:x2+1], cv2.COLOR_BGR2HSV)
+        fcRslt[y1:y2+1,x1:x2+1] = cv2.inRange(HSV_img, HSV_min, HSV_max)
+        return fcRslt
+
+    #-------------------------------------------------------------------
+    
+    def getColorLUT(self):
+        """ Get lookup table from 24-bit BGR color to bits of 
+        color classes in 'mColClasses' (Macaque19).
+        The table is rebuilt only when HSV ranges of the classes changed.
+
+        Args: None
+
+        Returns:
+            lut (numpy.ndarray): Bits of color classes of each color,
+              indexed with (B + G*256 + R*65536).
+        """
+        if DEBUG: print("CVProc.getColorLUT()")
+
+        ecp = self.p.aecParam
+        param = tuple([(tuple(ecp[c+"Min"]["value"]), 
+                        tuple(ecp[c+"Max"]["value"]))
+                        for c in self.mColClasses])
+        cl = self.colLUT
+        if cl["param"] != param: # HSV ranges changed
+            lut = np.zeros((256, 65536), dtype=np.uint8)
+            ### B & G values of colors with the same R value
+            bg = np.arange(65536, dtype=np.uint32)
+            bgr = np.empty((256, 256, 3), dtype=np.uint8)
+            bgr[:,:,0] = (bg & 255).reshape((256, 256))
+            bgr[:,:,1] = (bg >> 8).reshape((256, 256))
+            for r in range(256):
+                bgr[:,:,2] = r
+                hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+                for i, (colMin, colMax) in enumerate(param):
+                    # inRange result is 255 or 0; keep only i-th bit 
+                    m = cv2.inRange(hsv, colMin, colMax)
+                    lut[r] |= (m & (1 << i)).ravel()
+            cl["lut"] = lut.ravel()
+            cl["param"] = param
+        return cl["lut"]
+
+    #-------------------------------------------------------------------
+    
+    def classify_colors(self, rect, inImage):
+        """ Classify colors of pixels in an area('rect') of an image
+        ('inImage') into all color classes of 'mColClasses' at once 
+        with a lookup table (getColorLUT). 
+        The result is kept in 'colCls' for the current frame; 
+          when 'rect' is out of the classified area, union of them
+          is classified.
+
+        Args:
+            rect (tuple): (x1, y1, x2, y2) of the area to classify.
+              x2 and y2 are inclusive. 
+            inImage (numpy.ndarray): BGR image.
+
+        Returns:
+            rect (None/tuple): 'rect' clipped into image. 
+              None, when it's out of image.
+        """
+        if DEBUG: print("CVProc.classify_colors()")
+        
+        iH, iW = inImage.shape[:2]
+        ### clip rect into image
+        x1 = max(0, min(rect[0], rect[2])); y1 = max(0, min(rect[1], rect[3]))
+        x2 = min(iW-1, max(rect[0], rect[2]))
+        y2 = min(iH-1, max(rect[1], rect[3]))
+        if x2 < x1 or y2 < y1: return None
+        cc = self.colCls
+        cr = cc["rect"]
+        if cr != None and cc["img"].shape == (iH, iW):
+            if cr[0] <= x1 and cr[1] <= y1 and x2 <= cr[2] and y2 <= cr[3]:
+            # already classified
+                return (x1, y1, x2, y2)
+            ### classify only strips around the classified area,
+            ###   which make union of the area and the classified area
+            ux1 = min(x1, cr[0]); uy1 = min(y1, cr[1])
+            ux2 = max(x2, cr[2]); uy2 = max(y2, cr[3])
+            regions = [(ux1, uy1, ux2, cr[1]-1), # top
+                       (ux1, cr[3]+1, ux2, uy2), # bottom
+                       (ux1, cr[1], cr[0]-1, cr[3]), # left
+                       (cr[2]+1, cr[1], ux2, cr[3])] # right
+        else:
+            cc["img"] = np.zeros((iH, iW), dtype=np.uint8)
+            ux1, uy1, ux2, uy2 = x1, y1, x2, y2
+            regions = [(x1, y1, x2, y2)]
+        lut = self.getColorLUT()
+        for (rx1, ry1, rx2, ry2) in regions:
+            if rx2 < rx1 or ry2 < ry1: continue
+            ### index of each pixel color to the lookup table;
+            ###   BGRA pixel with zero alpha as little-endian 32-bit integer
+            bgra = cv2.cvtColor(inImage[ry1:ry2+1,rx1:rx2+1], 
+                                cv2.COLOR_BGR2BGRA)
+            bgra[:,:,3] = 0
+            idx = bgra.view('<u4')[:,:,0]
+            cc["img"][ry1:ry2+1,rx1:rx2+1] = np.take(lut, idx)
+        cc["rect"] = (ux1, uy1, ux2, uy2)
+        return (x1, y1, x2, y2)
+
+    #-------------------------------------------------------------------
+    
+    def find_color_class(self, rect, inImage, cBits):
+        """ Find colors of classes ('cBits'; bits of 'mColClasses') 
+        in an area('rect') of an image('inImage'), using
+        classified colors (classify_colors) instead of converting 
+        the area to HSV and thresholding it for each color range.
+        Result is same with find_color with HSV range of the class.
+
+        Args:
+            rect (tuple): (x1, y1, x2, y2) of the area to search.
+              x2 and y2 are inclusive. 
+            inImage (numpy.ndarray): BGR image.
+            cBits (int): Bits of color classes to find.
+
+        Returns:
+            fcRslt (numpy.ndarray): Greyscale image (same size as 'inImage'),
+              where found color is 255.
+        """
+        if DEBUG: print("CVProc.find_color_class()")
+        
+        fcRslt = np.zeros(inImage.shape[:2], dtype=np.uint8)
+        rect = self.classify_colors(rect, inImage)
+        if rect == None: return fcRslt
+        x1, y1, x2, y2 = rect
+        cls = self.colCls["img"][y1:y2+1,x1:x2+1]
+        # 255 for class bits, which have any of 'cBits'
+        bitsLUT = np.where(np.arange(256) & cBits, 255, 0).astype(np.uint8)
+        fcRslt[y1:y2+1,x1:x2+1] = cv2.LUT(cls, bitsLUT)
+        return fcRslt
+
+    #-------------------------------------------------------------------
+    
+    def drawClsRect(self, img, pt1, pt2, col, thickness):
+        """ Draw a rectangle on a frame image, and the color class of 
+        the rectangle color on classified pixels ('colCls') as well, 
+        so that the classified pixels stay same with the frame image.
+
+        Args:
+            img (numpy.ndarray): BGR frame image to draw on.
+            pt1 (tuple): A vertex of the rectangle.
+            pt2 (tuple): The opposite vertex of the rectangle.
+            col (tuple): BGR color of the rectangle.
+            thickness (int): Thickness of the rectangle lines.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("CVProc.drawClsRect()")
+
+        cv2.rectangle(img, pt1, pt2, col, thickness)
+        cc = self.colCls
+        if cc["img"] is not None and cc["img"].shape == img.shape[:2]:
+            cBits = int(self.getColorLUT()[col[0] + (col[1]<<8) + (col[2]<<16)])
+            cv2.rectangle(cc["img"], pt1, pt2, cBits, thickness)
 
     #-------------------------------------------------------------------
 
@@ -930,45 +2262,27 @@ class CVProc:
 
     def procBGSubtraction(self, img, bgImg):
         """ Get some informative images after subtracting background.
+        * Returned images are buffers of self.bgSub, which will be 
+          overwritten when this function is called next time.
 
         Args:
             img (numpy.ndarray): image array to process.
             bgImg (numpy.ndarray): background image to subtract.
 
         Returns:
+            diffCol (numpy.ndarray): color image after BG subtraction.
             diff (numpy.ndarray): greyscale image after BG subtraction.
-            edged (numpy.ndarray): greyscale image of edges in 'diff'.
         """
         if DEBUG: print("CVProc.procBGSubtraction()")
         
-        ### get difference between
-        ###   the current frame and the background image 
-        diffCol = cv2.absdiff(img, bgImg)
-        diff = cv2.cvtColor(diffCol, cv2.COLOR_BGR2GRAY)
         ecp = self.p.aecParam
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(3,3))
-        if "bgsMExOIter" in ecp.keys() and ecp["bgsMExOIter"]["value"] != -1:
-            diff = cv2.morphologyEx(
-                        diff, 
-                        cv2.MORPH_OPEN, 
-                        kernel, 
-                        iterations=ecp["bgsMExOIter"]["value"],
-                        ) # to decrease noise & minor features
-        if "bgsMExCIter" in ecp.keys() and ecp["bgsMExCIter"]["value"] != -1:
-            diff = cv2.morphologyEx(
-                        diff, 
-                        cv2.MORPH_CLOSE, 
-                        kernel, 
-                        iterations=ecp["bgsMExCIter"]["value"],
-                        ) # closing small holes
-        if "bgsThres" in ecp.keys() and ecp["bgsThres"]["value"] != -1:
-            __, diff = cv2.threshold(
-                            diff, 
-                            ecp["bgsThres"]["value"], 
-                            255, 
-                            cv2.THRESH_BINARY
-                            ) # make the recognized part clear 
-        return diffCol, diff
+        ### number of iterations of morphologyEx and threshold value
+        ###   (-1 means that the operation is not applied)
+        vals = []
+        for k in ["bgsMExOIter", "bgsMExCIter", "bgsThres"]:
+            if k in ecp.keys(): vals.append(ecp[k]["value"])
+            else: vals.append(-1)
+        return self.bgSub.proc(img, bgImg, vals[0], vals[1], vals[2]) 
     
     #-------------------------------------------------------------------
     
@@ -991,6 +2305,8 @@ class CVProc:
     
     def getCntData(self, img):
         """ Get some useful data from contours in a given image.
+        Bounding rects of contours are calculated in bulk 
+          with a single array of points of all contours.
 
         Args:
             img (numpy.ndarray): greyscale image to get contour data.
@@ -999,7 +2315,9 @@ class CVProc:
             cnt_info (list): contour info list. 
                 each item is a tuple (size, center-X, center-Y) of a contour.
                 'size' is width + height.
-            cnt_pts (list): list of every pixels in all contours.
+            cnt_pts (numpy.ndarray): every point (x, y) in all contours,
+                which passed the size threshold.
+            cnt_br (tuple): rect bounding all contour points.
             cnt_cpt (tuple): center point of contour.
         """
         if DEBUG: print("CVProc.getCntData()")
@@ -1009,21 +2327,41 @@ class CVProc:
                                              cv2.RETR_EXTERNAL, 
                                              cv2.CHAIN_APPROX_SIMPLE)
         cnt_info = [] # contour info (size, center-X, center-Y)
-        cnt_pts = [] # put points of all contours into this list
-        for ci in range(len(cnts)):
-            mr = cv2.boundingRect(cnts[ci])
-            if mr[2]+mr[3] < self.p.aecParam["contourTh"]["value"]: continue
-            #cv2.circle(img, (mr[0]+mr[2]/2,mr[1]+mr[3]/2), mr[2]/2, 125, 1)
-            cnt_info.append((mr[2]+mr[3], mr[0]+mr[2]/2, mr[1]+mr[3]/2))
-            cnt_pts += list(cnts[ci].reshape((cnts[ci].shape[0], 2)))
-        if len(cnt_pts) > 0:
-            # rect bounding all contour points
-            cnt_br = cv2.boundingRect(np.asarray(cnt_pts))
-            # calculate center point of all contours
-            cnt_cpt = (cnt_br[0]+int(cnt_br[2]/2), cnt_br[1]+int(cnt_br[3]/2))
-        else:
-            cnt_br = (-1, -1, -1, -1)
-            cnt_cpt = (-1, -1)
+        cnt_pts = np.zeros((0, 2), dtype=np.int32) # points of all contours
+        cnt_br = (-1, -1, -1, -1)
+        cnt_cpt = (-1, -1)
+        if len(cnts) == 0: return cnt_info, cnt_pts, cnt_br, cnt_cpt
+
+        ### bounding rect of each contour
+        nPts = np.fromiter(map(len, cnts), dtype=np.int64, count=len(cnts))
+          # number of points in each contour
+        pts = np.concatenate(cnts).reshape((-1, 2)) # points of all contours
+        sIdx = np.zeros(len(cnts), dtype=np.int64) # starting index of 
+          # each contour in 'pts'
+        sIdx[1:] = np.cumsum(nPts)[:-1]
+        x1 = np.minimum.reduceat(pts[:,0], sIdx)
+        y1 = np.minimum.reduceat(pts[:,1], sIdx)
+        w = np.maximum.reduceat(pts[:,0], sIdx) - x1 + 1
+        h = np.maximum.reduceat(pts[:,1], sIdx) - y1 + 1
+        
+        ### filter contours with size (width + height)
+        isValid = (w+h) >= self.p.aecParam["contourTh"]["value"]
+        if not np.any(isValid): return cnt_info, cnt_pts, cnt_br, cnt_cpt
+        x1 = x1[isValid]; y1 = y1[isValid]; w = w[isValid]; h = h[isValid]
+        cnt_info = list(zip((w+h).tolist(), 
+                            (x1+w/2).tolist(), 
+                            (y1+h/2).tolist()))
+        cnt_pts = pts[np.repeat(isValid, nPts)]
+        
+        ### rect bounding all contour points
+        bx1 = int(x1.min()) 
+        by1 = int(y1.min())
+        cnt_br = (bx1, 
+                  by1, 
+                  int((x1+w).max())-bx1, 
+                  int((y1+h).max())-by1)
+        # calculate center point of all contours
+        cnt_cpt = (cnt_br[0]+int(cnt_br[2]/2), cnt_br[1]+int(cnt_br[3]/2))
 
         return cnt_info, cnt_pts, cnt_br, cnt_cpt
     
@@ -1031,6 +2369,609 @@ class CVProc:
 
 #=======================================================================
 
+class BGSubtractor:
+    """ Background subtraction pipeline, which owns output buffers 
+    (allocated once for the frame size of the video) and 
+    structuring elements, to avoid allocating new arrays for each frame.
+    N iterations of morphologyEx with 3x3 rect kernel is processed 
+      as one pass with (2N+1)x(2N+1) rect kernel, 
+      which produces the identical result.
+        
+    Attributes:
+        Each attribute is commented in 'setting up attributes' section.
+    """
+    def __init__(self):
+        if DEBUG: print("BGSubtractor.__init__()")
+        
+        ##### [begin] setting up attributes -----
+        self.shape = None # shape of frame image, buffers were allocated for
+        self.buf = {} # buffers for output images
+        self.kernel = {} # structuring element for each number of iterations
+        ##### [end] setting up attributes -----
+
+    #-------------------------------------------------------------------
+    
+    def allocBuffers(self, shape):
+        """ Allocate output buffers for the given frame shape.
+
+        Args:
+            shape (tuple): Shape of color frame image.
+
+        Returns: None
+        """
+        if DEBUG: print("BGSubtractor.allocBuffers()")
+
+        self.shape = shape
+        self.buf["diffCol"] = np.zeros(shape, dtype=np.uint8)
+        self.buf["grey"] = np.zeros(shape[:2], dtype=np.uint8)
+        self.buf["morph"] = np.zeros(shape[:2], dtype=np.uint8)
+
+    #-------------------------------------------------------------------
+    
+    def getKernel(self, nIter):
+        """ Get rect structuring element, equivalent to 
+        'nIter' iterations of 3x3 rect kernel.
+
+        Args:
+            nIter (int): Number of iterations.
+
+        Returns:
+            (numpy.ndarray): Structuring element.
+        """
+        if DEBUG: print("BGSubtractor.getKernel()")
+
+        if not nIter in self.kernel.keys():
+            kSz = (2*nIter+1, 2*nIter+1)
+            self.kernel[nIter] = cv2.getStructuringElement(cv2.MORPH_RECT, 
+                                                           kSz)
+        return self.kernel[nIter]
+
+    #-------------------------------------------------------------------
+    
+    def proc(self, img, bgImg, oIter=-1, cIter=-1, thres=-1):
+        """ Subtract background and reduce noise.
+
+        Args:
+            img (numpy.ndarray): image array to process.
+            bgImg (numpy.ndarray): background image to subtract.
+            oIter (int): Number of iterations of opening 
+              (to decrease noise & minor features). -1 to skip.
+            cIter (int): Number of iterations of closing 
+              (closing small holes). -1 to skip.
+            thres (int): Threshold value (to make the recognized part 
+              clear). -1 to skip.
+
+        Returns:
+            diffCol (numpy.ndarray): color image after BG subtraction.
+            diff (numpy.ndarray): greyscale image after BG subtraction.
+        """
+        if DEBUG: print("BGSubtractor.proc()")
+
+        if img.shape != self.shape: self.allocBuffers(img.shape)
+        buf = self.buf
+        ### get difference between
+        ###   the current frame and the background image 
+        diffCol = cv2.absdiff(img, bgImg, dst=buf["diffCol"])
+        diff = cv2.cvtColor(diffCol, cv2.COLOR_BGR2GRAY, dst=buf["grey"])
+        if oIter != -1:
+            diff = cv2.morphologyEx(diff, 
+                                    cv2.MORPH_OPEN, 
+                                    self.getKernel(oIter),
+                                    dst=buf["morph"])
+        if cIter != -1:
+            if diff is buf["morph"]: dst = buf["grey"]
+            else: dst = buf["morph"]
+            diff = cv2.morphologyEx(diff, 
+                                    cv2.MORPH_CLOSE, 
+                                    self.getKernel(cIter),
+                                    dst=dst)
+        if thres != -1:
+            __, diff = cv2.threshold(diff, 
+                                     thres, 
+                                     255, 
+                                     cv2.THRESH_BINARY, 
+                                     dst=diff)
+        return diffCol, diff
+
+#=======================================================================
+
+class HeadlessVRW:
+    """ Minimal stand-in of VideoRW for processing frames without UI.
+
+    Args:
+        nFrames (int): Total number of frames.
+    """
+    def __init__(self, nFrames):
+        if DEBUG: print("HeadlessVRW.__init__()")
+        self.fi = -1 # current frame index
+        self.nFrames = nFrames # total number of frames
+        self.currFrame = None # current frame image
+        self.arena = None # arena (arena.make_arena), to which frames are
+          # cropped
+
+#=======================================================================
+
+class HeadlessParent:
+    """ Minimal stand-in of the app frame (AnimalBehaviourCoderFrame),
+    providing attributes, which CVProc reads from its parent,
+    to process frames without UI (in a thread or a worker process).
+
+    Args:
+        pInfo (dict): Processing info such as animalECase, aecParam, 
+          dataCols, etc. (AnimalBehaviourCoderFrame.getProcInfo()).
+        oData (None/numpy.ndarray): Output data. When it's None, 
+          it's initialized with initial values of data columns.
+    """
+    def __init__(self, pInfo, oData=None):
+        if DEBUG: print("HeadlessParent.__init__()")
+
+        ##### [begin] setting up attributes -----
+        self.animalECase = pInfo["animalECase"]
+        self.aecParam = deepcopy(pInfo["aecParam"])
+        self.dataCols = list(pInfo["dataCols"])
+        self.dataInitVal = list(pInfo["dataInitVal"])
+        self.dataStruct = list(pInfo["dataStruct"])
+        for k in pInfo["colIdx"].keys():
+            setattr(self, k, pInfo["colIdx"][k]) # column indices
+        self.vRW = HeadlessVRW(pInfo["nFrames"])
+        self.vRW.arena = pInfo["arena"]
+        if type(oData) == np.ndarray:
+            self.oData = oData
+        else:
+            self.oData = np.asarray(
+                                [tuple(self.dataInitVal)]*self.vRW.nFrames,
+                                dtype=self.dataStruct
+                                ) # output data
+        self.flagContManualInput = False
+        self.flagVRec = False
+        self.ratFImgDispImg = 1.0
+        ##### [end] setting up attributes -----
+
+#=======================================================================
+
+extractorState = {} # state of a worker process of candidate extraction
+
+#-----------------------------------------------------------------------
+
+def initExtractor(pInfo, vFP, bg):
+    """ Initialize a worker process for candidate extraction 
+    (initializer of multiprocessing.Pool).
+
+    Args:
+        pInfo (dict): Processing info (AnimalBehaviourCoderFrame.getProcInfo()).
+        vFP (str): File path of video.
+        bg (numpy.ndarray): Background image.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("cv_proc.initExtractor()")
+
+    p = HeadlessParent(dict(pInfo, nFrames=0))
+    cvp = CVProc(p)
+    cvp.bg = bg
+    extractorState["cvp"] = cvp
+    extractorState["fCache"] = open_frame_cache(vFP)
+
+#-----------------------------------------------------------------------
+
+def extractFrames(fRange):
+    """ Extract candidates from a range of frames (in a worker process).
+    Frames are read from frame cache of the video (random access),
+      which is required for parallel extraction; without it, each
+      worker would decode the video from its first frame.
+    A frame, of which extraction failed, is omitted in the result.
+
+    Args:
+        fRange (tuple): The first and the last frame-index.
+
+    Returns:
+        cands (dict): Candidates of frames; {frame-index: candidates}.
+    """
+    if DEBUG: print("cv_proc.extractFrames()")
+
+    st = extractorState
+    cvp = st["cvp"]
+    cands = {}
+    for fi in range(fRange[0], fRange[1]+1):
+        if fi >= st["fCache"].shape[0]: break
+        frame = crop_frame(st["fCache"][fi], cvp.p.vRW.arena, True)
+        cvp.p.vRW.fi = fi
+        try: cands[fi] = cvp.extractCandidates(cvp.p.animalECase, frame)
+        except: pass # the frame will be processed entirely in sequence
+    return cands
+
+#-----------------------------------------------------------------------
+
+def initReanalysis(pInfo, bg, fi0, rows):
+    """ Set up a headless parent and CVProc for re-analysis 
+    of a range of frames.
+
+    Args:
+        pInfo (dict): Processing info (AnimalBehaviourCoderFrame.getProcInfo()).
+        bg (None/numpy.ndarray): Background image.
+        fi0 (int): The first frame-index to re-analyse.
+        rows (numpy.ndarray): Output data from frame-index (fi0-1) 
+          to the last frame-index to re-analyse. When fi0 is 0,
+          it starts from fi0.
+
+    Returns:
+        p (HeadlessParent): Parent with output data including 'rows'.
+        cvp (CVProc): CVProc instance to process frames.
+        offset (int): Row index of fi0 in 'rows'.
+        fi1 (int): The last frame-index to re-analyse.
+    """
+    if DEBUG: print("cv_proc.initReanalysis()")
+
+    offset = 1 if fi0 > 0 else 0 # row index of fi0 in 'rows'
+    fi1 = fi0 + len(rows) - offset - 1 # the last frame-index
+    ### set up parent with output data, big enough to hold 'rows'
+    pInfo = dict(pInfo)
+    pInfo["nFrames"] = fi1 + 1
+    p = HeadlessParent(pInfo)
+    p.oData[fi0-offset:fi1+1] = rows
+    cvp = CVProc(p)
+    cvp.bg = bg
+    return p, cvp, offset, fi1
+
+#-----------------------------------------------------------------------
+
+def reanalyseFrames(pInfo, vFP, bg, fi0, rows, q2m, q2t, nProc=1):
+    """ Re-analyse a range of frames (in a worker process).
+    Rows, of which head direction was manually determined (mHD == True),
+      are kept untouched. Data of other rows are re-calculated from
+      their initial values.
+    When 'nProc' is larger than 1, the case is in CVProc.parallelCases
+      and the video has frame cache, candidates are extracted from 
+      frames in a pool of worker processes, while this process resolves 
+      them in order with data of the previous frame. At most 2*nProc
+      ranges of frames are extracted ahead, so that memory of
+      candidates doesn't grow when resolving is slower.
+    When there's a checkpoint of tracker state (checkpoint.py) of 
+      the frame before fi0, processing starts with its state, 
+      so that results are the same as the ones of an uninterrupted run.
+
+    Args:
+        pInfo (dict): Processing info (AnimalBehaviourCoderFrame.getProcInfo()).
+        vFP (str): File path of video.
+        bg (None/numpy.ndarray): Background image.
+        fi0 (int): The first frame-index to re-analyse.
+        rows (numpy.ndarray): Output data from frame-index (fi0-1) 
+          to the last frame-index to re-analyse. When fi0 is 0,
+          it starts from fi0.
+        q2m (multiprocessing.Queue): Queue to send data to main.
+        q2t (multiprocessing.Queue): Queue to receive data from main.
+        nProc (int): Number of worker processes for candidate extraction.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("cv_proc.reanalyseFrames()")
+
+    p, cvp, offset, fi1 = initReanalysis(pInfo, bg, fi0, rows)
+    mhdi = p.dataCols.index("mHD")
+    
+    fCache = open_frame_cache(vFP) # frame cache of the video
+    cvp.rCache = ResultCache(vFP, p.dataStruct) # result cache of the video
+    
+    lastMsgTime = time()
+    if fCache is not None:
+        vCap = None
+        if offset == 1: 
+            cvp.last_motion_frame = crop_frame(fCache[fi0-1], p.vRW.arena, True)
+            cvp.lmFI = fi0-1
+    else:
+        vCap = cv2.VideoCapture(vFP)
+        ### read frames (sequentially, to match frame-indices exactly)
+        ###   up to the frame before fi0
+        for fi in range(fi0-offset):
+            if not vCap.grab(): break
+            if time()-lastMsgTime > 0.2:
+                q2m.put(("Re-analysis: moving to %i"%(fi0),), True, None)
+                lastMsgTime = time()
+        if offset == 1:
+            ret, frame = vCap.read()
+            cvp.last_motion_frame = crop_frame(frame, p.vRW.arena)
+            cvp.lmFI = fi0-1
+    if offset == 1:
+        # restore tracker state after the frame before fi0, 
+        #   when its checkpoint is available
+        cvp.loadCheckpoint(vFP, fi0-1)
+    
+    pool = None
+    if nProc > 1 and p.animalECase in cvp.parallelCases and \
+      type(bg) == np.ndarray and fCache is not None:
+        ### extract candidates in worker processes
+        rLen = 64 # number of frames in a range
+        fRanges = [(fi, min(fi1, fi+rLen-1)) for fi in range(fi0, fi1+1, rLen)]
+        pool = Pool(nProc, 
+                    initializer=initExtractor, 
+                    initargs=(pInfo, vFP, bg))
+        pending = [] # results of submitted ranges, in order
+        maxPending = nProc * 2 # max. number of submitted ranges,
+          # of which candidates were not received yet
+        rIdx = 0 # index of range to receive candidates next
+    
+    for fi in range(fi0, fi1+1):
+        msg = None
+        if pool != None:
+            while rIdx < len(fRanges) and fRanges[rIdx][0] <= fi:
+            # candidates of this frame were not received yet
+                while rIdx+len(pending) < len(fRanges) and \
+                  len(pending) < maxPending:
+                    fr = fRanges[rIdx+len(pending)]
+                    pending.append(pool.apply_async(extractFrames, (fr,)))
+                try:
+                    cvp.preCand.update(pending[0].get(0.2))
+                    pending.pop(0)
+                    rIdx += 1
+                except MPTimeoutError:
+                    ### check cancellation while waiting
+                    try: msg = q2t.get(False)
+                    except queue.Empty: pass
+                    if msg == "quit": break
+                    if time()-lastMsgTime > 0.2:
+                        msg = "Re-analysis: extracting candidates of %i"%(fi)
+                        q2m.put((msg,), True, None)
+                        lastMsgTime = time()
+        if msg != "quit":
+            try: msg = q2t.get(False)
+            except queue.Empty: msg = None
+        if msg == "quit":
+            if vCap != None: vCap.release()
+            if pool != None: pool.terminate()
+            cvp.rCache.flush()
+            q2m.put(("Cancelled", fi0, None), True, None)
+            return
+        if vCap == None:
+            if fi >= fCache.shape[0]: break
+            frame = crop_frame(fCache[fi], p.vRW.arena, True)
+        else:
+            ret, frame = vCap.read()
+            if not ret: break
+            frame = crop_frame(frame, p.vRW.arena)
+        if p.oData[fi][mhdi] == "True": 
+            cvp.preCand.pop(fi, None)
+            continue # keep manual data
+        p.oData[fi] = tuple(p.dataInitVal)
+        p.vRW.fi = fi
+        p.vRW.currFrame = frame
+        x, flagMHPos = cvp.getXDict()
+        ret, __ = cvp.proc_img(frame, p.animalECase, x, flagMHPos)
+        # candidates are not used, when there was no motion
+        cvp.preCand.pop(fi, None)
+        p.oData[fi] = cvp.getODataRow(ret)
+        if time()-lastMsgTime > 0.2:
+            msg = "Re-analysis: %i/ %i"%(fi, fi1)
+            q2m.put((msg,), True, None)
+            lastMsgTime = time()
+    if vCap != None: vCap.release()
+    if pool != None: 
+        pool.terminate()
+        pool.join()
+    cvp.rCache.flush()
+    q2m.put(("Finished", fi0, p.oData[fi0:fi1+1].copy()), True, None)
+
+#-----------------------------------------------------------------------
+
+def needsRefinement(p, fiA, fiB, degTh, minConf):
+    """ Whether the interval between two analysed frames should be 
+    refined with more analysed frames, instead of being interpolated.
+
+    Args:
+        p (HeadlessParent): Parent with output data.
+        fiA (int): Frame-index of the earlier analysed frame.
+        fiB (int): Frame-index of the later analysed frame.
+        degTh (int): Threshold of head direction change in degrees.
+        minConf (float): Minimum confidence (hDConf) of frame B.
+
+    Returns:
+        (bool): True when head direction of either frame is not 
+          available, its change is larger than 'degTh', or
+          its confidence in frame B is lower than 'minConf'.
+    """
+    if DEBUG: print("cv_proc.needsRefinement()")
+
+    if fiA < 0: return True
+    hDs, isInt = parse_int_col(p.oData["hD"][[fiA, fiB]])
+    if not isInt.all(): return True
+    if "hDConf" in p.dataCols and p.oData[fiB]["mHD"] != "True":
+    # a case might keep the previous head direction with low confidence,
+    #   when a candidate changed too much from the previous frame 
+        try: conf = float(p.oData[fiB]["hDConf"])
+        except ValueError: conf = 0.0
+        if conf < minConf: return True
+    return calc_angle_diff(int(hDs[0]), int(hDs[1])) > degTh
+
+#-----------------------------------------------------------------------
+
+def interpolateFrames(p, fiA, fiB):
+    """ Fill data of frames between two analysed frames (exclusive)
+    by interpolation; head direction is interpolated along the shorter
+    arc of the circle, base position linearly, and head position is 
+    calculated with them and the interpolated head length.
+    'remarks' of the filled frames is 'interpolated' and 'hDConf' is
+      the lower one of the two analysed frames.
+
+    Args:
+        p (HeadlessParent): Parent with output data.
+        fiA (int): Frame-index of the earlier analysed frame.
+        fiB (int): Frame-index of the later analysed frame.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("cv_proc.interpolateFrames()")
+
+    n = fiB - fiA
+    if n < 2: return
+    d = p.oData[fiA+1:fiB] # view of rows to fill
+    d[:] = tuple(p.dataInitVal)
+    hDs, isInt = parse_int_col(p.oData["hD"][[fiA, fiB]])
+    if not isInt.all(): return # keep initial values
+    r = np.arange(1, n) / float(n) # ratio from frame A to B
+    hD = hDs[0] + r * calc_signed_angle_diff(hDs[0], hDs[1])
+    hD = convt_360_to_180(np.round(hD).astype(np.int64) % 360)
+    d["hD"] = hD.astype(str)
+    d["remarks"] = "interpolated"
+    pos = {}
+    for k in ["bPosX", "bPosY", "hPosX", "hPosY"]:
+        pos[k] = parse_int_col(p.oData[k][[fiA, fiB]])
+    if pos["bPosX"][1].all() and pos["bPosY"][1].all():
+        bx = np.round(pos["bPosX"][0][0] + \
+                r*(pos["bPosX"][0][1]-pos["bPosX"][0][0])).astype(np.int64)
+        by = np.round(pos["bPosY"][0][0] + \
+                r*(pos["bPosY"][0][1]-pos["bPosY"][0][0])).astype(np.int64)
+        d["bPosX"] = bx.astype(str)
+        d["bPosY"] = by.astype(str)
+        if pos["hPosX"][1].all() and pos["hPosY"][1].all():
+            ### head length (distance between base and head position)
+            hLen = np.sqrt((pos["hPosX"][0]-pos["bPosX"][0])**2 + \
+                           (pos["hPosY"][0]-pos["bPosY"][0])**2)
+            dist = hLen[0] + r*(hLen[1]-hLen[0])
+            hx, hy = calc_pt_w_angle_n_dist(hD, dist, bx, by, True)
+            d["hPosX"] = hx.astype(str)
+            d["hPosY"] = hy.astype(str)
+    if "hDConf" in p.dataCols:
+        try:
+            conf = min(float(p.oData[fiA]["hDConf"]), 
+                       float(p.oData[fiB]["hDConf"]))
+            d["hDConf"] = "%.2f"%(conf)
+        except ValueError:
+            pass
+
+#-----------------------------------------------------------------------
+
+def reanalyseFramesAdaptive(pInfo, vFP, bg, fi0, rows, q2m, q2t):
+    """ Re-analyse a range of frames (in a worker process) 
+    in coarse-to-fine manner.
+    Frames are sampled with a step of up to 'uAdaptStep' frames.
+      A sampled frame is analysed with data of the last accepted frame
+      as its previous frame. When head direction of the two frames is
+      not available, its change is larger than 'adaptDegTh' or its
+      confidence is lower than 'adaptMinConf', the step 
+      is halved and a closer frame is analysed instead. Otherwise, 
+      the sampled frame is accepted, frames in between are interpolated
+      (interpolateFrames) and the step is doubled for the next sample.
+    Cases process a frame with data of the previous frame, therefore
+      the refinement is done while stepping forward, instead of 
+      after sampling all frames.
+    Rows, of which head direction was manually determined (mHD == True),
+      are kept untouched and accepted as analysed frames.
+
+    Args:
+        pInfo (dict): Processing info (AnimalBehaviourCoderFrame.getProcInfo()).
+        vFP (str): File path of video.
+        bg (None/numpy.ndarray): Background image.
+        fi0 (int): The first frame-index to re-analyse.
+        rows (numpy.ndarray): Output data from frame-index (fi0-1) 
+          to the last frame-index to re-analyse. When fi0 is 0,
+          it starts from fi0.
+        q2m (multiprocessing.Queue): Queue to send data to main.
+        q2t (multiprocessing.Queue): Queue to receive data from main.
+
+    Returns:
+        None
+    """
+    if DEBUG: print("cv_proc.reanalyseFramesAdaptive()")
+
+    p, cvp, offset, fi1 = initReanalysis(pInfo, bg, fi0, rows)
+    ecp = p.aecParam
+    maxStep = max(1, int(ecp["uAdaptStep"]["value"]))
+    degTh = ecp["adaptDegTh"]["value"]
+    minConf = ecp["adaptMinConf"]["value"]
+    isManual = p.oData["mHD"] == "True"
+    
+    fCache = open_frame_cache(vFP) # frame cache of the video
+    cvp.rCache = ResultCache(vFP, p.dataStruct) # result cache of the video
+    
+    lastMsgTime = time()
+    buf = {} # frames read from video, which might be analysed
+    if fCache is not None:
+        vCap = None
+        fi1 = min(fi1, fCache.shape[0]-1)
+        if offset == 1: 
+            cvp.last_motion_frame = crop_frame(fCache[fi0-1], p.vRW.arena, True)
+            cvp.lmFI = fi0-1
+    else:
+        vCap = cv2.VideoCapture(vFP)
+        ### read frames (sequentially, to match frame-indices exactly)
+        ###   up to the frame before fi0
+        for fi in range(fi0-offset):
+            if not vCap.grab(): break
+            if time()-lastMsgTime > 0.2:
+                q2m.put(("Re-analysis: moving to %i"%(fi0),), True, None)
+                lastMsgTime = time()
+        if offset == 1:
+            ret, frame = vCap.read()
+            cvp.last_motion_frame = crop_frame(frame, p.vRW.arena)
+            cvp.lmFI = fi0-1
+        vFI = fi0 - 1 # frame-index of the last read frame
+    if offset == 1:
+        # restore tracker state after the frame before fi0, 
+        #   when its checkpoint is available
+        cvp.loadCheckpoint(vFP, fi0-1)
+    
+    fiA = fi0 - 1 # the last accepted frame
+    lmFrame = cvp.last_motion_frame # last motion frame at 'fiA'
+    lmFI = cvp.lmFI # frame-index of 'lmFrame'
+    step = maxStep
+    nAnalysed = 0 # number of analysed frames
+    while fiA < fi1:
+        try: msg = q2t.get(False)
+        except queue.Empty: msg = None
+        if msg == "quit":
+            if vCap != None: vCap.release()
+            cvp.rCache.flush()
+            q2m.put(("Cancelled", fi0, None), True, None)
+            return
+        fiB = min(fiA+step, fi1)
+        # a manual row in between is accepted first
+        mIdx = np.nonzero(isManual[fiA+1:fiB+1])[0]
+        if len(mIdx) > 0: fiB = fiA + 1 + mIdx[0]
+        if not isManual[fiB]:
+            ### get the frame image
+            if vCap == None:
+                frame = crop_frame(fCache[fiB], p.vRW.arena, True)
+            else:
+                while vFI < fiB:
+                    ret, frame = vCap.read()
+                    if not ret: break
+                    vFI += 1
+                    buf[vFI] = crop_frame(frame, p.vRW.arena)
+                frame = buf.get(fiB, None)
+                if frame is None: # end of video
+                    fi1 = vFI
+                    continue
+            ### analyse the frame with data of frame A as previous data
+            p.oData[fiB] = tuple(p.dataInitVal)
+            p.vRW.fi = fiB
+            p.vRW.currFrame = frame
+            cvp.last_motion_frame = lmFrame
+            cvp.lmFI = lmFI
+            x, flagMHPos = cvp.getXDict(pFI=fiA)
+            ret, __ = cvp.proc_img(frame, p.animalECase, x, flagMHPos)
+            p.oData[fiB] = cvp.getODataRow(ret)
+            nAnalysed += 1
+        if fiB-fiA > 1 and needsRefinement(p, fiA, fiB, degTh, minConf):
+            step = (fiB-fiA) // 2
+            continue
+        interpolateFrames(p, fiA, fiB)
+        step = min(maxStep, (fiB-fiA)*2)
+        fiA = fiB
+        lmFrame = cvp.last_motion_frame
+        lmFI = cvp.lmFI
+        for fi in [k for k in buf.keys() if k <= fiA]: del buf[fi]
+        if time()-lastMsgTime > 0.2:
+            msg = "Re-analysis: %i/ %i (analysed: %i)"%(fiA, fi1, nAnalysed)
+            q2m.put((msg,), True, None)
+            lastMsgTime = time()
+    if vCap != None: vCap.release()
+    cvp.rCache.flush()
+    q2m.put(("Finished", fi0, p.oData[fi0:fi1+1].copy()), True, None)
+
+#=======================================================================
+
 if __name__ == '__main__':
     pass
 
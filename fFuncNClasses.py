@@ -7,7 +7,7 @@ Dependency:
     Numpy (1.17), 
 """
 
-import sys, errno
+import sys, errno, hashlib
 from os import path, strerror
 from datetime import datetime
 
@@ -17,6 +17,8 @@ import numpy as np
 import cv2
 
 DEBUG = False
+# values of non-numeric strings in result data (CSV) cells
+CELL_VOCAB = {"None":None, "D":"D", "True":True, "False":False}
 
 #-----------------------------------------------------------------------
 
@@ -166,8 +168,13 @@ def str2num(s, c=''):
     
     oNum = None 
     if c != '': # conversion method is given
-        try: oNum = eval('%s(%s)'%(c, s)) # try the intended conversion
-        except: pass
+        conv = dict(int=int, float=float).get(c, None)
+        if conv == None: return None
+        try: oNum = conv(s) # try the intended conversion
+        except:
+            # such as '3.0' for 'int'
+            try: oNum = conv(float(s))
+            except: pass
     else: # no conversion is specified
         try:
             oNum = int(s) # try to convert to integer first
@@ -178,6 +185,102 @@ def str2num(s, c=''):
 
 #-----------------------------------------------------------------------
 
+def parse_cell(s):
+    """ Function to convert a cell string of result data 
+    to its value.
+    
+    Args: 
+        s (str): String of a cell.
+
+    Returns:
+        (None/ str/ bool/ int/ float/ str): 
+          None for 'None', 'D' for 'D', bool for 'True'/'False',
+          number for numeric string, otherwise the string itself.
+
+    Examples:
+        >>> print(parse_cell('None'))
+        None
+        >>> parse_cell('D')
+        'D'
+        >>> parse_cell('True')
+        True
+        >>> parse_cell('-45')
+        -45
+    """
+    if DEBUG: print("fFuncNClasses.parse_cell()")
+   
+    if s in CELL_VOCAB: return CELL_VOCAB[s]
+    oNum = str2num(s)
+    if oNum == None: return s
+    return oNum
+
+#-----------------------------------------------------------------------
+
+def parse_int_col(col):
+    """ Function to convert an array of cell strings of result data
+    (such as a column of data) to integers at once.
+    
+    Args: 
+        col (numpy.ndarray): Array of strings.
+
+    Returns:
+        vals (numpy.ndarray): Integer values. 0 where it's not an integer.
+        isInt (numpy.ndarray): Boolean array; whether each cell
+          was an integer (such as False for 'None' or 'D').
+
+    Examples:
+        >>> parse_int_col(np.array(['-45', 'None', 'D', '3']))
+        (array([-45,   0,   0,   3]), array([ True, False, False,  True]))
+    """
+    if DEBUG: print("fFuncNClasses.parse_int_col()")
+    
+    col = np.asarray(col, dtype=str)
+    vals = np.zeros(col.shape, dtype=np.int64)
+    if col.size == 0: return vals, np.zeros(col.shape, dtype=bool)
+    # integer string; digits with an optional sign
+    isInt = np.char.isdigit(np.char.lstrip(np.char.strip(col), '+-'))
+    isInt &= (np.char.count(col, '-') + np.char.count(col, '+')) <= 1
+    try: vals[isInt] = col[isInt].astype(np.int64)
+    except ValueError: isInt[:] = False # leave all to conversion below
+    ### other strings, which are not in vocabulary of cells,
+    ###   such as '3.0'; convert one by one 
+    isOther = ~isInt & ~np.isin(col, list(CELL_VOCAB.keys()))
+    for idx in zip(*np.nonzero(isOther)):
+        v = str2num(col[idx], 'int')
+        if v != None:
+            vals[idx] = v
+            isInt[idx] = True
+    return vals, isInt
+
+#-----------------------------------------------------------------------
+
+def get_param_hash(param, keys=None):
+    """ Function to get a hash string of parameter values.
+    
+    Args: 
+        param (dict): Parameter dictionary such as aecParam,
+          of which each item has a 'value' key.
+        keys (None/list): Keys of parameters to include in the hash.
+          All the keys are used, when it's None.
+
+    Returns:
+        (str): Hash string (MD5 hex-digest).
+
+    Examples:
+        >>> get_param_hash({"a": dict(value=1), "b": dict(value=[2,3])})
+        '3a0fccf7178b0f42bc9288675aa3e0e2'
+    """
+    if DEBUG: print("fFuncNClasses.get_param_hash()")
+    
+    if keys == None: keys = sorted(param.keys())
+    txt = ""
+    for k in keys:
+        if not k in param.keys(): continue
+        txt += "%s:%s;"%(k, str(param[k]["value"]))
+    return hashlib.md5(txt.encode("utf-8")).hexdigest()
+
+#-----------------------------------------------------------------------
+
 def load_img(fp, size=(-1,-1), flag='wx'):
     """ Load an image using wxPython or OpenCV functions.
 
@@ -484,19 +587,24 @@ def convt_180_to_360(ang):
     """ convert -180~180 degree to 0~360 degree
 
     Args:
-        angle (int): Output angle, 0 indicates right, 90 indicates up, 
-            180 indicates left, -90 indicates down
+        angle (int/numpy.ndarray): Output angle, 0 indicates right, 
+            90 indicates up, 180 indicates left, -90 indicates down
         
     Returns:
-       angle (int): Input angle. 0 indicates right, 90 indicates up,
-            180 indicates left, 270 indicates down. 
+       angle (int/numpy.ndarray): Input angle. 0 indicates right, 
+            90 indicates up, 180 indicates left, 270 indicates down. 
     
     Examples:
         >>> convt_180_to_360(45)
         45
         >>> convt_180_to_360(-45)
         315
+        >>> convt_180_to_360(np.array([45, -45]))
+        array([ 45, 315])
     """ 
+    if np.ndim(ang) > 0:
+        ang = np.asarray(ang)
+        return np.where(ang < 0, 360 + ang, ang)
     if ang < 0: ang = 360 + ang
     return ang
 
@@ -506,19 +614,27 @@ def convt_360_to_180(angle):
     """ Convert 360 degree system to 180 degree system.
 
     Args:
-        angle (int): Input angle. 0 indicates right, 90 indicates up,
-            180 indicates left, 270 indicates down.
+        angle (int/numpy.ndarray): Input angle. 0 indicates right, 
+            90 indicates up, 180 indicates left, 270 indicates down.
 
     Returns:
-        angle (int): Output angle, 0 indicates right, 90 indicates up, 
-            180 indicates left, -90 indicates down
+        angle (int/numpy.ndarray): Output angle, 0 indicates right, 
+            90 indicates up, 180 indicates left, -90 indicates down
 
     Examples:
         >>> convt_360_to_180(90)
         90
         >>> convt_360_to_180(270)
         -90
+        >>> convt_360_to_180(np.array([90, 270, 360]))
+        array([ 90, -90,   0])
     """
+    if np.ndim(angle) > 0:
+        angle = np.asarray(angle)
+        isOver = angle > 180
+        # 1 for angles, which are not converted, to avoid modulo by zero
+        divisor = np.where(isOver, angle, 1)
+        return np.where(isOver, -(360 % divisor), angle)
     if angle <= 180: return angle
     else: return -(360 % angle)
 
@@ -528,16 +644,17 @@ def calc_pt_w_angle_n_dist(angle, dist, bPosX=0, bPosY=0, flagScreen=False):
     """ Calculates a point when a angle and a distance is given.
 
     Args:
-        angle (int): 0 indicates right, 90 indicates up, 
+        angle (int/numpy.ndarray): 0 indicates right, 90 indicates up, 
             180 or -180 indicates left, -90 indicates down.
-        dist (int): Distance in pixel.
-        bPosX (int): x-coordinate of base-position.
-        bPosY (int): y-coordinate of base-position.
+        dist (int/numpy.ndarray): Distance in pixel.
+        bPosX (int/numpy.ndarray): x-coordinate of base-position.
+        bPosY (int/numpy.ndarray): y-coordinate of base-position.
         flagScreen (bool): whether it's for displaying it on screen.
           (y coordinate will be reversed)
 
     Returns:
-        (int, int): x,y coordinate
+        (int, int): x,y coordinate. 
+          Each is numpy.ndarray, when any of input is an array.
 
     Examples:
         >>> calc_pt_w_angle_n_dist(90, 20)
@@ -550,11 +667,19 @@ def calc_pt_w_angle_n_dist(angle, dist, bPosX=0, bPosY=0, flagScreen=False):
         (85, 85)
         >>> calc_pt_w_angle_n_dist(-135, 20, 100, 100, True)
         (85, 114)
+        >>> calc_pt_w_angle_n_dist(np.array([90, -135]), 20, 100, 100, True)
+        (array([100,  85]), array([ 80, 114]))
     """
     if DEBUG: print("fFuncNClasses.calc_pt_w_angle_n_dist()")
 
     s = np.sin(np.deg2rad(angle))
     c = np.cos(np.deg2rad(angle))
+    if max([np.ndim(v) for v in (angle, dist, bPosX, bPosY)]) > 0:
+        ### array; truncate toward zero as int() 
+        x = np.trunc(bPosX + c*dist).astype(np.int64)
+        if flagScreen: y = np.trunc(bPosY - s*dist).astype(np.int64)
+        else: y = np.trunc(bPosY + s*dist).astype(np.int64)
+        return (x, y)
     x = int(bPosX + c*dist)
     if flagScreen: y = int(bPosY - s*dist)
     else: y = int(bPosY + s*dist)
@@ -568,9 +693,12 @@ def calc_line_angle(pt1, pt2):
     Args:
         pt1 (tuple): x, y coordinate of the first point
         pt2 (tuple): x, y coordinate of the second point
+          * x and y can be arrays (such as columns of data) 
+            for calculating angles of multiple lines.
 
     Returns:
-        (int): angle of the line; 0=right, 90=upward, -90=downward, 180=left
+        (int/numpy.ndarray): angle of the line; 
+          0=right, 90=upward, -90=downward, 180=left
 
     Examples:
         >>> calc_line_angle((0,0), (1,0))
@@ -579,8 +707,12 @@ def calc_line_angle(pt1, pt2):
         -45
         >>> calc_line_angle((0,0), (-1,-1))
         135
+        >>> calc_line_angle((0,0), (np.array([1,1,-1]), np.array([0,1,-1])))
+        array([  0, -45, 135])
     """
-    return int(np.degrees(np.arctan2(-(pt2[1]-pt1[1]),pt2[0]-pt1[0])))
+    ang = np.degrees(np.arctan2(-(pt2[1]-pt1[1]),pt2[0]-pt1[0]))
+    if np.ndim(ang) > 0: return np.trunc(ang).astype(np.int64)
+    return int(ang)
 
 #-----------------------------------------------------------------------
 
@@ -588,11 +720,11 @@ def calc_angle_diff(ang1, ang2):
     """ Calculates angle difference between two angles
 
     Args:
-        ang1 (int): Angle between -180 and 180
-        ang2 (int): Angle between -180 and 180
+        ang1 (int/numpy.ndarray): Angle between -180 and 180
+        ang2 (int/numpy.ndarray): Angle between -180 and 180
 
     Returns:
-        (int): Angle difference (smallest)
+        (int/numpy.ndarray): Angle difference (smallest)
 
     Examples:
         >>> calc_angle_diff(0, 90)
@@ -601,7 +733,16 @@ def calc_angle_diff(ang1, ang2):
         135
         >>> calc_angle_diff(180, -90)
         90
+        >>> calc_angle_diff(np.array([0, 180, 180]), np.array([90, 45, -90]))
+        array([ 90, 135,  90])
     """
+    if np.ndim(ang1) > 0 or np.ndim(ang2) > 0:
+        ang1 = np.asarray(ang1)
+        ang2 = np.asarray(ang2)
+        sameSign = (ang1 >= 0) == (ang2 >= 0)
+        ad1 = np.abs(ang1) + np.abs(ang2)
+        ad2 = 360 - ad1
+        return np.where(sameSign, np.abs(ang1-ang2), np.minimum(ad1, ad2))
     angle_diff = 0
     if (ang1 >= 0 and ang2 >= 0) or (ang1 < 0 and ang2 < 0):
         angle_diff = abs(ang1-ang2)
@@ -613,6 +754,29 @@ def calc_angle_diff(ang1, ang2):
 
 #-----------------------------------------------------------------------
 
+def calc_signed_angle_diff(ang1, ang2):
+    """ Calculates signed (shortest) angle difference from ang1 to ang2
+
+    Args:
+        ang1 (int/float/numpy.ndarray): Angle between -180 and 180
+        ang2 (int/float/numpy.ndarray): Angle between -180 and 180
+
+    Returns:
+        (int/float/numpy.ndarray): Angle difference between -180 and 180.
+          Positive value means counter-clockwise rotation from ang1.
+
+    Examples:
+        >>> calc_signed_angle_diff(0, 90)
+        90
+        >>> calc_signed_angle_diff(170, -170)
+        20
+        >>> calc_signed_angle_diff(-170, 170)
+        -20
+    """
+    return (ang2 - ang1 + 180) % 360 - 180
+
+#-----------------------------------------------------------------------
+
 def calc_pt_line_dist(pt, line, flag_line_ends=True):
     """ Calculates distance from a point to a line
 
@@ -657,11 +821,15 @@ def rot_pt(pt, ct, deg):
     where 0 is the top row and the row index increases as it comes down
 
     Args:
+        pt (tuple): Point to rotate
         ct (tuple): Center point
-        deg (int): Angel to rotate
+        deg (int/numpy.ndarray): Angel to rotate
+          * x and y of 'pt' and 'deg' can be arrays 
+            for rotating multiple points.
 
     Returns:
         (tuple): Rotated point. 
+          x and y are numpy.ndarray, when any of input is an array.
     
     Examples:
         >>> rot_pt((2,2), (1,1), 45)
@@ -670,6 +838,8 @@ def rot_pt(pt, ct, deg):
         (0, 0)
         >>> rot_pt((2,2), (1,1), -90)
         (0, 2)
+        >>> rot_pt((2,2), (1,1), np.array([45, 180, -90]))
+        (array([2, 0, 0]), array([1, 0, 2]))
     """ 
     if DEBUG: print("fFuncNClasses.rot_pt()")
 
@@ -678,6 +848,8 @@ def rot_pt(pt, ct, deg):
     ty = pt[1]-ct[1]
     x = (tx * np.cos(r) + ty * np.sin(r)) + ct[0]
     y = (-tx * np.sin(r) + ty * np.cos(r)) + ct[1]
+    if np.ndim(x) > 0:
+        return (np.round(x).astype(np.int64), np.round(y).astype(np.int64))
     return (int(np.round(x)), int(np.round(y)))
 
 #-----------------------------------------------------------------------
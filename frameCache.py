@@ -0,0 +1,270 @@
+# coding: UTF-8
+
+"""
+Raw frame cache and proxy video of a video for pyABC.
+Frames are decoded once in a streaming pass and written to a NumPy (.npy)
+  file, which is read back with memory-mapping (np.memmap),
+  so that repeated passes over a video (analysis with different
+  parameters, re-analysis, parameter sweep, saving video) don't decode
+  the video again, and a frame with any index is read directly.
+The cache can be made with a reduced resolution; it's used only
+  when the same scale is requested, because coordinates of result data
+  depend on the frame size. pyABC.py analyses with the full resolution
+  cache, while reviseCSV_HD.py browses with a reduced resolution one
+  (when there's no proxy video), scaling coordinates of data.
+A proxy video is an all-intra (MJPEG), reduced resolution copy 
+  of a video, which is used by reviseCSV_HD.py for browsing, 
+  because seeking in it doesn't require decoding of 
+  full resolution frames.
+
+Usage:
+    python frameCache.py [video-file-path] [scale (optional; 0.0-1.0)]
+    python frameCache.py -proxy [video-file-path] [max. height (optional)]
+
+Dependency:
+    NumPy (1.17)
+    OpenCV (4.1)
+"""
+
+from glob import glob, escape
+from os import path, remove, rename
+import struct
+from sys import argv
+from time import time
+
+import cv2
+import numpy as np
+
+DEBUG = False
+
+#-----------------------------------------------------------------------
+
+def get_frame_cache_fp(vFP, scale=1.0):
+    """ Get file path of frame cache of a video.
+
+    Args:
+        vFP (str): File path of video.
+        scale (float): Scale of frame size of the cache.
+
+    Returns:
+        (str): File path of frame cache.
+
+    Examples:
+        >>> get_frame_cache_fp("data/rat1.mp4")
+        'data/rat1.mp4_frames.npy'
+        >>> get_frame_cache_fp("data/rat1.mp4", 0.5)
+        'data/rat1.mp4_frames_x0.50.npy'
+    """
+    if DEBUG: print("frameCache.get_frame_cache_fp()")
+
+    if scale == 1.0: return vFP + "_frames.npy"
+    else: return vFP + "_frames_x%.2f.npy"%(scale)
+
+#-----------------------------------------------------------------------
+
+def open_frame_cache(vFP, scale=1.0):
+    """ Open frame cache of a video with memory-mapping, if it exists.
+
+    Args:
+        vFP (str): File path of video.
+        scale (float): Scale of frame size of the cache.
+
+    Returns:
+        (None/numpy.memmap): Read-only frames (nFrames, height, width, 3).
+    """
+    if DEBUG: print("frameCache.open_frame_cache()")
+
+    fp = get_frame_cache_fp(vFP, scale)
+    if not path.isfile(fp): return None
+    return np.load(fp, mmap_mode='r')
+
+#-----------------------------------------------------------------------
+
+def list_frame_cache_scales(vFP):
+    """ Get scales of existing frame caches of a video.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (list): Sorted scales (float).
+    """
+    if DEBUG: print("frameCache.list_frame_cache_scales()")
+
+    scales = []
+    if path.isfile(get_frame_cache_fp(vFP)): scales.append(1.0)
+    for fp in glob(escape(vFP) + "_frames_x*.npy"):
+        try: scales.append(float(fp[len(vFP + "_frames_x"):-len(".npy")]))
+        except ValueError: pass
+    return sorted(scales)
+
+#-----------------------------------------------------------------------
+
+def build_frame_cache(vFP, scale=1.0, q2m=None):
+    """ Decode all frames of a video and write them to frame cache.
+    Frames are written to a temporary file, which is renamed
+      only when all frames were written, therefore an incomplete cache
+      is never used.
+
+    Args:
+        vFP (str): File path of video.
+        scale (float): Scale of frame size of the cache.
+        q2m (None/queue.Queue): Queue to send progress message.
+
+    Returns:
+        fp (str): File path of frame cache.
+    """
+    if DEBUG: print("frameCache.build_frame_cache()")
+
+    fp = get_frame_cache_fp(vFP, scale)
+    tmpFP = fp + ".tmp"
+    vCap = cv2.VideoCapture(vFP)
+    nFrames = int(vCap.get(cv2.CAP_PROP_FRAME_COUNT))
+    ret, frame = vCap.read()
+    if not ret:
+        vCap.release()
+        raise IOError("Failed to read a frame from %s"%(vFP))
+    if scale != 1.0:
+        w = int(round(frame.shape[1]*scale))
+        h = int(round(frame.shape[0]*scale))
+    else:
+        h, w = frame.shape[:2]
+    frames = np.lib.format.open_memmap(tmpFP,
+                                       mode='w+',
+                                       dtype=np.uint8,
+                                       shape=(nFrames, h, w, 3))
+    fi = 0
+    lastMsgTime = time()
+    while ret and fi < nFrames:
+        if scale != 1.0:
+            cv2.resize(frame, (w, h), dst=frames[fi],
+                       interpolation=cv2.INTER_AREA)
+        else:
+            frames[fi] = frame
+        fi += 1
+        if q2m != None and time()-lastMsgTime > 0.2:
+            q2m.put(("Building frame cache.. %i/%i"%(fi, nFrames),), True, None)
+            lastMsgTime = time()
+        ret, frame = vCap.read()
+    vCap.release()
+    frames.flush()
+    del frames
+    if fi < nFrames:
+    # frame count in video header was larger than the number of
+    #   decodable frames; store only decoded frames
+        with open(tmpFP, "r+b") as f:
+            ### rewrite header with the new shape, keeping its length
+            ###   (padded with spaces), so that data offset doesn't change
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(f)
+                lenFmt = "<H" # format of header length field
+            else:
+                np.lib.format.read_array_header_2_0(f)
+                lenFmt = "<I"
+            hLen = f.tell() # whole header length (data offset)
+            magic = np.lib.format.magic(*version)
+            hdrLen = hLen - len(magic) - struct.calcsize(lenFmt)
+            hdr = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }"%(
+                            np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                            str((fi, h, w, 3)))
+            hdr = (hdr.ljust(hdrLen-1) + "\n").encode("latin1")
+            f.seek(0)
+            f.write(magic + struct.pack(lenFmt, hdrLen) + hdr)
+            ### cut off the space of frames, which were not decoded
+            f.truncate(hLen + fi*h*w*3)
+    if path.isfile(fp): remove(fp)
+    rename(tmpFP, fp)
+    return fp
+
+#-----------------------------------------------------------------------
+
+def get_proxy_fp(vFP):
+    """ Get file path of proxy video of a video.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (str): File path of proxy video.
+
+    Examples:
+        >>> get_proxy_fp("data/rat1.mp4")
+        'data/rat1.mp4_proxy.avi'
+    """
+    if DEBUG: print("frameCache.get_proxy_fp()")
+
+    return vFP + "_proxy.avi"
+
+#-----------------------------------------------------------------------
+
+def build_proxy(vFP, maxSz=(1920, 540), q2m=None):
+    """ Transcode a video to an all-intra (MJPEG) proxy video,
+    of which frame size fits in 'maxSz'.
+    Every decoded frame is written, so that frame-indices of 
+      the proxy match the ones of the original video.
+
+    Args:
+        vFP (str): File path of video.
+        maxSz (tuple): Maximum width and height of proxy video.
+        q2m (None/queue.Queue): Queue to send progress message.
+
+    Returns:
+        fp (str): File path of proxy video.
+    """
+    if DEBUG: print("frameCache.build_proxy()")
+
+    fp = get_proxy_fp(vFP)
+    tmpFP = fp.replace(".avi", "_tmp.avi")
+    vCap = cv2.VideoCapture(vFP)
+    nFrames = int(vCap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = vCap.get(cv2.CAP_PROP_FPS)
+    if fps <= 0: fps = 30
+    ret, frame = vCap.read()
+    if not ret:
+        vCap.release()
+        raise IOError("Failed to read a frame from %s"%(vFP))
+    h, w = frame.shape[:2]
+    scale = min(1.0, float(maxSz[0])/w, float(maxSz[1])/h)
+    pSz = (int(round(w*scale)), int(round(h*scale))) # proxy frame size
+    video_rec = cv2.VideoWriter(tmpFP, 
+                                fourcc=cv2.VideoWriter_fourcc(*"MJPG"), 
+                                fps=fps, 
+                                frameSize=pSz, 
+                                isColor=True)
+    fi = 0
+    lastMsgTime = time()
+    while ret:
+        if scale != 1.0:
+            frame = cv2.resize(frame, pSz, interpolation=cv2.INTER_AREA)
+        video_rec.write(frame)
+        fi += 1
+        if q2m != None and time()-lastMsgTime > 0.2:
+            q2m.put(("Building proxy video.. %i/%i"%(fi, nFrames),), True, None)
+            lastMsgTime = time()
+        ret, frame = vCap.read()
+    vCap.release()
+    video_rec.release()
+    if path.isfile(fp): remove(fp)
+    rename(tmpFP, fp)
+    return fp
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    if len(argv) < 2:
+        print("Usage: python frameCache.py [video-file-path] [scale]")
+        print("       python frameCache.py -proxy [video-file-path] [max-h]")
+    elif argv[1] == "-proxy":
+        maxSz = (1920, 540)
+        if len(argv) > 3: maxSz = (np.inf, int(argv[3])) # only height
+        t = time()
+        fp = build_proxy(argv[2], maxSz)
+        print("%s was written. (%.1f s)"%(fp, time()-t))
+    else:
+        scale = 1.0
+        if len(argv) > 2: scale = float(argv[2])
+        t = time()
+        fp = build_frame_cache(argv[1], scale)
+        print("%s was written. (%.1f s)"%(fp, time()-t))
+
@@ -0,0 +1,457 @@
+# coding: UTF-8
+
+"""
+Parameter sweep for pyABC.
+Combinations of parameter (aecParam) values are evaluated on sampled
+  frames of a video and ranked by head direction error against
+  a manually coded (ground-truth) result CSV file.
+Output of each pipeline stage (background subtraction, edge detection,
+  contour data) is cached with the frame-index and hash of its upstream
+  parameters, so that changing only a downstream parameter
+  (such as 'contourTh') doesn't repeat decoding, background subtraction
+  and edge detection.
+
+Dependency:
+    NumPy (1.17)
+    OpenCV (4.1)
+"""
+
+import queue
+from collections import OrderedDict
+from copy import deepcopy
+from itertools import product
+from time import time
+
+import cv2
+import numpy as np
+
+from cv_proc import CVProc, HeadlessParent
+from fFuncNClasses import get_param_hash, calc_angle_diff
+from frameCache import open_frame_cache
+from arena import crop_frame
+
+DEBUG = False
+
+#=======================================================================
+
+class MemoCVProc(CVProc):
+    """ CVProc, which caches output of background subtraction,
+    edge detection and contour data with the frame-index and
+    hash of upstream parameters.
+    Cached images are set read-only, so that a cached result is never
+      modified by later processing.
+
+    Args:
+        parent (HeadlessParent): Parent object.
+        nKeep (int): Number of parameter hashes to keep in cache
+          of each stage.
+    """
+    def __init__(self, parent, nKeep=2):
+        if DEBUG: print("MemoCVProc.__init__()")
+        CVProc.__init__(self, parent)
+
+        ##### [begin] setting up attributes -----
+        self.nKeep = nKeep
+        self.stageKeys = dict(
+                    bgs=["bgsMExOIter", "bgsMExCIter", "bgsThres"],
+                    edge=["bgsMExOIter", "bgsMExCIter", "bgsThres",
+                          "cannyTh"],
+                    cnt=["bgsMExOIter", "bgsMExCIter", "bgsThres",
+                         "cannyTh", "contourTh"],
+                    ) # parameter keys, each stage depends on
+        self.memo = {} # cache; {stage: OrderedDict(param-hash: {fi: output})}
+        for k in self.stageKeys.keys(): self.memo[k] = OrderedDict()
+        self.lastOut = dict(bgs=None, edge=None) # last image output of
+          # each stage, to recognize whether input of the next stage
+          # is the output of this stage
+        self.nHit = 0 # number of cache hits
+        self.nMiss = 0 # number of cache misses
+        ##### [end] setting up attributes -----
+
+    #-------------------------------------------------------------------
+
+    def getMemo(self, stage):
+        """ Get cache dictionary of the stage with the current parameters.
+
+        Args:
+            stage (str): Stage name; bgs, edge or cnt.
+
+        Returns:
+            (dict): Cached output of the stage; {frame-index: output}.
+        """
+        if DEBUG: print("MemoCVProc.getMemo()")
+
+        pHash = get_param_hash(self.p.aecParam, self.stageKeys[stage])
+        m = self.memo[stage]
+        if pHash in m.keys():
+            m.move_to_end(pHash)
+        else:
+            m[pHash] = {}
+            while len(m) > self.nKeep: m.popitem(last=False)
+        return m[pHash]
+
+    #-------------------------------------------------------------------
+
+    def procBGSubtraction(self, img, bgImg):
+        """ Background subtraction with cache.
+        'img' is assumed to be the frame image of the current frame-index.
+        """
+        if DEBUG: print("MemoCVProc.procBGSubtraction()")
+
+        m = self.getMemo("bgs")
+        fi = self.p.vRW.fi
+        if fi in m.keys():
+            self.nHit += 1
+        else:
+            self.nMiss += 1
+            diffCol, diff = CVProc.procBGSubtraction(self, img, bgImg)
+            # copy, because they're buffers of self.bgSub
+            diffCol = diffCol.copy()
+            diff = diff.copy()
+            diffCol.flags.writeable = False
+            diff.flags.writeable = False
+            m[fi] = (diffCol, diff)
+        self.lastOut["bgs"] = m[fi][1]
+        return m[fi]
+
+    #-------------------------------------------------------------------
+
+    def getEdged(self, greyImg):
+        """ Edge detection with cache.
+        Cache is used only when 'greyImg' is the output of
+          procBGSubtraction of the current frame.
+        """
+        if DEBUG: print("MemoCVProc.getEdged()")
+
+        if greyImg is not self.lastOut["bgs"]:
+            self.lastOut["edge"] = None
+            return CVProc.getEdged(self, greyImg)
+        m = self.getMemo("edge")
+        fi = self.p.vRW.fi
+        if fi in m.keys():
+            self.nHit += 1
+        else:
+            self.nMiss += 1
+            m[fi] = CVProc.getEdged(self, greyImg)
+            m[fi].flags.writeable = False
+        self.lastOut["edge"] = m[fi]
+        return m[fi]
+
+    #-------------------------------------------------------------------
+
+    def getCntData(self, img):
+        """ Contour data with cache.
+        Cache is used only when 'img' is the output of
+          getEdged of the current frame.
+        """
+        if DEBUG: print("MemoCVProc.getCntData()")
+
+        if img is not self.lastOut["edge"]:
+            return CVProc.getCntData(self, img)
+        m = self.getMemo("cnt")
+        fi = self.p.vRW.fi
+        if fi in m.keys():
+            self.nHit += 1
+        else:
+            self.nMiss += 1
+            m[fi] = CVProc.getCntData(self, img)
+        cnt_info, cnt_pts, cnt_br, cnt_cpt = m[fi]
+        return list(cnt_info), cnt_pts, cnt_br, cnt_cpt
+
+#=======================================================================
+
+class ParamSweep:
+    """ Evaluate combinations of parameter values on sampled frames
+    against ground-truth data.
+    Frames are sampled as short segments of consecutive frames,
+      because head direction of a frame depends on the previous frame.
+      Data of the frame before each segment is seeded with
+      the ground-truth data.
+
+    Args:
+        app (AnimalBehaviourCoderFrame): App frame.
+        gtFP (str): File path of ground-truth (result) CSV file.
+        grid (dict): Candidate values of parameters;
+          {parameter-key: [value1, value2, ...]}.
+        nSeg (int): Number of segments to sample.
+        segLen (int): Number of frames in each segment.
+
+    Attributes:
+        Each attribute is commented in 'setting up attributes' section.
+    """
+    def __init__(self, app, gtFP, grid, nSeg=10, segLen=10):
+        if DEBUG: print("ParamSweep.__init__()")
+
+        ##### [begin] setting up attributes -----
+        self.vFP = app.fPath # video file path
+        self.gtFP = gtFP
+        self.parent = HeadlessParent(app.getProcInfo())
+        self.cvp = MemoCVProc(self.parent)
+        if type(app.cv_proc.bg) == np.ndarray:
+            self.cvp.bg = app.cv_proc.bg.copy()
+        self.gtRows = self.loadGroundTruth(gtFP) # {frame-index: row}
+        self.gt = {} # ground-truth head direction; {frame-index: hD}
+        for fi in self.gtRows.keys():
+            try: self.gt[fi] = int(self.gtRows[fi][self.parent.hdi])
+            except: pass
+        self.segments = self.sampleSegments(nSeg, segLen)
+        self.frames = {} # decoded frame images; {frame-index: image}
+        ### order keys, so that upstream parameters of pipeline stages
+        ###   change the slowest, to make the most of the cache
+        keys = []
+        for k in self.cvp.stageKeys["cnt"] + sorted(grid.keys()):
+            if k in grid.keys() and not k in keys: keys.append(k)
+        self.keys = keys
+        self.combos = list(product(*[grid[k] for k in keys]))
+          # combinations of parameter values
+        ##### [end] setting up attributes -----
+
+    #-------------------------------------------------------------------
+
+    def loadGroundTruth(self, gtFP):
+        """ Load ground-truth data from a result CSV file.
+        Columns are mapped with the column heads.
+
+        Args:
+            gtFP (str): File path of ground-truth (result) CSV file.
+
+        Returns:
+            gtRows (dict): {frame-index: tuple of values in dataCols order}.
+        """
+        if DEBUG: print("ParamSweep.loadGroundTruth()")
+
+        p = self.parent
+        gtRows = {}
+        colIdx = None # index of each data column in CSV lines
+        f = open(gtFP, 'r')
+        lines = f.readlines()
+        f.close()
+        for line in lines:
+            items = [x.strip() for x in line.split(',')]
+            if items[0] == "frame-index":
+                colIdx = []
+                for col in p.dataCols:
+                    if col in items: colIdx.append(items.index(col))
+                    else: colIdx.append(-1)
+                continue
+            if colIdx == None: continue
+            try: fi = int(items[0])
+            except: continue
+            if fi >= p.vRW.nFrames: continue
+            row = []
+            for ci in range(len(p.dataCols)):
+                if colIdx[ci] == -1 or colIdx[ci] >= len(items):
+                    row.append(p.dataInitVal[ci])
+                else:
+                    row.append(items[colIdx[ci]])
+            gtRows[fi] = tuple(row)
+        return gtRows
+
+    #-------------------------------------------------------------------
+
+    def sampleSegments(self, nSeg, segLen):
+        """ Sample segments of consecutive frames,
+        starting at frames with ground-truth head direction.
+
+        Args:
+            nSeg (int): Number of segments to sample.
+            segLen (int): Number of frames in each segment.
+
+        Returns:
+            segments (list): List of lists of frame-indices.
+        """
+        if DEBUG: print("ParamSweep.sampleSegments()")
+
+        gtFIs = sorted(self.gt.keys())
+        if len(gtFIs) == 0: return []
+        idx = np.linspace(0, len(gtFIs)-1, min(nSeg, len(gtFIs)))
+        segments = []
+        lastFI = -1 # last frame-index of the previous segment
+        for i in np.unique(idx.astype(int)):
+            s = max(gtFIs[i], lastFI+1)
+            e = min(s+segLen, self.parent.vRW.nFrames)
+            if s >= e: continue
+            segments.append(list(range(s, e)))
+            lastFI = e-1
+        return segments
+
+    #-------------------------------------------------------------------
+
+    def decodeFrames(self, q2m=None):
+        """ Decode frames of the sampled segments
+        (and the frame before each segment for motion detection).
+        Frames are read sequentially, without seeking,
+          to match frame-indices of the ground-truth data exactly.
+          Unneeded frames are only grabbed.
+          When frame cache of the video is available, frames are read 
+          from it instead.
+        Frames are cropped to arena of the video, when it's set.
+
+        Args:
+            q2m (None/queue.Queue): Queue to send progress to main.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ParamSweep.decodeFrames()")
+
+        needed = set()
+        for seg in self.segments:
+            needed.update(seg)
+            if seg[0] > 0: needed.add(seg[0]-1)
+        if len(needed) == 0: return
+        lastFI = max(needed)
+        fCache = open_frame_cache(self.vFP) # frame cache of the video
+        if fCache is not None:
+        # frames are read directly from frame cache
+            for fi in sorted(needed):
+                if fi >= fCache.shape[0]: break
+                self.frames[fi] = crop_frame(fCache[fi], 
+                                             self.parent.vRW.arena, 
+                                             True)
+            return
+        vCap = cv2.VideoCapture(self.vFP)
+        for fi in range(lastFI+1):
+            if fi in needed:
+                ret, frame = vCap.read()
+                if not ret: break
+                self.frames[fi] = crop_frame(frame, self.parent.vRW.arena)
+            else:
+                if not vCap.grab(): break
+            if q2m != None and fi % 100 == 0:
+                q2m.put(("Decoding frames.. %i/%i"%(fi, lastFI),), True, None)
+        vCap.release()
+
+    #-------------------------------------------------------------------
+
+    def evalCombo(self, combo):
+        """ Evaluate one combination of parameter values.
+
+        Args:
+            combo (tuple): Parameter values in the order of self.keys.
+
+        Returns:
+            rslt (dict): Evaluation result.
+        """
+        if DEBUG: print("ParamSweep.evalCombo()")
+
+        p = self.parent
+        cvp = self.cvp
+        for i, k in enumerate(self.keys):
+            p.aecParam[k]["value"] = deepcopy(combo[i])
+        cvp.resetState()
+        # no last motion frame; not to depend on the previous combo
+        cvp.last_motion_frame = None
+        cvp.lmFI = None
+        errs = [] # head direction errors
+        nMissing = 0 # number of frames, where head direction is missing
+        for seg in self.segments:
+            s = seg[0]
+            if s > 0:
+                ### seed the frame before the segment with ground-truth
+                p.oData[s-1] = self.gtRows.get(s-1, tuple(p.dataInitVal))
+                if s-1 in self.frames.keys():
+                    cvp.last_motion_frame = self.frames[s-1]
+                    cvp.lmFI = s-1
+                else:
+                    cvp.last_motion_frame = None
+                    cvp.lmFI = None
+            else:
+                cvp.last_motion_frame = None
+                cvp.lmFI = None
+            for fi in seg:
+                if not fi in self.frames.keys(): break
+                p.oData[fi] = tuple(p.dataInitVal)
+                p.vRW.fi = fi
+                p.vRW.currFrame = self.frames[fi]
+                x, flagMHPos = cvp.getXDict()
+                ret, __ = cvp.proc_img(self.frames[fi].copy(),
+                                       p.animalECase,
+                                       x,
+                                       flagMHPos)
+                p.oData[fi] = cvp.getODataRow(ret)
+                if not fi in self.gt.keys(): continue
+                if type(ret["hD"]) == int:
+                    errs.append(calc_angle_diff(self.gt[fi], ret["hD"]))
+                else:
+                    nMissing += 1
+                    errs.append(180) # maximum error for missing data
+        rslt = dict(param=dict(zip(self.keys, deepcopy(combo))),
+                    nEval=len(errs),
+                    nMissing=nMissing)
+        if len(errs) > 0:
+            rslt["meanErr"] = float(np.mean(errs))
+            rslt["medianErr"] = float(np.median(errs))
+        else:
+            rslt["meanErr"] = 180.0
+            rslt["medianErr"] = 180.0
+        return rslt
+
+    #-------------------------------------------------------------------
+
+    def run(self, q2m, q2t):
+        """ Run parameter sweep (in a thread).
+
+        Args:
+            q2m (queue.Queue): Queue to send data to main.
+            q2t (queue.Queue): Queue to receive data from main.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ParamSweep.run()")
+
+        startTime = time()
+        self.decodeFrames(q2m)
+        results = []
+        for ci, combo in enumerate(self.combos):
+            try: msg = q2t.get(False)
+            except queue.Empty: msg = None
+            if msg == "quit": break
+            results.append(self.evalCombo(combo))
+            msg = "Parameter sweep.. %i/%i"%(ci+1, len(self.combos))
+            msg += " [cache hit %i, miss %i]"%(self.cvp.nHit, self.cvp.nMiss)
+            q2m.put((msg,), True, None)
+        # rank by mean error, then by number of missing data
+        results = sorted(results, key=lambda r: (r["meanErr"], r["nMissing"]))
+        q2m.put(("Finished", results, time()-startTime), True, None)
+
+    #-------------------------------------------------------------------
+
+    def saveResults(self, results, fp):
+        """ Save ranked results to a CSV file.
+
+        Args:
+            results (list): Ranked results of evaluation.
+            fp (str): File path to save.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ParamSweep.saveResults()")
+
+        fh = open(fp, 'w')
+        fh.write("Ground-truth, %s\n"%(self.gtFP))
+        segTxt = ["%i-%i"%(seg[0], seg[-1]) for seg in self.segments]
+        fh.write("Segments, %s\n"%("/".join(segTxt)))
+        fh.write('-----\n')
+        line = "rank, meanErr, medianErr, nMissing, nEval, "
+        line += ", ".join(self.keys) + "\n"
+        fh.write(line)
+        for ri, r in enumerate(results):
+            line = "%i, %.3f, %.3f, %i, %i"%(ri+1,
+                                             r["meanErr"],
+                                             r["medianErr"],
+                                             r["nMissing"],
+                                             r["nEval"])
+            for k in self.keys:
+                val = str(r["param"][k])
+                if "," in val: val = val.replace(",", "/")
+                line += ", %s"%(val)
+            fh.write(line + "\n")
+        fh.close()
+
+#=======================================================================
+
+if __name__ == '__main__':
+    pass
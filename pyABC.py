@@ -70,9 +70,11 @@ v.0.3.1: (2020.02)
 
 import queue
 from threading import Thread 
+from multiprocessing import Process, cpu_count
+from multiprocessing import Queue as MPQueue
 from os import getcwd, path
 from sys import argv
-from copy import copy
+from copy import copy, deepcopy
 from time import time, sleep
 from datetime import timedelta
 from glob import glob
@@ -83,9 +85,12 @@ import wx.lib.scrolledpanel as SPanel
 import cv2
 import numpy as np
 
-from cv_proc import CVProc
+from cv_proc import CVProc, reanalyseFrames, reanalyseFramesAdaptive
+from paramSweep import ParamSweep
 #from reviseCSV import ReviseCSV
 from videoRW import VideoRW
+from arena import crop_frame
+from resultCache import ResultCache
 from fFuncNClasses import GNU_notice, get_time_stamp, writeFile, getWXFonts
 from fFuncNClasses import load_img, add2gbs, setupStaticText, PopupDialog
 from fFuncNClasses import updateFrameSize, receiveDataFromQueue, stopAllTimers
@@ -144,7 +149,13 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         self.vRecSzR = 0.25 # ratio to the original frame size 
         self.isRunning = False # analysis is running by pressing spacebar
         self.isLBPressed = False # whether left mouse button is pressed or not
+        self.isSettingArena = False # whether dragging on the image sets
+          # arena of the video, instead of head direction
         self.flagBlockUI = False # block user input 
+        self.paramSweep = None # ParamSweep object, while sweep is running
+        self.reanalysis = None # info of re-analysis, while it's running
+        self.nReanalysisProc = max(1, cpu_count()-1) # number of worker 
+          # processes for extracting candidates in re-analysis
         ### description of parameters
         self.paramDesc = {} 
         d = "Number of iterations of morphologyEx (for reducing noise"
@@ -175,6 +186,45 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         self.paramDesc["uDegTh"] = d 
         d = "Number of clusters for k-means clustering."
         self.paramDesc["uNKMC"] = d 
+        d = "Whether to use temporal filter (circular alpha-beta filter)"
+        d += " of head direction and position (1: use, 0: not use)."
+        d += " When it's used, head direction, which differs more than"
+        d += " uDegTh from the predicted one, is treated as an outlier."
+        d += " The tolerable difference widens with each consecutive"
+        d += " outlier, so that tracking can recover."
+        self.paramDesc["uHDFilter"] = d 
+        d = "Alpha (gain for correcting head direction and position"
+        d += " with a measurement) of temporal filter. 0.0 - 1.0"
+        self.paramDesc["hdfAlpha"] = d 
+        d = "Beta (gain for correcting change rate of head direction"
+        d += " and position with a measurement) of temporal filter."
+        d += " 0.0 - 1.0"
+        self.paramDesc["hdfBeta"] = d 
+        d = "Whether to track head between full detections with optical"
+        d += " flow (pyramidal Lucas-Kanade) of feature points around"
+        d += " the head (1: use, 0: not use)."
+        self.paramDesc["uLKTrack"] = d 
+        d = "Number of frames, after which full detection is done again,"
+        d += " when head is tracked with optical flow."
+        self.paramDesc["lkInterval"] = d 
+        d = "Minimum confidence (ratio of feature points, which moved"
+        d += " consistently) of tracking with optical flow."
+        d += " Full detection is done, when it's lower. 0.0 - 1.0"
+        self.paramDesc["lkMinConf"] = d 
+        d = "Maximum step (number of frames) of adaptive sampling in"
+        d += " re-analysis. Frames between analysed frames are interpolated,"
+        d += " when head direction changed smoothly. 1 means that"
+        d += " all frames are analysed."
+        self.paramDesc["uAdaptStep"] = d 
+        d = "Maximum change of head direction (in degrees) between"
+        d += " analysed frames, with which frames in between are"
+        d += " interpolated in adaptive sampling. With a larger change,"
+        d += " frames in between are analysed further."
+        self.paramDesc["adaptDegTh"] = d 
+        d = "Minimum confidence of head direction of an analysed frame,"
+        d += " with which frames in between are interpolated in adaptive"
+        d += " sampling. 0.0 - 1.0"
+        self.paramDesc["adaptMinConf"] = d 
         # animal experiment cases
         self.animalECaseChoices = [
                             'Macaque19',
@@ -190,12 +240,34 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         self.dispImgTypeChoices = ["RGB", "Greyscale(Diff)"] #"Greyscale(Edge)"
         # current display image type
         self.dispImgType = self.dispImgTypeChoices[0]
+        # display rate choice (while continuous analysis is running)
+        self.dispRateChoices = ["Every frame",
+                                "30 FPS",
+                                "10 FPS",
+                                "2 FPS",
+                                "Every 10th frame",
+                                "Every 100th frame"]
+        self.dispMaxFPS = 10 # max. number of frames to display per second,
+          # while continuous analysis is running (0 means no limit)
+        self.dispEveryNFrame = 1 # display every n-th frame,
+          # while continuous analysis is running
+        self.lastDispTime = 0 # time when an analyzed image was last displayed
+        self.ckptInterval = 300 # interval (in frames) to write checkpoint 
+          # of tracker state (checkpoint.py) during continuous analysis;
+          # 0 means no checkpoint
+        self.pendingDispImg = None # the latest analyzed image,
+          # which was not displayed due to the display rate
+        self.dispBmp = None # reusable bitmap for displaying analyzed image
+        self.dispBuf = {} # reusable image arrays for displaying image
         self.frameImgFNformat = "f%06i.jpg"
         self.lpWid = [] # wx widgets in left panel
         self.ratFImgDispImg = None # ratio between frame image and 
           # display image on app
         self.flagContManualInput = False # continuous manual input
-        self.dataGridSelectedCells = []
+        self.dataGridSelRanges = [] # selected ranges of cells in data grid;
+          # [(first-row, first-col, last-row, last-col), ...]
+        self.dataGridDirtyRows = [-1, -1] # range of rows in data grid,
+          # which were updated but not refreshed (re-drawn) yet
         self.setDataCols() # set ouput data columns (self.dataCols),
           # initival values (self.dataInitVal) and column indices 
         self.cv_proc = CVProc(self) # computer vision processing module
@@ -233,6 +305,13 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
         add2gbs(self.gbs["tp"], btn, (row,col), (1,1))
         '''
+        col += 1
+        btn = wx.Button(self.panel["tp"],
+                        -1,
+                        label="Set arena",
+                        name="arena_btn")
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        add2gbs(self.gbs["tp"], btn, (row,col), (1,1))
         col += 1 
         add2gbs(self.gbs["tp"],
                 wx.StaticLine(self.panel["tp"],
@@ -278,9 +357,26 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                             self.panel["tp"],
                             -1,
                             name="imgType_cho",
-                            choices=self.dispImgTypeChoices, 
+                            choices=self.dispImgTypeChoices,
+                       )
+        cho.Bind(wx.EVT_CHOICE, self.onChoice)
+        add2gbs(self.gbs["tp"], cho, (row,col), (1,1))
+        col += 1
+        sTxt = setupStaticText(
+                            self.panel["tp"],
+                            "Display-rate: ",
+                            font=self.fonts[2],
+                            )
+        add2gbs(self.gbs["tp"], sTxt, (row,col), (1,1))
+        col += 1
+        cho = wx.Choice(
+                            self.panel["tp"],
+                            -1,
+                            name="dispRate_cho",
+                            choices=self.dispRateChoices,
                        )
         cho.Bind(wx.EVT_CHOICE, self.onChoice)
+        cho.SetSelection(self.dispRateChoices.index("10 FPS"))
         add2gbs(self.gbs["tp"], cho, (row,col), (1,1))
         col += 1
         add2gbs(self.gbs["tp"],
@@ -369,7 +465,9 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         nCol = 2
         self.gbs["rp"] = wx.GridBagSizer(0,0)
         row = 0; col = 0
-        self.dataGrid = Grid(self.panel["rp"], np.empty((0,0), dtype=np.uint8))
+        self.dataGrid = Grid(self.panel["rp"], 
+                             self, 
+                             size=(pi["rp"]["sz"][0]-10, pi["rp"]["sz"][1]-75))
         self.Bind(wx.grid.EVT_GRID_CELL_CHANGED, self.onDataGridCellChanged)
         self.Bind(wx.grid.EVT_GRID_SELECT_CELL, self.onDataGridCellSelected)
         self.Bind(wx.grid.EVT_GRID_RANGE_SELECT, self.onDataGridCellsSelected)
@@ -509,6 +607,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                              "bPosX", # body postion (x) 
                              "bPosY", # body position (y)
                              "remarks", 
+                             "hDConf", # confidence of head direction
                             ] # data columns 
             self.dataInitVal = [
                                 "None", # hD 
@@ -519,6 +618,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                                 "None", # bPosX 
                                 "None", # bPosY 
                                 "None", # remarks
+                                "None", # hDConf
                                ] # initial values for data columns
             ### store indices for each data column
             self.hdi = self.dataCols.index("hD")
@@ -528,6 +628,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             self.mhpi = self.dataCols.index("mHPos")
             self.bxi = self.dataCols.index("bPosX")
             self.byi = self.dataCols.index("bPosY")
+            self.hdci = self.dataCols.index("hDConf")
             self.dataStruct = [
                      ('hD', (np.str_, 4)), # head direction
                      ('mHD', (np.str_, 5)), # head direction is manually fixed
@@ -537,6 +638,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                      ('bPosX', (np.str_, 4)), # base position (x) 
                      ('bPosY', (np.str_, 4)), # base position (y) 
                      ('remarks', (np.str_, 20)), # remakrs
+                     ('hDConf', (np.str_, 4)), # confidence of head direction
                      ] # data types for numpy structured array
        
         '''
@@ -662,6 +764,22 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
         self.lpWid.append(btn)
         add2gbs(self.gbs["lp"], btn, (row,col), (1,3))
+        row += 1; col = 0
+        btn = wx.Button(self.panel["lp"],
+                        -1,
+                        label="Sweep parameters",
+                        name="sweepParam_btn")
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        self.lpWid.append(btn)
+        add2gbs(self.gbs["lp"], btn, (row,col), (1,3))
+        row += 1; col = 0
+        btn = wx.Button(self.panel["lp"],
+                        -1,
+                        label="Re-analyse selection",
+                        name="reanalyse_btn")
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        self.lpWid.append(btn)
+        add2gbs(self.gbs["lp"], btn, (row,col), (1,3))
         ###
         self.panel["lp"].SetSizer(self.gbs["lp"])
         self.gbs["lp"].Layout()
@@ -696,6 +814,15 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             self.aecParam["motionTh"] = dict(value=[35, 100])
             self.aecParam["hdLineLen"] = dict(value=50)
             self.aecParam["uDegTh"] = dict(value=20)
+            self.aecParam["uHDFilter"] = dict(value=0)
+            self.aecParam["hdfAlpha"] = dict(value=0.6)
+            self.aecParam["hdfBeta"] = dict(value=0.1)
+            self.aecParam["uLKTrack"] = dict(value=0)
+            self.aecParam["lkInterval"] = dict(value=10)
+            self.aecParam["lkMinConf"] = dict(value=0.5)
+            self.aecParam["uAdaptStep"] = dict(value=1)
+            self.aecParam["adaptDegTh"] = dict(value=10)
+            self.aecParam["adaptMinConf"] = dict(value=0.5)
         
         elif self.animalECase == "Macaque19":
         # Macaque monkey experiment in 2019 
@@ -762,6 +889,12 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             #self.aecParam["uCol3Min"] = dict(value=[150,120,100])
             self.aecParam["uCol4Min"] = dict(value=[150,120,120])
             self.aecParam["uCol4Max"] = dict(value=[200,255,230])
+            self.aecParam["uLKTrack"] = dict(value=0)
+            self.aecParam["lkInterval"] = dict(value=10)
+            self.aecParam["lkMinConf"] = dict(value=0.5)
+            self.aecParam["uAdaptStep"] = dict(value=1)
+            self.aecParam["adaptDegTh"] = dict(value=10)
+            self.aecParam["adaptMinConf"] = dict(value=0.5)
 
         elif self.animalECase == "Rat05": 
         # Rat tracking in 2005 (for testing purpose) 
@@ -774,6 +907,15 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             self.aecParam["hdLineLen"] = dict(value=30)
             self.aecParam["uDegTh"] = dict(value=30)
             self.aecParam["uNKMC"] = dict(value=4)
+            self.aecParam["uHDFilter"] = dict(value=0)
+            self.aecParam["hdfAlpha"] = dict(value=0.6)
+            self.aecParam["hdfBeta"] = dict(value=0.1)
+            self.aecParam["uLKTrack"] = dict(value=0)
+            self.aecParam["lkInterval"] = dict(value=10)
+            self.aecParam["lkMinConf"] = dict(value=0.5)
+            self.aecParam["uAdaptStep"] = dict(value=1)
+            self.aecParam["adaptDegTh"] = dict(value=10)
+            self.aecParam["adaptMinConf"] = dict(value=0.5)
         
         '''
         elif self.animalECase == "Dove19": 
@@ -844,12 +986,19 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             self.startStopAnalyzeVideo()
         elif objName == "quit_btn":
             self.onClose(None)
+        elif objName == "arena_btn":
+            self.toggleArenaSetting()
         elif objName == "nextFrame_btn":
             self.onRight(True)
         elif objName == "jump2frame_btn":
             self.jumpToFrame()
         elif objName == "applyParam_btn":
             self.applyChangedParam()
+        elif objName == "sweepParam_btn":
+            self.startParamSweep()
+        elif objName == "reanalyse_btn":
+            if self.reanalysis == None: self.startReanalysis()
+            else: self.reanalysis["q2t"].put("quit", True, None) # cancel
         elif objName.endswith("_help_btn"):
             key = objName.replace("_help_btn", "")
             msg = self.aecParam[key]["desc"]
@@ -894,9 +1043,21 @@ class AnimalBehaviourCoderFrame(wx.Frame):
 
         if objName == "imgType_cho":
         # display image type changed
-            self.dispImgType = objVal 
+            self.dispImgType = objVal
             self.proc_img()
 
+        if objName == "dispRate_cho":
+        # display rate (during continuous analysis) changed
+            if objVal == "Every frame":
+                self.dispMaxFPS = 0
+                self.dispEveryNFrame = 1
+            elif objVal.endswith("FPS"):
+                self.dispMaxFPS = int(objVal.split(" ")[0])
+                self.dispEveryNFrame = 1
+            else: # every n-th frame
+                self.dispMaxFPS = 0
+                self.dispEveryNFrame = int(objVal.split(" ")[1].rstrip("thd"))
+
     #-------------------------------------------------------------------
 
     def onCheckBox(self, event, objName=""):
@@ -933,6 +1094,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 obj.SetValue(val) 
                 self.flagContManualInput = val
             self.cv_proc.last_motion_frame = self.vRW.currFrame.copy()
+            self.cv_proc.lmFI = self.vRW.fi
     
     #-------------------------------------------------------------------
        
@@ -987,6 +1149,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         if self.fPath == '': return 
         if self.isRunning == False:
             if self.vRW.fi >= self.vRW.nFrames-1: return
+            if self.reanalysis != None: return # re-analysis is running
             self.isRunning = True
             self.fps = 0
             self.last_fps_time = time()
@@ -1000,6 +1163,8 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             sTxt = wx.FindWindowByName("fps_sTxt", self.panel["tp"])
             sTxt.SetLabel('')
             self.isRunning = False # stop continuous analysis
+            self.flushPendingDisplay() # show the latest analyzed result
+            self.cv_proc.rCache.flush() # write cached results
             
     #-------------------------------------------------------------------
     
@@ -1030,6 +1195,12 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 hPos = ( int(mp[0]*r), int(mp[1]*r) )
             else:
                 hPos = (mp[0], mp[1])
+            if self.isSettingArena:
+                ### draw arena rectangle
+                img = self.tmp_img.copy()
+                cv2.rectangle(img, self.bPos, hPos, (0,255,255), 2)
+                self.displayAnalyzedImage(img, True)
+                return
             mInput = dict(hPosX=hPos[0], hPosY=hPos[1], 
                           bPosX=self.bPos[0], bPosY=self.bPos[1]) 
             ret, frame_arr = self.cv_proc.proc_img(self.tmp_img.copy(), 
@@ -1049,6 +1220,12 @@ class AnimalBehaviourCoderFrame(wx.Frame):
             hPos = (int(mp[0]*r), int(mp[1]*r))
         else:
             hPos = (mp[0], mp[1])
+        if self.isSettingArena:
+            self.setArena(self.bPos + hPos)
+            self.isLBPressed = False
+            self.bPos = None
+            self.tmp_img = None
+            return
         self.oData[self.vRW.fi][self.mhpi] = "True"
         self.oData[self.vRW.fi][self.mhdi] = "True"
         mInput = dict(hPosX=hPos[0], hPosY=hPos[1], 
@@ -1063,6 +1240,9 @@ class AnimalBehaviourCoderFrame(wx.Frame):
     def onMRBU_dispImg(self, event):
         if DEBUG: print("AnimalBehaviourCoderFrame.onMRBU_dispImg()")
         if self.fPath == '': return
+        if self.isSettingArena:
+            self.setArena(None) # remove arena
+            return
         for ci in range(len(self.dataCols)):
             col = str(self.dataCols[ci])
             if ('PosX' in col) or ('PosY' in col) or \
@@ -1077,27 +1257,36 @@ class AnimalBehaviourCoderFrame(wx.Frame):
 
     #-------------------------------------------------------------------
     
-    def applyChangedParam(self):
-        """ Apply changed parameters.
+    def getParamValsFromUI(self):
+        """ Get parameter values entered in the left panel.
+        Multiple candidate values of a parameter (for parameter sweep)
+          can be entered, separated with '|'. 
+          e.g.: '30|50|70' for contourTh, '10,30|20,40' for cannyTh.
 
         Args: None
 
-        Returns: None
+        Returns:
+            pVals (None/dict): Candidate values of each parameter;
+              {parameter-key: [value1, value2, ...]}.
+              None, when an entered value was not valid.
         """ 
-        if DEBUG: print("AnimalBehaviourCoderFrame.applyChangedParam()")
+        if DEBUG: print("AnimalBehaviourCoderFrame.getParamValsFromUI()")
+        
         ecp = self.aecParam
+        pVals = {}
         for key in sorted(ecp.keys()):
             valWid = wx.FindWindowByName( '%s_txt'%(key), self.panel["lp"] )
-            val = valWid.GetValue().strip()
             currVal = ecp[key]["value"]
-            if type(currVal) == list:
-                vals = val.split(",")
-                if len(currVal) != len(vals):
-                    msg = "There should be %i items"%(len(ecp[key]))
-                    msg += " for %s."%(key)
-                    wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
-                    return
-                else:
+            pVals[key] = []
+            for val in valWid.GetValue().strip().split("|"):
+                val = val.strip()
+                if type(currVal) == list:
+                    vals = val.split(",")
+                    if len(currVal) != len(vals):
+                        msg = "There should be %i items"%(len(currVal))
+                        msg += " for %s."%(key)
+                        wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+                        return None
                     for i in range(len(vals)):
                         try:
                             if key.startswith("ColorHPos"):
@@ -1107,45 +1296,371 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                         except:
                             msg = "Data type of %s doesn't match."%(key)
                             wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
-                            return
-                for i in range(len(vals)): ecp[key]["value"][i] = vals[i]
-            else:
-                try: val = int(val)
-                except:
-                    try: val = float(val)
+                            return None
+                    pVals[key].append(vals)
+                else:
+                    try: val = int(val)
                     except:
-                        msg = "%s should be a number."%(key)
-                        wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
-                        return
-                self.aecParam[key]["value"] = val
+                        try: val = float(val)
+                        except:
+                            msg = "%s should be a number."%(key)
+                            wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+                            return None
+                    pVals[key].append(val)
+        return pVals
+    
+    #-------------------------------------------------------------------
+    
+    def applyChangedParam(self):
+        """ Apply changed parameters.
+
+        Args: None
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.applyChangedParam()")
+        
+        pVals = self.getParamValsFromUI()
+        if pVals == None: return
+        for key in pVals.keys():
+            if len(pVals[key]) > 1:
+                msg = "Multiple values are entered for %s."%(key)
+                msg += " Please use 'Sweep parameters' to evaluate them."
+                wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+                return
+        for key in pVals.keys():
+            self.aecParam[key]["value"] = pVals[key][0]
         self.proc_img() # process image
         msg = "Successfully updated."
         wx.MessageBox(msg, "Info", wx.OK|wx.ICON_INFORMATION)
     
     #-------------------------------------------------------------------
     
-    def displayAnalyzedImage(self, img):
-        """ Display the image, analyzed with cv_proc, in StaticBitmap object
+    def startParamSweep(self):
+        """ Start parameter sweep with entered candidate values 
+        of parameters, evaluating them against a ground-truth CSV file.
+
+        Args: None
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.startParamSweep()")
+        
+        if self.fPath == '' or self.isRunning or self.th != None: return
+        if self.reanalysis != None: return
+        pVals = self.getParamValsFromUI()
+        if pVals == None: return
+        grid = {} # parameters with multiple candidate values
+        nCombo = 1 # number of combinations
+        for key in pVals.keys():
+            if len(pVals[key]) > 1:
+                grid[key] = pVals[key]
+                nCombo *= len(pVals[key])
+            else:
+                self.aecParam[key]["value"] = pVals[key][0]
+        if grid == {}:
+            msg = "No parameter has multiple values."
+            msg += " Enter candidate values, separated with '|'."
+            wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+            return
+        ### choose ground-truth (manually coded result) CSV file
+        wc = "CSV files (*.csv)|*.csv" 
+        dlg = wx.FileDialog(self, 
+                            "Choose ground-truth CSV file", 
+                            defaultDir=path.dirname(self.fPath),
+                            wildcard=wc, 
+                            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() == wx.ID_CANCEL: return
+        gtFP = dlg.GetPath()
+        dlg.Destroy()
+        
+        self.paramSweep = ParamSweep(self, gtFP, grid)
+        if self.paramSweep.segments == []:
+            msg = "No head direction data found in %s."%(gtFP)
+            wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+            self.paramSweep = None
+            return
+        ### start thread
+        self.th = Thread(target=self.paramSweep.run, 
+                         args=(self.q2m, self.q2t,))
+        self.th.start()
+        ### set timer for receiving progress
+        self.timer["paramSweep"] = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER,
+                  lambda event: self.onTimer(event, "paramSweep"),
+                  self.timer["paramSweep"])
+        self.timer["paramSweep"].Start(100)
+        self.flagBlockUI = True
+    
+    #-------------------------------------------------------------------
+    
+    def finishParamSweep(self, results, eTime):
+        """ Show and save results of parameter sweep.
+
+        Args:
+            results (list): Ranked evaluation results.
+            eTime (float): Elapsed time (in seconds).
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.finishParamSweep()")
+        
+        self.flagBlockUI = False
+        ps = self.paramSweep
+        self.paramSweep = None
+        sTxt = wx.FindWindowByName("navProg_sTxt", self.panel["rp"])
+        sTxt.SetLabel("-")
+        if results == []: return
+        ext = "." + self.fPath.split(".")[-1]
+        fp = self.fPath.replace(ext, "_sweep.csv")
+        ps.saveResults(results, fp)
+        ### show the best results
+        msg = "Evaluated %i combinations"%(len(results))
+        msg += " in %.1f seconds.\n"%(eTime)
+        msg += "(rank: mean error/ median error/ missing)\n\n"
+        for ri in range(min(5, len(results))):
+            r = results[ri]
+            msg += "%i: %.1f/ %.1f/ %i\n"%(ri+1, 
+                                            r["meanErr"], 
+                                            r["medianErr"], 
+                                            r["nMissing"])
+            for k in ps.keys: msg += "    %s: %s\n"%(k, str(r["param"][k]))
+        msg += "\nAll results were saved in %s.\n"%(path.basename(fp))
+        msg += "Apply parameters of the 1st rank?"
+        dlg = PopupDialog(self, 
+                          title="Parameter sweep", 
+                          msg=msg, 
+                          size=(500, 500),
+                          flagCancelBtn=True)
+        rslt = dlg.ShowModal()
+        dlg.Destroy()
+        if rslt == wx.ID_OK:
+            for k in ps.keys:
+                val = results[0]["param"][k]
+                self.aecParam[k]["value"] = val
+                valWid = wx.FindWindowByName('%s_txt'%(k), self.panel["lp"])
+                valWid.SetValue(str(val).strip("[]"))
+            self.proc_img()
+    
+    #-------------------------------------------------------------------
+    
+    def getProcInfo(self):
+        """ Get info for processing frames without UI
+        (cv_proc.HeadlessParent).
+
+        Args: None
+
+        Returns:
+            (dict): Processing info.
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.getProcInfo()")
+        
+        colIdx = {} # column indices
+        for k in ["hdi", "mhdi", "hxi", "hyi", "mhpi", "bxi", "byi", "hdci"]:
+            colIdx[k] = getattr(self, k)
+        return dict(animalECase=self.animalECase,
+                    aecParam=deepcopy(self.aecParam),
+                    dataCols=list(self.dataCols),
+                    dataInitVal=list(self.dataInitVal),
+                    dataStruct=list(self.dataStruct),
+                    colIdx=colIdx,
+                    nFrames=self.vRW.nFrames,
+                    arena=self.vRW.arena)
+    
+    #-------------------------------------------------------------------
+    
+    def startReanalysis(self):
+        """ Re-analyse selected frames (rows in data grid) 
+        with the current parameters in a worker process.
+        When no rows are selected, frames from the current frame 
+          to the last frame are re-analysed.
+        Rows with manually determined head direction are kept untouched.
+
+        Args: None
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.startReanalysis()")
+        
+        if self.fPath == '' or self.isRunning or self.th != None: return
+        
+        pVals = self.getParamValsFromUI()
+        if pVals == None: return
+        for key in pVals.keys():
+            if len(pVals[key]) > 1:
+                msg = "Multiple values are entered for %s."%(key)
+                wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
+                return
+            self.aecParam[key]["value"] = pVals[key][0]
+        
+        if len(self.dataGridSelRanges) > 0:
+            fi0 = min([sr[0] for sr in self.dataGridSelRanges])
+            fi1 = max([sr[2] for sr in self.dataGridSelRanges])
+        else:
+            fi0 = self.vRW.fi
+            fi1 = self.vRW.nFrames-1
+        q2m = MPQueue()
+        q2t = MPQueue()
+        bg = self.cv_proc.bg
+        if type(bg) == np.ndarray: bg = bg.copy()
+        args = (self.getProcInfo(), 
+                self.fPath,
+                bg,
+                fi0,
+                self.oData[max(0, fi0-1):fi1+1].copy(),
+                q2m,
+                q2t,)
+        if self.aecParam["uAdaptStep"]["value"] > 1:
+        # analyse sampled frames and interpolate others
+            proc = Process(target=reanalyseFramesAdaptive, args=args)
+        else:
+            proc = Process(target=reanalyseFrames, 
+                           args=args+(self.nReanalysisProc,))
+        # not daemonic, to be able to start its own worker processes;
+        #   stopped with stopReanalysis()
+        proc.daemon = False
+        proc.start()
+        self.reanalysis = dict(proc=proc, q2m=q2m, q2t=q2t, fi0=fi0, fi1=fi1)
+        ### set timer for receiving progress
+        self.timer["reanalysis"] = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER,
+                  lambda event: self.onTimer(event, "reanalysis"),
+                  self.timer["reanalysis"])
+        self.timer["reanalysis"].Start(100)
+        btn = wx.FindWindowByName("reanalyse_btn", self.panel["lp"])
+        btn.SetLabel("Cancel re-analysis")
+    
+    #-------------------------------------------------------------------
+    
+    def stopReanalysis(self):
+        """ Stop re-analysis process and its worker processes.
+
+        Args: None
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.stopReanalysis()")
+        
+        proc = self.reanalysis["proc"]
+        # request to quit, so that worker processes are terminated as well
+        self.reanalysis["q2t"].put("quit", True, None)
+        proc.join(3)
+        if proc.is_alive(): proc.terminate()
+    
+    #-------------------------------------------------------------------
+    
+    def finishReanalysis(self, fi0, newRows):
+        """ Swap re-analysed data into the output data.
+
+        Args:
+            fi0 (int): The first frame-index of re-analysed frames.
+            newRows (None/numpy.ndarray): Re-analysed data.
+              None, when re-analysis was cancelled.
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.finishReanalysis()")
+        
+        self.timer["reanalysis"].Stop()
+        self.timer["reanalysis"] = None
+        self.reanalysis["proc"].join()
+        self.reanalysis = None
+        btn = wx.FindWindowByName("reanalyse_btn", self.panel["lp"])
+        btn.SetLabel("Re-analyse selection")
+        sTxt = wx.FindWindowByName("navProg_sTxt", self.panel["rp"])
+        sTxt.SetLabel("-")
+        if type(newRows) != np.ndarray or len(self.oData) == 0: return
+        
+        fi1 = fi0 + len(newRows) - 1
+        ### keep rows, which were manually fixed during re-analysis
+        curr = self.oData[fi0:fi1+1]
+        isManual = curr[self.dataCols[self.mhdi]] == "True"
+        newRows[isManual] = curr[isManual]
+        self.oData[fi0:fi1+1] = newRows # swap in data
+        self.markDataGridDirty(fi0, fi1)
+        self.refreshDataGrid()
+        if fi0 <= self.vRW.fi <= fi1: self.proc_img()
+    
+    #-------------------------------------------------------------------
+    
+    def displayAnalyzedImage(self, img, flagForce=False):
+        """ Display the image, analyzed with cv_proc, in StaticBitmap object.
+        While continuous analysis is running, the image is displayed only
+          when it's due according to the display rate (dispMaxFPS and
+          dispEveryNFrame). Otherwise, it's kept as a pending image,
+          so that the latest result can be shown later.
 
         Args:
             img (numpy.ndarray): Image to display
+            flagForce (bool): Display the image regardless of display rate.
 
         Returns:
-            None
+            (bool): Whether the image was displayed.
         """ 
         if DEBUG: print("AnimalBehaviourCoderFrame.displayAnalyzedImage()")
         
-        if self.ratFImgDispImg != 1.0:
-            img = cv2.resize(img, 
-                             (0,0), 
-                             fx=self.ratFImgDispImg, 
-                             fy=self.ratFImgDispImg)
+        if self.isRunning and not flagForce:
+            isDue = True
+            if self.vRW.fi % self.dispEveryNFrame != 0: isDue = False
+            elif self.dispMaxFPS > 0 and \
+              time()-self.lastDispTime < 1.0/self.dispMaxFPS:
+                isDue = False
+            if not isDue:
+                self.pendingDispImg = img # keep the latest analyzed image
+                return False
+        self.pendingDispImg = None
+        self.lastDispTime = time()
+
+        r = self.ratFImgDispImg
+        dSz = (int(round(img.shape[1]*r)), int(round(img.shape[0]*r)))
+        if self.dispBmp is None or tuple(self.dispBmp.GetSize()) != dSz:
+            ### (re-)allocate bitmap and image arrays for display
+            self.dispBmp = wx.Bitmap(dSz[0], dSz[1], 24)
+            self.dispBuf["rsz"] = np.empty((dSz[1], dSz[0], 3), np.uint8)
+            self.dispBuf["rgb"] = np.empty((dSz[1], dSz[0], 3), np.uint8)
+        
+        if r != 1.0:
+            img = cv2.resize(img, dSz, dst=self.dispBuf["rsz"])
         
         ### display image 
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        wxImg = wx.Image(img.shape[1], img.shape[0])
-        wxImg.SetData(img.tostring())
-        self.dispImg_sBmp.SetBitmap(wxImg.ConvertToBitmap())
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.dispBuf["rgb"])
+        self.dispBmp.CopyFromBuffer(self.dispBuf["rgb"])
+        self.dispImg_sBmp.SetBitmap(self.dispBmp)
+        self.dispImg_sBmp.Refresh()
+        return True
+    
+    #-------------------------------------------------------------------
+    
+    def updateDataGridCursor(self):
+        """ Update data grid position to make data of the current frame
+        visible.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.updateDataGridCursor()")
+
+        self.dataGrid.MakeCellVisible(self.vRW.fi, 0)
+        self.dataGrid.SelectRow(self.vRW.fi)
+        self.dataGrid.SetGridCursor(self.vRW.fi, 0)
+    
+    #-------------------------------------------------------------------
+    
+    def flushPendingDisplay(self):
+        """ Display the latest analyzed image and data, which were skipped 
+        due to the display rate.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.flushPendingDisplay()")
+
+        if self.pendingDispImg is None: return
+        self.displayAnalyzedImage(self.pendingDispImg, True)
+        self.updateDataGridCursor()
+        self.refreshDataGrid()
     
     #-------------------------------------------------------------------
     
@@ -1162,32 +1677,8 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         if DEBUG: print("AnimalBehaviourCoderFrame.proc_img()")
         if self.fPath == '': return
         
-        ### set temporary (for processing the current frame) 
-        ###   dictionary to store values
-        x = {} # temp. dictionary
-        flagMHPos = False 
-        for dIdx, dCol in enumerate(self.dataCols):
-            if mInput != None and dCol in mInput.keys():
-            # manual input is given
-                x[dCol] = mInput[dCol]
-                flagMHPos = True
-            elif self.oData[self.vRW.fi][dIdx] != 'None':
-            # already calculated data available
-                x[dCol] = self.oData[self.vRW.fi][dIdx]
-            else:
-                x[dCol] = self.dataInitVal[dIdx]
-            ### convert value to integer if applicable
-            try: x[dCol] = int(x[dCol])
-            except: pass
-            ### data from previous frame
-            pk = "p_" + dCol
-            if self.vRW.fi == 0:
-                x[pk] = self.dataInitVal[dIdx] 
-            else:
-                x[pk] = self.oData[self.vRW.fi-1][dIdx]
-                if not x[pk] in ['None', 'D', 'True', 'False']:
-                    try: x[pk] = int(x[pk])
-                    except: pass
+        # temporary dictionary to store values of the current frame
+        x, flagMHPos = self.cv_proc.getXDict(mInput)
         
         # process 
         ret, frame_arr = self.cv_proc.proc_img(self.vRW.currFrame.copy(), 
@@ -1196,29 +1687,33 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                                                flagMHPos,
                                                self.dispImgType)
         # display the processed frame 
-        self.displayAnalyzedImage(frame_arr)
+        isDisplayed = self.displayAnalyzedImage(frame_arr)
         
         ### update oData
-        for dIdx, dCol in enumerate(self.dataCols):
-            self.oData[self.vRW.fi][dIdx] = str(ret[dCol])
+        self.oData[self.vRW.fi] = self.cv_proc.getODataRow(ret)
         
         if self.flagContManualInput:
             self.oData[self.vRW.fi][self.mhdi] = "True"
         
         if self.oData[self.vRW.fi][self.mhpi] == "True":
         # head position is manually determined via mouse-click on image 
-            for i in range(len(self.dataGridSelectedCells)):
-            # going through all selected cells 
-                ri = self.dataGridSelectedCells[i][0] # row index
-                if ri != self.vRW.fi:
-                    # copy data of the current frame 
-                    #   to other selected frames 
-                    self.oData[ri] = copy(self.oData[self.vRW.fi]) 
+            row = self.oData[self.vRW.fi].copy()
+            for r0, __, r1, __ in self.dataGridSelRanges:
+                # copy data of the current frame to selected frames 
+                self.oData[r0:r1+1] = row
+                self.markDataGridDirty(r0, r1)
+        self.markDataGridDirty(self.vRW.fi)
+
+        if self.isRunning and self.ckptInterval > 0 and \
+          (self.vRW.fi+1) % self.ckptInterval == 0:
+            # write tracker state, so that analysis can be resumed
+            #   from the next frame
+            self.cv_proc.saveCheckpoint(self.fPath)
       
-        ### update data grid position to make newly calculated data visible 
-        self.dataGrid.MakeCellVisible(self.vRW.fi, 0)
-        self.dataGrid.SelectRow(self.vRW.fi)
-        self.dataGrid.SetGridCursor(self.vRW.fi, 0)
+        if isDisplayed:
+            # update data grid position to make newly calculated data visible
+            self.updateDataGridCursor()
+            self.refreshDataGrid() # re-draw updated rows
          
         if self.isRunning:
             if self.vRW.fi < self.vRW.nFrames-1: # there's more frames to run
@@ -1236,13 +1731,15 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         """
         if DEBUG: print("AnimalBehaviourCoderFrame.initDataWithLoadedVideo()") 
         
-        ### check bg file
-        #bgFile = self.fPath + "_bg.jpg"
+        self.cv_proc.resetState() # reset states kept over frames
+        self.cv_proc.lmFI = None # last motion frame (if any) is of 
+          # the previous video
+        # results of frames, analysed before with the same parameters, 
+        #   are served from result cache
+        self.cv_proc.rCache = ResultCache(self.fPath, self.dataStruct)
+
+        self.loadBG() # load background image, if it exists
         ext = "." + self.fPath.split(".")[-1]
-        bgFile = self.fPath.replace(ext, "_bg.jpg")
-        if path.isfile(bgFile):
-            # load background image
-            self.cv_proc.bg = load_img(bgFile, flag='cv')
         
         if self.flagVRec:
             ### start video recorder
@@ -1297,6 +1794,113 @@ class AnimalBehaviourCoderFrame(wx.Frame):
     
     #-------------------------------------------------------------------
     
+    def loadBG(self):
+        """ Load background image of the video, cropped to its arena. 
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.loadBG()")
+        
+        self.cv_proc.bg = None
+        ### check bg file
+        #bgFile = self.fPath + "_bg.jpg"
+        ext = "." + self.fPath.split(".")[-1]
+        bgFile = self.fPath.replace(ext, "_bg.jpg")
+        if path.isfile(bgFile):
+            # load background image
+            bg = load_img(bgFile, flag='cv')
+            self.cv_proc.bg = crop_frame(bg, self.vRW.arena)
+    
+    #-------------------------------------------------------------------
+    
+    def toggleArenaSetting(self):
+        """ Start/stop setting arena of the video. 
+        While it's on, a rectangle, dragged on the frame image, 
+          becomes arena and right-click removes arena.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.toggleArenaSetting()")
+        
+        if self.fPath == '' or self.isRunning or self.th != None or \
+          self.reanalysis != None: 
+            return
+        self.isSettingArena = not self.isSettingArena
+        btn = wx.FindWindowByName("arena_btn", self.panel["tp"])
+        if self.isSettingArena:
+            btn.SetLabel("Cancel setting arena")
+            msg = "Drag a rectangle on the image to set arena"
+            msg += " (in the current view). Right-click to remove arena."
+            self.showStatusBarMsg(msg, 0)
+        else:
+            btn.SetLabel("Set arena")
+            self.showStatusBarMsg("")
+    
+    #-------------------------------------------------------------------
+    
+    def setArena(self, rect=None):
+        """ Set arena of the video (or remove it, when 'rect' is None)
+        and process the current frame again with it.
+        Arena is saved to the arena file of the video 
+          (arena.get_arena_fp), so that it's used when the video 
+          is opened again.
+
+        Args:
+            rect (None/tuple): (x1, y1, x2, y2) of dragged rectangle 
+              in the current frame image.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.setArena()")
+        
+        if rect != None:
+            ### rect in the full frame
+            x1 = min(rect[0], rect[2]); y1 = min(rect[1], rect[3])
+            x2 = max(rect[0], rect[2]); y2 = max(rect[1], rect[3])
+            if x2-x1 < 10 or y2-y1 < 10: return # too small; ignore
+            if self.vRW.arena != None:
+            # the current frame image is already cropped to arena
+                x1 += self.vRW.arena["offset"][0]
+                y1 += self.vRW.arena["offset"][1]
+            rect = (x1, y1, x2-x1, y2-y1)
+        self.vRW.setArena(rect)
+        self.loadBG()
+        self.cv_proc.resetState() # states are in coordinates of frame image
+        self.toggleArenaSetting() # finish setting arena
+        ### read the current frame again, cropped with the new arena
+        self.diff_FI_TFI = 0 
+        sTxt = wx.FindWindowByName("navProg_sTxt", self.panel["rp"])
+        self.vRW.getFrame(self.vRW.fi, self.callbackArena, sTxt)
+        self.flagBlockUI = True
+    
+    #-------------------------------------------------------------------
+    
+    def callbackArena(self, rData):
+        """ Call back function after reading the current frame again
+        with a new arena.
+
+        Args:
+            rData (tuple): Frame-index and frame image.
+        
+        Returns:
+            None
+        """
+        if DEBUG: print("AnimalBehaviourCoderFrame.callbackArena()")
+
+        # frame size changed; calculate ratio to display it in UI
+        self.ratFImgDispImg = calcI2DIRatio(self.vRW.currFrame, 
+                                            self.dispImg_sBmp_sz)
+        self.cv_proc.last_motion_frame = self.vRW.currFrame.copy()
+        self.cv_proc.lmFI = self.vRW.fi
+        self.callback(rData)
+    
+    #-------------------------------------------------------------------
+    
     def startStopAnalyzeVideo(self):
         ''' Processing when start or stop analysis
         '''
@@ -1339,9 +1943,19 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 self.onSave(None) # save data
             if self.isRunning:
                 self.onSpace(None) # stop continuous running
+            if self.reanalysis != None:
+                ### stop re-analysis
+                self.stopReanalysis()
+                self.finishReanalysis(-1, None)
             if self.flagVRec:
                 self.vRW.closeWriter() # stop analysis video recording
+                if self.vRW.nRecDropped > 0:
+                    msg = "%i frames were dropped"%(self.vRW.nRecDropped)
+                    msg += " in the analysis video."
+                    self.showStatusBarMsg(msg, 0)
             self.cv_proc.bg = None # remove background image
+            self.cv_proc.rCache.flush()
+            self.cv_proc.rCache = None
             self.resetDataGrid(flagRemoveOnly=True) # reset data grid
             self.vRW.closeReader() # close video
             ### init
@@ -1362,6 +1976,8 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         """ Load data from CSV file
         """ 
         endDataIdx = -1 
+        colIdx = list(range(1, len(self.dataCols)+1)) # column index 
+          # (in CSV line) of each data column
         ### read CSV file and update oData
         f = open(result_csv_file, 'r')
         lines = f.readlines()
@@ -1385,11 +2001,20 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 self.aecParam[items[0]]['value'] = val 
                 continue
 
+            if items[0] == 'frame-index':
+                ### store column index (in CSV line) of each data column
+                colIdx = []
+                for col in self.dataCols:
+                    if col in items: colIdx.append(items.index(col))
+                    else: colIdx.append(-1) # column doesn't exist in CSV
+                continue
+
             ### restore data
             try: fi = int(items[0])
             except: continue
             for ci in range(len(self.dataCols)):
-                val = str(items[ci+1])
+                if colIdx[ci] == -1 or colIdx[ci] >= len(items): continue
+                val = str(items[colIdx[ci]])
                 oData[fi][ci] = val
                 if endDataIdx == -1:
                     if ci == self.hdi and val == 'None':
@@ -1404,7 +2029,9 @@ class AnimalBehaviourCoderFrame(wx.Frame):
     #-------------------------------------------------------------------
 
     def resetDataGrid(self, flagRemoveOnly=False):
-        """ Reset dataGrid with data (self.oData)
+        """ Reset dataGrid with data (self.oData).
+        The grid reads values directly from self.oData (virtual table),
+          so only number of rows/columns and column widths are updated here.
         
         Args:
             flagRemoveOnly (bool): Remove data without resetting 
@@ -1415,28 +2042,48 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         """ 
         if DEBUG: print("AnimalBehaviourCoderFrame.resetDataGrid()")
 
-        key = "rp"
-        pSz = self.pi[key]["sz"] 
-        self.gbs[key].Detach(self.dataGrid) # detach grid from gridBagSizer
-        self.dataGrid.Destroy() # destroy the grid
-        if flagRemoveOnly:
-            ### put empty grid and return
-            self.dataGrid = Grid(self.panel[key], np.zeros((0,0))) 
-            add2gbs(self.gbs[key], self.dataGrid, (0,0), (1,2))
-        else:
-            ### put a new grid with oData
-            self.dataGrid = Grid(self.panel[key],
-                                 np.asarray(self.oData), 
-                                 size=(pSz[0]-10, pSz[1]-75))
-            add2gbs(self.gbs[key], self.dataGrid, (0,0), (1,2))
-            ### set column and row labels for dataSheet
-            for ci in range(len(self.dataCols)):
-                self.dataGrid.SetColLabelValue(ci, self.dataCols[ci])
-            #for ri in range(1, self.oData.shape[0]+1):
-            #    self.dataGrid.SetRowLabelValue(ri, "%i"%(ri))
-            self.dataGrid.AutoSizeColumns() # this could take quite some time,
-              # as number of columns increases
-        self.gbs[key].Layout()
+        if flagRemoveOnly: self.oData = []
+        self.dataGridDirtyRows = [-1, -1]
+        self.dataGrid.resetView() # update number of rows & columns
+        if not flagRemoveOnly:
+            # set column widths, measured with sample rows
+            self.dataGrid.setColSizesWithSample()
+        self.gbs["rp"].Layout()
+
+    #-------------------------------------------------------------------
+    
+    def markDataGridDirty(self, r0, r1=None):
+        """ Mark rows of data grid, which data was updated.
+        
+        Args:
+            r0 (int): First row index.
+            r1 (None/int): Last row index. 
+
+        Returns:
+            None
+        """ 
+        #if DEBUG: print("AnimalBehaviourCoderFrame.markDataGridDirty()")
+
+        if r1 == None: r1 = r0
+        dr = self.dataGridDirtyRows
+        if dr[0] == -1: self.dataGridDirtyRows = [r0, r1]
+        else: self.dataGridDirtyRows = [min(dr[0], r0), max(dr[1], r1)]
+
+    #-------------------------------------------------------------------
+    
+    def refreshDataGrid(self):
+        """ Re-draw dirty rows of data grid.
+        
+        Args: None
+
+        Returns: None
+        """ 
+        if DEBUG: print("AnimalBehaviourCoderFrame.refreshDataGrid()")
+
+        r0, r1 = self.dataGridDirtyRows
+        if r0 == -1: return
+        self.dataGrid.refreshRows(r0, r1)
+        self.dataGridDirtyRows = [-1, -1]
 
     #-------------------------------------------------------------------
      
@@ -1444,7 +2091,7 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         ''' manual data editing on dataGrid
         '''
         if DEBUG: print("AnimalBehaviourCoderFrame.onDataGridCellChanged()")
-        if self.dataGridSelectedCells != []:
+        if self.dataGridSelRanges != []:
             ri = self.dataGrid.GetGridCursorRow()
             ci = self.dataGrid.GetGridCursorCol()
             value = self.oData[ri][ci].lower()
@@ -1457,11 +2104,12 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 elif value == 'd': value = 'D'
                 elif value == 'none': value = 'None'
             ### update selected cells with entered value
-            for i in range(len(self.dataGridSelectedCells)):
-                ri = self.dataGridSelectedCells[i][0]
-                ci = self.dataGridSelectedCells[i][1]
-                self.oData[ri][ci] = str(value)
-            self.dataGridSelectedCells = []
+            for r0, c0, r1, c1 in self.dataGridSelRanges:
+                for ci in range(c0, c1+1):
+                    self.oData[self.dataCols[ci]][r0:r1+1] = str(value)
+                self.markDataGridDirty(r0, r1)
+            self.dataGridSelRanges = []
+            self.refreshDataGrid()
     
     #-------------------------------------------------------------------
     
@@ -1469,7 +2117,9 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         ''' store selected cell
         '''
         if DEBUG: print("AnimalBehaviourCoderFrame.onDataGridCellSelected()")
-        self.dataGridSelectedCells = [(event.GetRow(), event.GetCol())]
+        ri = event.GetRow()
+        ci = event.GetCol()
+        self.dataGridSelRanges = [(ri, ci, ri, ci)]
 
     #-------------------------------------------------------------------
     
@@ -1479,12 +2129,13 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         if DEBUG: print("AnimalBehaviourCoderFrame.onDataGridCellsSelected()")
       
         if self.dataGrid.GetSelectionBlockTopLeft():
-            self.dataGridSelectedCells = []
-            tL = self.dataGrid.GetSelectionBlockTopLeft()[0]
-            bR = self.dataGrid.GetSelectionBlockBottomRight()[0]
-            for ri in range(tL[0], bR[0]+1):
-                for ci in range(tL[1], bR[1]+1):
-                    self.dataGridSelectedCells.append( (ri,ci) )
+            ### store selected blocks as ranges, 
+            ###   instead of listing every cell
+            tLs = self.dataGrid.GetSelectionBlockTopLeft()
+            bRs = self.dataGrid.GetSelectionBlockBottomRight()
+            self.dataGridSelRanges = []
+            for tL, bR in zip(tLs, bRs):
+                self.dataGridSelRanges.append((tL[0], tL[1], bR[0], bR[1]))
          
     #-------------------------------------------------------------------
     
@@ -1500,9 +2151,12 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         if DEBUG: print("AnimalBehaviourCoderFrame.callbackFunc()")
 
         if self.diff_FI_TFI> 1: # if moving multiple frames
-            # update last_motion_frame
-            #   to prevent difference goes over motion detection threshold 
-            self.cv_proc.last_motion_frame = self.vRW.currFrame.copy()
+            if not self.cv_proc.loadCheckpoint(self.fPath, self.vRW.fi-1):
+            # tracker state of the previous frame is not available
+                # update last_motion_frame
+                #   to prevent difference goes over motion detection threshold 
+                self.cv_proc.last_motion_frame = self.vRW.currFrame.copy()
+                self.cv_proc.lmFI = self.vRW.fi
         self.proc_img() # process loaded image
         self.flagBlockUI = False
     
@@ -1609,6 +2263,42 @@ class AnimalBehaviourCoderFrame(wx.Frame):
                 lbl = str(timedelta(seconds=e_time)).split('.')[0]
                 sTxt = wx.FindWindowByName("ssTime_sTxt", self.panel["tp"])
                 sTxt.SetLabel(lbl)
+        
+        elif flag == "reanalysis":
+            ### receive data from queue
+            rData = None
+            while not self.reanalysis["q2m"].empty():
+                rData = self.reanalysis["q2m"].get()
+                if len(rData) == 3: break # finished (or cancelled)
+            if rData == None:
+                if not self.reanalysis["proc"].is_alive():
+                # worker process ended without result
+                    self.finishReanalysis(-1, None)
+                return
+            if len(rData) == 1: # progress message
+                sTxt = wx.FindWindowByName("navProg_sTxt", self.panel["rp"])
+                sTxt.SetLabel(rData[0])
+            else:
+                self.finishReanalysis(rData[1], rData[2])
+        
+        elif flag == "paramSweep":
+            ### receive (last) data from queue
+            rData = None
+            while True:
+                ret = receiveDataFromQueue(self.q2m)
+                if ret == None: break
+                rData = ret
+                if len(rData) == 3: break # finished
+            if rData == None: return
+            if len(rData) == 1: # progress message
+                sTxt = wx.FindWindowByName("navProg_sTxt", self.panel["rp"])
+                sTxt.SetLabel(rData[0])
+            elif len(rData) == 3: # finished
+                self.timer["paramSweep"].Stop()
+                self.timer["paramSweep"] = None
+                self.th.join()
+                self.th = None
+                self.finishParamSweep(rData[1], rData[2])
    
     ''' 
     #-------------------------------------------------------------------
@@ -1694,6 +2384,15 @@ class AnimalBehaviourCoderFrame(wx.Frame):
         if rslt:
             if hasattr(self.vRW, "video_rec") and self.vRW.video_rec != None:
                 self.vRW.closeWriter()
+            if self.reanalysis != None:
+            # re-analysis is running
+                self.stopReanalysis()
+            if self.paramSweep != None and self.th != None:
+            # parameter sweep is running
+                self.q2t.put("quit", True, None)
+                self.th.join()
+                self.th = None
+            if self.cv_proc.rCache != None: self.cv_proc.rCache.flush()
             wx.CallLater(500, self.Destroy)
     
     #-------------------------------------------------------------------
@@ -1701,72 +2400,163 @@ class AnimalBehaviourCoderFrame(wx.Frame):
 #=======================================================================
 
 class TableBase(wx.grid.GridTableBase):
-    def __init__(self, data):
+    """ Virtual table for wx.grid.Grid. 
+    Values are read from (and written to) the output data (oData) 
+      of the parent frame directly, without copying it.
+
+    Args:
+        parent (wx.Frame): Frame, which has oData and dataCols.
+    """
+    def __init__(self, parent):
         if DEBUG: print("TableBase.__init__()")
         wx.grid.GridTableBase.__init__(self)
-        self.data = data
-        self.colLabels = list(range(len(data.dtype)))
-        # frame indices
-        self.rowLabels = [str(x) for x in range(data.shape[0])]
+        self.p = parent
     
     #-------------------------------------------------------------------
 
     def GetNumberRows(self): 
         #if DEBUG: print("TableBase.GetNumberRows()")
-        return self.data.shape[0] 
+        return len(self.p.oData)
 
     #-------------------------------------------------------------------
 
     def GetNumberCols(self): 
         #if DEBUG: print("TableBase.GetNumberCols()")
-        return len(self.data.dtype)
+        if len(self.p.oData) == 0: return 0
+        return len(self.p.dataCols)
 
     #-------------------------------------------------------------------
 
     def GetValue(self, row, col):
         #if DEBUG: print("TableBase.GetValue()")
-        return self.data[row][col]
+        return str(self.p.oData[row][col])
 
     #-------------------------------------------------------------------
 
     def SetValue(self, row, col, value):
         #if DEBUG: print("TableBase.SetValue()")
-        self.data[row][col] = value
+        self.p.oData[row][col] = value
     
     #-------------------------------------------------------------------
     
     def GetRowLabelValue(self, row):
         #if DEBUG: print("TableBase.GetRowLabelValue()")
-        return self.rowLabels[row]
-    
-    #-------------------------------------------------------------------
-    
-    def SetRowLabelValue(self, row, value):
-        #if DEBUG: print("TableBase.SetRowLabelValue()")
-        self.rowLabels[row] = value
+        return str(row) # frame index
     
     #-------------------------------------------------------------------
     
     def GetColLabelValue(self, col):
         #if DEBUG: print("TableBase.GetColLabelValue()")
-        return self.colLabels[col]
+        return self.p.dataCols[col]
     
     #-------------------------------------------------------------------
 
-    def SetColLabelValue(self, col, value):
-        #if DEBUG: print("TableBase.SetColLabelValue()")
-        self.colLabels[col] = value
-
-    #-------------------------------------------------------------------
-
 #=======================================================================
 
 class Grid(wx.grid.Grid): 
-    def __init__(self, parent, data, size=(100,50)): 
+    """ Grid to show output data of the parent frame, using TableBase.
+
+    Args:
+        parent (wx.Panel): Panel to place this grid. 
+        dataFrame (wx.Frame): Frame, which has oData and dataCols.
+        size (tuple): Size of the grid.
+    """
+    def __init__(self, parent, dataFrame, size=(100,50)): 
         if DEBUG: print("Grid.__init__()")
         wx.grid.Grid.__init__(self, parent, -1, size=size) 
-        self.table = TableBase(data) 
+        self.table = TableBase(dataFrame) 
         self.SetTable(self.table, True) 
+        self.nRows = self.table.GetNumberRows() # number of rows in view
+        self.nCols = self.table.GetNumberCols() # number of columns in view
+    
+    #-------------------------------------------------------------------
+
+    def resetView(self):
+        """ Update the grid after number of rows or columns of 
+        the table data were changed.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("Grid.resetView()")
+
+        self.BeginBatch()
+        for curr, new, delMsg, addMsg in [
+                        (self.nRows, 
+                         self.table.GetNumberRows(),
+                         wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                         wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED),
+                        (self.nCols, 
+                         self.table.GetNumberCols(),
+                         wx.grid.GRIDTABLE_NOTIFY_COLS_DELETED,
+                         wx.grid.GRIDTABLE_NOTIFY_COLS_APPENDED),
+                                          ]:
+            if new < curr:
+                msg = wx.grid.GridTableMessage(self.table, 
+                                               delMsg, 
+                                               new, 
+                                               curr-new)
+                self.ProcessTableMessage(msg)
+            elif new > curr:
+                msg = wx.grid.GridTableMessage(self.table, addMsg, new-curr)
+                self.ProcessTableMessage(msg)
+        self.nRows = self.table.GetNumberRows()
+        self.nCols = self.table.GetNumberCols()
+        self.EndBatch()
+        self.ForceRefresh()
+    
+    #-------------------------------------------------------------------
+
+    def setColSizesWithSample(self, nSample=100, margin=10):
+        """ Set column widths with text widths of sample rows,
+        instead of AutoSizeColumns, which measures all the rows.
+
+        Args:
+            nSample (int): Number of rows to sample.
+            margin (int): Margin in pixels to add to measured text width.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("Grid.setColSizesWithSample()")
+
+        nRows = self.table.GetNumberRows()
+        if nRows == 0: return
+        rows = np.unique(np.linspace(0, nRows-1, min(nSample, nRows)).astype(int))
+        dc = wx.ClientDC(self)
+        for ci in range(self.table.GetNumberCols()):
+            dc.SetFont(self.GetLabelFont())
+            w = dc.GetTextExtent(self.table.GetColLabelValue(ci))[0]
+            dc.SetFont(self.GetDefaultCellFont())
+            for ri in rows:
+                w = max(w, dc.GetTextExtent(self.table.GetValue(ri, ci))[0])
+            self.SetColSize(ci, w+margin)
+    
+    #-------------------------------------------------------------------
+
+    def refreshRows(self, r0, r1):
+        """ Re-draw only the given range of rows. 
+
+        Args:
+            r0 (int): First row index.
+            r1 (int): Last row index.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("Grid.refreshRows()")
+
+        if self.nRows == 0 or self.nCols == 0: return
+        r0 = max(0, r0)
+        r1 = min(self.nRows-1, r1)
+        rect = self.CellToRect(r0, 0)
+        rect = rect.Union(self.CellToRect(r1, self.nCols-1))
+        x, y = self.CalcScrolledPosition(rect.x, rect.y)
+        rect = wx.Rect(x, y, rect.width, rect.height)
+        self.GetGridWindow().RefreshRect(rect)
+        
+    #-------------------------------------------------------------------
 
 #=======================================================================
 
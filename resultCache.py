@@ -0,0 +1,323 @@
+# coding: UTF-8
+
+"""
+Persistent cache of per-frame analysis results of a video for pyABC.
+A result (output data row) of a frame is stored with a key of
+  (fingerprint of the video, frame-index, animal experiment case,
+  hash of parameters) and a digest of data of its previous frame and
+  tracker state before the frame (CVProc.getCompactState), which are
+  the input of the frame besides the frame image. Tracker state after
+  the frame is stored with the result.
+  When the same frame is analysed again with the same key and
+  the same input, the cached result is served and tracker state is
+  updated with the stored one, instead of processing the frame. 
+  Therefore, results are the same as the ones without the cache, and
+  after a change of data (such as manual input) of a frame, frames 
+  are processed again from the frame, until their input is the same
+  as the cached one again.
+Results are stored in binary chunks (NumPy .npy file of a structured
+  array of byte strings, 'chunkLen' frames per file) in a sidecar
+  directory of the video, [video-file-path]_rcache.
+
+Usage:
+    python resultCache.py [video-file-path]
+
+Dependency:
+    NumPy (1.17)
+"""
+
+from glob import glob
+from hashlib import md5
+from os import path, makedirs, remove, replace, fdopen
+from sys import argv
+from tempfile import mkstemp
+
+import numpy as np
+
+DEBUG = False
+
+#-----------------------------------------------------------------------
+
+def get_rcache_dir(vFP):
+    """ Get directory path of result cache of a video.
+
+    Args:
+        vFP (str): File path of video.
+
+    Returns:
+        (str): Directory path of result cache.
+
+    Examples:
+        >>> get_rcache_dir("data/rat1.mp4")
+        'data/rat1.mp4_rcache'
+    """
+    if DEBUG: print("resultCache.get_rcache_dir()")
+
+    return vFP + "_rcache"
+
+#-----------------------------------------------------------------------
+
+def video_fingerprint(vFP, blockSz=65536):
+    """ Get a fast fingerprint of a video file with its size and
+    the first, middle and last block of bytes, instead of
+    all bytes of the file.
+
+    Args:
+        vFP (str): File path of video.
+        blockSz (int): Size of a block in bytes.
+
+    Returns:
+        (str): Fingerprint string.
+    """
+    if DEBUG: print("resultCache.video_fingerprint()")
+
+    fSz = path.getsize(vFP)
+    h = md5(str(fSz).encode("utf-8"))
+    with open(vFP, "rb") as f:
+        for pos in [0, max(0, fSz//2-blockSz//2), max(0, fSz-blockSz)]:
+            f.seek(pos)
+            h.update(f.read(blockSz))
+    return h.hexdigest()
+
+#-----------------------------------------------------------------------
+
+def row_digest(values):
+    """ Get a short digest of a data row.
+
+    Args:
+        values (list): Values of a data row.
+
+    Returns:
+        (str): Digest string (16 hexadecimal characters).
+
+    Examples:
+        >>> row_digest(["90", "None"]) == row_digest([90, None])
+        True
+        >>> row_digest(["90", "None"]) == row_digest(["91", "None"])
+        False
+    """
+    if DEBUG: print("resultCache.row_digest()")
+
+    s = "\t".join([str(v) for v in values])
+    return md5(s.encode("utf-8")).hexdigest()[:16]
+
+#=======================================================================
+
+class ResultCache:
+    """ Persistent cache of per-frame analysis results of a video.
+    Chunks are kept in memory once they're read, and written to files
+      when 'flushInterval' results were stored, or with flush().
+
+    Args:
+        vFP (str): File path of video.
+        dataStruct (list): Data structure (dtype) of output data.
+        chunkLen (int): Number of frames in a chunk.
+        stateLen (int): Max. length of tracker state (JSON text) 
+          of a frame. A result with longer state is not stored.
+
+    Attributes:
+        Each attribute is commented in 'setting up attributes' section.
+    """
+
+    def __init__(self, vFP, dataStruct, chunkLen=1000, stateLen=2048):
+        if DEBUG: print("ResultCache.__init__()")
+
+        ##### [begin] setting up attributes -----
+        self.vFP = vFP # file path of video
+        self.dirPath = get_rcache_dir(vFP) # directory of chunk files
+        self.fingerprint = video_fingerprint(vFP) # fingerprint of video
+        self.chunkLen = chunkLen # number of frames in a chunk
+        self.stateLen = stateLen # max. length of tracker state
+        self.dtype = [("valid", np.bool_), ("pKey", "S16")]
+        for col, (__, sz) in dataStruct:
+            self.dtype.append((col, "S%i"%(sz)))
+        self.dtype.append(("state", "S%i"%(stateLen)))
+          # dtype of a chunk; validity, digest of input (data of
+          # the previous frame and tracker state), data columns 
+          # and tracker state after the frame in byte strings
+        self.cols = [col for col, __ in dataStruct] # data columns
+        self.chunks = {} # chunks in memory; {file-path: chunk}
+        self.dirty = set() # file paths of chunks, changed in memory
+        self.nStored = 0 # number of results stored after the last flush
+        self.flushInterval = 300 # number of stored results, after which
+          # changed chunks are written
+        ##### [end] setting up attributes -----
+
+    #-------------------------------------------------------------------
+
+    def getChunkFP(self, animalECase, pHash, fi):
+        """ Get file path of chunk, containing a frame.
+
+        Args:
+            animalECase (str): Animal experiment case.
+            pHash (str): Hash of parameters.
+            fi (int): Frame-index.
+
+        Returns:
+            (str): File path of the chunk.
+        """
+        if DEBUG: print("ResultCache.getChunkFP()")
+
+        key = md5((self.fingerprint + pHash).encode("utf-8")).hexdigest()
+        fn = "%s_%s_%06i.npy"%(animalECase, key[:16], fi//self.chunkLen)
+        return path.join(self.dirPath, fn)
+
+    #-------------------------------------------------------------------
+
+    def getChunk(self, fp, flagCreate=False):
+        """ Get a chunk from memory or its file.
+
+        Args:
+            fp (str): File path of chunk.
+            flagCreate (bool): Whether to create an empty chunk,
+              when it doesn't exist.
+
+        Returns:
+            (None/numpy.ndarray): Chunk.
+        """
+        if DEBUG: print("ResultCache.getChunk()")
+
+        if fp in self.chunks.keys(): return self.chunks[fp]
+        chunk = None
+        if path.isfile(fp):
+            try: chunk = np.load(fp, allow_pickle=False)
+            except Exception: chunk = None # broken chunk file
+            if chunk is not None and (chunk.dtype != np.dtype(self.dtype) \
+              or len(chunk) != self.chunkLen):
+                chunk = None # chunk of different data structure
+        if chunk is None:
+            if not flagCreate: return None
+            chunk = np.zeros(self.chunkLen, dtype=self.dtype)
+        self.chunks[fp] = chunk
+        return chunk
+
+    #-------------------------------------------------------------------
+
+    def get(self, animalECase, pHash, fi, pKey):
+        """ Get cached result of a frame.
+
+        Args:
+            animalECase (str): Animal experiment case.
+            pHash (str): Hash of parameters.
+            fi (int): Frame-index.
+            pKey (str): Digest of input of the frame (row_digest).
+
+        Returns:
+            (None/tuple): Data row (tuple of strings) and tracker state
+              (str) after the frame. None, when there's no cached result
+              with the same key.
+        """
+        if DEBUG: print("ResultCache.get()")
+
+        chunk = self.getChunk(self.getChunkFP(animalECase, pHash, fi))
+        if chunk is None: return None
+        r = chunk[fi % self.chunkLen]
+        if not r["valid"] or r["pKey"] != pKey.encode("ascii"): return None
+        row = tuple([r[col].decode("utf-8") for col in self.cols])
+        return row, r["state"].decode("utf-8")
+
+    #-------------------------------------------------------------------
+
+    def put(self, animalECase, pHash, fi, pKey, row, state):
+        """ Store result of a frame.
+
+        Args:
+            animalECase (str): Animal experiment case.
+            pHash (str): Hash of parameters.
+            fi (int): Frame-index.
+            pKey (str): Digest of input of the frame (row_digest).
+            row (tuple): Data row (strings).
+            state (str): Tracker state after the frame (JSON text).
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ResultCache.put()")
+
+        state = state.encode("utf-8")
+        if len(state) > self.stateLen: return
+        fp = self.getChunkFP(animalECase, pHash, fi)
+        chunk = self.getChunk(fp, True)
+        chunk[fi % self.chunkLen] = (True, pKey) + tuple(row) + (state,)
+        self.dirty.add(fp)
+        self.nStored += 1
+        if self.nStored >= self.flushInterval: self.flush()
+
+    #-------------------------------------------------------------------
+
+    def flush(self):
+        """ Write changed chunks to their files.
+        Results in a chunk file, which were written by another process
+          and are not in memory, are kept.
+        A chunk, which failed to be written (such as because of 
+          permission or disk space), is left out; its results are 
+          only missing in the cache.
+
+        Args: None
+
+        Returns:
+            (bool): Whether all changed chunks were written.
+        """
+        if DEBUG: print("ResultCache.flush()")
+
+        dirty = self.dirty
+        self.dirty = set()
+        self.nStored = 0
+        if len(dirty) == 0: return True
+        try: makedirs(self.dirPath, exist_ok=True)
+        except OSError: return False
+        flagOK = True
+        for fp in dirty:
+            chunk = self.chunks[fp]
+            if path.isfile(fp):
+                try:
+                    fChunk = np.load(fp, allow_pickle=False)
+                    if fChunk.dtype == chunk.dtype and \
+                      len(fChunk) == len(chunk):
+                        idx = fChunk["valid"] & ~chunk["valid"]
+                        chunk[idx] = fChunk[idx]
+                except Exception:
+                    pass
+            ### write to a temporary file (unique to this writer), 
+            ###   then replace, so that a chunk file is never half-written
+            tmpFP = None
+            try:
+                fd, tmpFP = mkstemp(suffix=".tmp", dir=self.dirPath)
+                with fdopen(fd, "wb") as f: np.save(f, chunk)
+                replace(tmpFP, fp)
+            except OSError:
+                flagOK = False
+                if tmpFP != None and path.isfile(tmpFP):
+                    try: remove(tmpFP)
+                    except OSError: pass
+        return flagOK
+
+    #-------------------------------------------------------------------
+
+    def clear(self):
+        """ Remove all cached results of the video.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ResultCache.clear()")
+
+        for fp in glob(path.join(self.dirPath, "*.npy")):
+            try: remove(fp)
+            except OSError: pass # removed by another process
+        self.chunks = {}
+        self.dirty = set()
+        self.nStored = 0
+
+#=======================================================================
+
+if __name__ == '__main__':
+    if len(argv) < 2:
+        print("Usage: python resultCache.py [video-file-path]")
+    else:
+        dirPath = get_rcache_dir(argv[1])
+        for fp in sorted(glob(path.join(dirPath, "*.npy"))):
+            chunk = np.load(fp, allow_pickle=False)
+            print("%s\t%i results"%(path.basename(fp), np.sum(chunk["valid"])))
+
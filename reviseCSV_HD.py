@@ -51,13 +51,15 @@ User input with mouse and keyboard
 * Cmd + Q: Quit this app.  
 """
 
-import queue
+import queue, subprocess
 from threading import Thread 
+from multiprocessing import Pool, cpu_count
+from shutil import which
 from sys import argv
-from os import getcwd, path
+from os import getcwd, path, remove
 from glob import glob
 from random import randint
-from copy import copy, deepcopy
+from copy import copy
 
 import cv2
 import wx, wx.adv
@@ -71,6 +73,8 @@ from modFFC import GNU_notice, get_time_stamp, getWXFonts
 from modFFC import convt_180_to_360, convt_360_to_180, str2num
 from modFFC import updateFrameSize, add2gbs, receiveDataFromQueue
 from modFFC import stopAllTimers, calc_pt_w_angle_n_dist, calcI2DIRatio
+from modFFC import parse_int_col
+from frameCache import get_proxy_fp, open_frame_cache, list_frame_cache_scales
 
 DEBUG = False
 VERSION = "0.1.1"
@@ -121,6 +125,10 @@ class ReviseCSVFrame(wx.Frame):
         self.isRunning = False # continuous playing
         self.flagBlockUI = False # block user input 
         self.ratFImgDispImg = None # ratio to resize frame to display image
+        self.frameR = 1.0 # ratio of frame size of the video being read
+          # (proxy video) to frame size of the original video
+        self.expInfo = None # reader info to restore after exporting 
+          # full resolution video
         pi = self.setPanelInfo() # set panel info
         self.pi = pi
         self.gbs = {} # for GridBagSizer
@@ -135,6 +143,7 @@ class ReviseCSVFrame(wx.Frame):
           # along vertically middle point
         self.dataLnCol = wx.Colour(200,200,200) # data line color
         self.currFICol = wx.Colour(255,175,0) # current frame index color
+        self.suspectCol = wx.Colour(255,50,50) # color for suspect frames
         self.fontCol = wx.Colour(255,255,255) 
         self.selRange = [-1, -1] # range of selected frames
         self.gMarker = [] # markers on graph
@@ -145,10 +154,21 @@ class ReviseCSVFrame(wx.Frame):
         self.vRW = None # module for reading/writing video file
         self.aecParam = {} # parameters in CSV data
         self.dataCols = [] # column names of CSV data
-        self.oData = [] # data from CSV file
+        self.oData = np.zeros((0, 0), dtype=str) # data from CSV file
+          # (2D array of strings; frame-index x column)
         self.endDataIdx = -1 # row index where all data is 'None', 
           # or simply end row index of data
         self.gFI_onMP = -1 # frame-index on graph where mouse point was on 
+        self.hdci = -1 # column index of confidence of head direction
+          # (-1, when CSV doesn't have the column)
+        self.suspectFIs = np.zeros(0, dtype=np.int64) # sorted frame indices
+          # of suspect frames (low confidence or no head direction)
+        self.nExpProc = cpu_count() # number of worker processes to export
+          # video in segments; 1 means exporting in one serial stream
+        self.expSegLen = 300 # min. number of frames in a segment 
+          # of exporting video
+        self.ffmpegFP = which("ffmpeg") # FFmpeg to join exported segments
+          # without re-encoding; segments are not used without it
         ##### [end] setting up attributes -----
         
         
@@ -187,6 +207,13 @@ class ReviseCSVFrame(wx.Frame):
         btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
         add2gbs(self.gbs["tp"], btn, (row,col), (1,2))
         col += 2 
+        btn = wx.Button(self.panel["tp"],
+                        -1,
+                        label="Save full-res. video",
+                        name="saveVidFull_btn")
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        add2gbs(self.gbs["tp"], btn, (row,col), (1,2))
+        col += 2 
         add2gbs(self.gbs["tp"],
                 wx.StaticLine(self.panel["tp"],
                               -1,
@@ -386,6 +413,46 @@ class ReviseCSVFrame(wx.Frame):
                         name="undo_btn")
         btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown) 
         add2gbs(self.gbs["tp"], btn, (row,col), (1,1))  
+        col += 1 
+        add2gbs(self.gbs["tp"],
+                wx.StaticLine(self.panel["tp"],
+                              -1,
+                              size=vlSz,
+                              style=wx.LI_VERTICAL),
+                (row,col),
+                (1,1)) # vertical line separator
+        col += 1
+        cho = wx.Choice(self.panel['tp'], 
+                        -1, 
+                        choices=["%.1f"%(x*0.1) for x in range(1,10)], 
+                        name="suspectTh_cho",
+                        size=(50,-1))
+        cho.SetSelection(4)
+        cho.Bind(wx.EVT_CHOICE, lambda event: self.updateSuspectFIs())
+        add2gbs(self.gbs["tp"], cho, (row,col), (1,1))
+        col += 1
+        btn = wx.Button(self.panel["tp"],
+                        -1,
+                        label="<",
+                        name="prevSuspect_btn",
+                        size=(30,-1))
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown) 
+        add2gbs(self.gbs["tp"], btn, (row,col), (1,1))
+        col += 1
+        btn = wx.Button(self.panel["tp"],
+                        -1,
+                        label=">",
+                        name="nextSuspect_btn",
+                        size=(30,-1))
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown) 
+        add2gbs(self.gbs["tp"], btn, (row,col), (1,1))
+        col += 1
+        sTxt = wx.StaticText(self.panel['tp'], 
+                             -1,
+                             name="suspect_sTxt",
+                             label="0 suspect frames")
+        sTxt.SetForegroundColour('#ffffff')
+        add2gbs(self.gbs["tp"], sTxt, (row,col), (1,2))
         self.panel["tp"].SetSizer(self.gbs["tp"])
         self.gbs["tp"].Layout()
         self.panel["tp"].SetupScrolling()
@@ -424,6 +491,8 @@ class ReviseCSVFrame(wx.Frame):
         forFur_btnId = wx.NewIdRef(count=1)
         backBegin_btnId = wx.NewIdRef(count=1)
         forEnd_btnId = wx.NewIdRef(count=1)
+        prevSuspect_btnId = wx.NewIdRef(count=1)
+        nextSuspect_btnId = wx.NewIdRef(count=1)
         self.Bind(wx.EVT_MENU, self.onClose, id = exit_btnId)
         self.Bind(wx.EVT_MENU, self.onSpace, id = space_btnId)
         self.Bind(wx.EVT_MENU, self.selectionModeOnOff, id = selection_btnId)
@@ -440,6 +509,12 @@ class ReviseCSVFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, 
                   lambda event: self.moveFrame(event, 'forEnd'), 
                   id=forEnd_btnId)
+        self.Bind(wx.EVT_MENU, 
+                  lambda event: self.moveFrame(event, 'prevSuspect'), 
+                  id=prevSuspect_btnId)
+        self.Bind(wx.EVT_MENU, 
+                  lambda event: self.moveFrame(event, 'nextSuspect'), 
+                  id=nextSuspect_btnId)
         accel_tbl = wx.AcceleratorTable([
                             (wx.ACCEL_CMD,  ord('Q'), exit_btnId ),
                             (wx.ACCEL_NORMAL, wx.WXK_SPACE, space_btnId),
@@ -449,6 +524,8 @@ class ReviseCSVFrame(wx.Frame):
                             (wx.ACCEL_ALT,  wx.WXK_RIGHT, forFur_btnId),
                             (wx.ACCEL_CTRL,  wx.WXK_LEFT, backBegin_btnId), 
                             (wx.ACCEL_CTRL,  wx.WXK_RIGHT, forEnd_btnId), 
+                            (wx.ACCEL_SHIFT,  wx.WXK_LEFT, prevSuspect_btnId), 
+                            (wx.ACCEL_SHIFT,  wx.WXK_RIGHT, nextSuspect_btnId), 
                                         ])
         self.SetAcceleratorTable(accel_tbl)
          
@@ -528,6 +605,8 @@ class ReviseCSVFrame(wx.Frame):
         elif objName == "saveVid_btn":
             self.jumpToFrame(0)
             self.timer["saveVideo"] = wx.CallLater(10, self.saveVideo)
+        elif objName == "saveVidFull_btn":
+            self.saveVideo(isFullRes=True)
         elif objName == "moveToBegin_btn": self.moveFrame(None, 'backBegin')
         elif objName == "moveBackFur_btn": self.moveFrame(None, 'backFur') 
         elif objName == "moveForFur_btn": self.moveFrame(None, 'forFur')
@@ -542,6 +621,8 @@ class ReviseCSVFrame(wx.Frame):
         elif objName == "smooth_btn": self.changeHDVal('smooth')
         elif objName == "clearMarker_btn": self.clearMarkers()
         elif objName == "undo_btn": self.undo(None)
+        elif objName == "prevSuspect_btn": self.moveFrame(None, 'prevSuspect')
+        elif objName == "nextSuspect_btn": self.moveFrame(None, 'nextSuspect')
 
     #-------------------------------------------------------------------
     
@@ -624,7 +705,28 @@ class ReviseCSVFrame(wx.Frame):
         d = self.loadData(csvFP) # load data
         self.aecParam, self.dataCols, self.oData, self.endDataIdx = d
         self.vRW = VideoRW(self) # for reading/writing video file
-        self.vRW.initReader(self.videoFP) # init video file
+        self.vRW.useArena = False # data are in coordinates of full frame
+        proxyFP = get_proxy_fp(self.videoFP)
+        scales = [sc for sc in list_frame_cache_scales(self.videoFP) \
+                    if sc < 1.0]
+        if path.isfile(proxyFP) or scales != []:
+            if path.isfile(proxyFP):
+            # proxy video (made with frameCache.py) is available;
+            #   use it for browsing
+                self.vRW.initReader(proxyFP)
+            else:
+            # reduced resolution frame cache is available;
+            #   use the largest one for browsing
+                self.vRW.cacheScale = scales[-1]
+                self.vRW.initReader(self.videoFP)
+            vCap = cv2.VideoCapture(self.videoFP)
+            self.frameR = self.vRW.currFrame.shape[1] / \
+                            vCap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            vCap.release()
+        else:
+            self.vRW.initReader(self.videoFP) # init video file
+            self.frameR = 1.0
+        self.ratFImgDispImg = None
         self.backupOData = None # backup data
 
         ### store some data indices
@@ -639,6 +741,10 @@ class ReviseCSVFrame(wx.Frame):
         else: self.mhdi = self.dataCols.index("manHD")
         if "mHPos" in self.dataCols: self.mhpi = self.dataCols.index("mHPos")
         else: self.mhpi = self.dataCols.index("manHP")
+        # * confidence column was added in later versions
+        if "hDConf" in self.dataCols: self.hdci = self.dataCols.index("hDConf")
+        else: self.hdci = -1
+        self.updateSuspectFIs()
 
         self.play() # for processing the 1st frame
 
@@ -653,7 +759,7 @@ class ReviseCSVFrame(wx.Frame):
         Returns:
             aecParam (dict): Parameter values from CSV.
             dataCols: (list): Data columns.
-            oData (list): Output data.
+            oData (numpy.ndarray): Output data; 2D array of strings.
             endDataIdx (int): Row index of end of data.
         """ 
         if DEBUG: print("ReviseCSV.loadData()")
@@ -697,6 +803,10 @@ class ReviseCSVFrame(wx.Frame):
             if flagAllNone: endDataIdx = copy(fi-1) # set end data index
             oData.append(oDataRow)
         if endDataIdx == None: endDataIdx = fi
+        oData = np.array(oData, dtype=str)
+        if oData.dtype.itemsize//4 < 8:
+        # make string length enough for edited values (such as 'False')
+            oData = oData.astype("<U8")
         
         return (aecParam, dataCols, oData, endDataIdx)
     
@@ -753,15 +863,24 @@ class ReviseCSVFrame(wx.Frame):
             dc.SetPen(wx.Pen(self.selCol, 1))
             dc.DrawLine(li, 0, li, gSz[1])
 
+        ### draw ticks of suspect frames at the bottom of graph
+        sf = self.suspectFIs
+        sf = sf[np.searchsorted(sf, gIdx[0]):np.searchsorted(sf, gIdx[1], 
+                                                                side="right")]
+        dc.SetPen(wx.Pen(self.suspectCol, 1))
+        for idx in sf:
+            dc.DrawLine(idx-gIdx[0], gSz[1]-5, idx-gIdx[0], gSz[1])
+
         ### draw data (head direction) lines
         currFrameX = None
         dc.SetPen(wx.Pen(self.dataLnCol, 1))
+        # parse head directions of visible frames at once
+        hDs, isHD = parse_int_col(self.oData[gIdx[0]:gIdx[1]+1, self.hdi])
         for li in range(gIdx[1]-gIdx[0]+1):
             idx = gIdx[0] + li
             if idx >= self.vRW.nFrames: break
-            hD = self.oData[idx][self.hdi]
-            hD = str2num(hD, 'int')
-            if type(hD) == int:
+            if isHD[li]:
+                hD = int(hDs[li])
                 hdLen = int(hD / 180.0 * vMid) * -1 # head direction range is 
                   # -180 ~ 180
                 if idx == self.vRW.fi: # current frame index
@@ -871,14 +990,9 @@ class ReviseCSVFrame(wx.Frame):
                 msg += " integers for linear interpolation."
                 wx.MessageBox(msg, "Error", wx.OK|wx.ICON_ERROR)
                 return
-            hDDiff = eHD - bHD
-            if (eHD/abs(eHD)) != (bHD/abs(bHD)): # sign doesn't match
-                ### for changing over zero or 180 line 
-                ### (e.g.: 30 -> -30, -170 -> 170, etc..)
-                hDDiff = (180-abs(eHD)) + (180-abs(bHD))
-                if hDDiff > 180: hDDiff = 360 - hDDiff
-                if (0 <= bHD < hDDiff) or (bHD < 0 and bHD < -hDDiff):
-                    hDDiff = -hDDiff
+            # difference along the shorter way around the circle 
+            #   (e.g.: 30 -> -30 is -60, -170 -> 170 is -20)
+            hDDiff = (eHD-bHD+180) % 360 - 180
             fLen = len(fIdx)
             p["bHD"] = bHD
             p["eHD"] = eHD
@@ -903,11 +1017,11 @@ class ReviseCSVFrame(wx.Frame):
             if flag == 'minus': inputVal = -inputVal
             p["inputVal"] = inputVal
         
-        self.backupOData = deepcopy(self.oData) # back up data
+        self.backupOData = self.oData.copy() # back up data
         if self.isSelectionMode:
             self.selectionModeOnOff(None) # turn off selection-mode
         
-        if len(fIdx) > 1000:
+        if flag == 'smooth' and len(fIdx) > 1000:
             self.flagBlockUI = True 
             ### set timer for updating current progress 
             self.timer["changeHDVal"] = wx.Timer(self)
@@ -920,34 +1034,40 @@ class ReviseCSVFrame(wx.Frame):
                              args=(p, self.oData, flag, self.q2m, True,))
             wx.CallLater(20, self.th.start)
         else:
-            self.oData = self.runChangeHDVal(p, 
-                                             self.oData, 
-                                             flag, 
-                                             isThread=False) # run 
+            if flag == 'smooth':
+                self.oData = self.runChangeHDVal(p, 
+                                                 self.oData, 
+                                                 flag, 
+                                                 isThread=False) # run 
+            else:
+                self.editHDVal(p, self.oData, flag)
+            self.updateSuspectFIs()
             self.panel["gp"].Refresh() # draw graph
             self.displayFrameImage(self.vRW.currFrame) # show current frame
 
     #-------------------------------------------------------------------
    
     def runChangeHDVal(self, p, oData, flag, q2m=None, isThread=True):
-        """ Change head direction value(s) procedure.
+        """ Smoothing head direction values procedure.
         Separated for running it as a thread.
 
         Args:
             p (dict): Parameters for operation.
-            oData (dict): Output data.
+            oData (numpy.ndarray): Output data.
             flag (str): Operation type to change head direction values.
             q2m (queue.Queue): Queue to send data to main thread.
             isThread (bool): Whether running this function as a thread.
 
         Returns:
-            oData (dict): Changed data. 
+            oData (numpy.ndarray): Changed data. 
         """ 
         if DEBUG: print("ReviseCSV.runChangeHDVal()")
         
         ### calculate values
         modifiedFIs = []
         newHDs = []
+        # parse head directions of all frames at once
+        hDs, isHD = parse_int_col(oData[:, self.hdi])
         for i, fi in enumerate(p["fIdx"]):
             if isThread:
                 msg = "calculating.. %i/ %i"%(fi, p["fIdx"][-1])
@@ -956,15 +1076,12 @@ class ReviseCSVFrame(wx.Frame):
             if flag == 'smooth': # smooth data line, 
               # referring +/- several frames around the current frame
                 if fi < p["refL"] or fi > self.vRW.nFrames-1-p["refL"]: continue
-                refHDs = []
-                for _fi in range(fi-p["refL"], fi+p["refL"]+1):
-                    _hd = oData[_fi][self.hdi]
-                    _hd = str2num(_hd, 'int')
-                    if type(_hd) == int:
-                        # store reference head direction 
-                        #   (radian angle in 360 degree system)
-                        refHDs.append(np.deg2rad(convt_180_to_360(_hd)))
-                if refHDs != []:
+                _fis = slice(fi-p["refL"], fi+p["refL"]+1)
+                # reference head directions 
+                #   (radian angle in 360 degree system)
+                refHDs = hDs[_fis][isHD[_fis]]
+                refHDs = np.deg2rad(convt_180_to_360(refHDs))
+                if len(refHDs) > 0:
                     if fi >= p["refL"]:
                         modifiedFIs.append(fi)
                         cm = np.rad2deg(circmean(refHDs)) # mean value of
@@ -972,68 +1089,96 @@ class ReviseCSVFrame(wx.Frame):
                           # head directions -> convert to degree from radian
                         newHDs.append(convt_360_to_180(int(cm)))
 
-            elif flag == 'linearInterpolation':
-                if fi == 0 or fi == p["fLen"]-1: continue
-                newHD = int(p["bHD"] + p["hDDiff"]*(float(i)/p["fLen"]))
-                if newHD > 180: newHD = -(180-newHD%180)
-                elif newHD < -180: newHD = 180-(abs(newHD)-180)
-                modifiedFIs.append(fi)
-                newHDs.append(newHD)
-
-            else: # set, plus or minus
-                oldHD = oData[fi][self.hdi]
-                oldHD = str2num(oldHD, 'int')
-                if flag == 'set':
-                    modifiedFIs.append(fi)
-                    newHDs.append(p["inputVal"])
-                elif flag == 'delete':
-                    modifiedFIs.append(fi)
-                    newHDs.append('D')
-                else:
-                    if type(oldHD) == str: # 'None' or 'D'
-                        oData[fi][self.hdi] = str(oldHD)
-                    else:
-                        newHD = oldHD + p["inputVal"]
-                        newHD = min(max(-180, newHD), 180) # range is -180~180
-                        modifiedFIs.append(fi)
-                        newHDs.append(newHD) 
-
         ### change data 
-        for i in range(len(modifiedFIs)):
-            fi = modifiedFIs[i]
-            if isThread:
-                msg = "updating data.. %i/ %i"%(fi, modifiedFIs[-1])
-                q2m.put((msg,), True, None)
-            
-            newHD = newHDs[i]
-            _d = oData[fi]
-            if type(newHD) == int:
-                bPosX = oData[fi][self.bxi]
-                bPosY = oData[fi][self.byi]
-                if not bPosX in ['None', 'D']:
-                    # re-calculate hPos with new head direction value
-                    hPos = calc_pt_w_angle_n_dist(
-                                            newHD, 
-                                            self.aecParam["hdLineLen"]["value"],
-                                            int(bPosX),
-                                            int(bPosY),
-                                            True
-                                            )
-                    oData[fi][self.hxi] = str(hPos[0])
-                    oData[fi][self.hyi] = str(hPos[1])
-            oData[fi][self.hdi] = str(newHD)
-            oData[fi][self.mhdi] = "True"
-            if flag == 'delete':
-                oData[fi][self.hxi] = "D" 
-                oData[fi][self.hyi] = "D" 
-                oData[fi][self.mhpi] = "True"
-                oData[fi][self.bxi] = "D" 
-                oData[fi][self.byi] = "D"
+        self.setHDData(oData, modifiedFIs, newHDs)
 
         if isThread: q2m.put(("", oData), True, None)
         else: return oData
     
     #-------------------------------------------------------------------
+   
+    def editHDVal(self, p, oData, flag):
+        """ Edit head direction values of frames in p["fIdx"] 
+        as operations on the whole range of arrays.
+
+        Args:
+            p (dict): Parameters for operation.
+            oData (numpy.ndarray): Output data.
+            flag (str): Operation type to change head direction values.
+              'linearInterpolation', 'set', 'plus', 'minus' or 'delete'.
+
+        Returns:
+            None
+        """ 
+        if DEBUG: print("ReviseCSV.editHDVal()")
+        
+        fis = np.arange(p["fIdx"][0], p["fIdx"][-1]+1) # frame indices
+
+        if flag == 'delete':
+            for ci in [self.hdi, self.hxi, self.hyi, self.bxi, self.byi]:
+                oData[fis, ci] = "D"
+            oData[fis, self.mhdi] = "True"
+            oData[fis, self.mhpi] = "True"
+            return
+
+        elif flag == 'linearInterpolation':
+            ### interpolate frames between the first and last frame,
+            ###   then wrap values to -180 ~ 180
+            fis = fis[1:-1]
+            t = np.arange(1, p["fLen"]-1) / float(p["fLen"]-1)
+            newHDs = np.round(p["bHD"] + p["hDDiff"]*t).astype(np.int64)
+            newHDs = (newHDs+180) % 360 - 180
+            newHDs[newHDs == -180] = 180
+        
+        elif flag == 'set':
+            newHDs = np.full(len(fis), p["inputVal"], dtype=np.int64)
+        
+        else: # plus or minus
+            oldHDs = oData[fis, self.hdi]
+            # frames with integer head direction (not 'None' or 'D')
+            isInt = np.char.isdigit(np.char.lstrip(oldHDs, "-"))
+            fis = fis[isInt]
+            newHDs = oldHDs[isInt].astype(np.int64) + p["inputVal"]
+            newHDs = np.clip(newHDs, -180, 180) # range is -180~180
+        
+        self.setHDData(oData, fis, newHDs)
+    
+    #-------------------------------------------------------------------
+   
+    def setHDData(self, oData, fis, newHDs):
+        """ Set head direction values of frames as manually fixed ones,
+        and re-calculate head positions of frames with base positions.
+
+        Args:
+            oData (numpy.ndarray): Output data.
+            fis (list/numpy.ndarray): Frame indices.
+            newHDs (list/numpy.ndarray): Head direction (integer) 
+              of each frame.
+
+        Returns:
+            None
+        """ 
+        if DEBUG: print("ReviseCSV.setHDData()")
+        
+        fis = np.asarray(fis, dtype=np.int64)
+        newHDs = np.asarray(newHDs, dtype=np.int64)
+        if len(fis) == 0: return
+        
+        ### re-calculate hPos with new head direction values
+        bx = oData[fis, self.bxi]
+        hasBPos = (bx != "None") & (bx != "D")
+        if np.any(hasBPos):
+            _fis = fis[hasBPos]
+            dist = self.aecParam["hdLineLen"]["value"]
+            bx = bx[hasBPos].astype(np.int64)
+            by = oData[_fis, self.byi].astype(np.int64)
+            hx, hy = calc_pt_w_angle_n_dist(newHDs[hasBPos], dist, bx, by, True)
+            oData[_fis, self.hxi] = hx
+            oData[_fis, self.hyi] = hy
+        oData[fis, self.hdi] = newHDs
+        oData[fis, self.mhdi] = "True"
+    
+    #-------------------------------------------------------------------
 
     def onTimer(self, event, flag):
         """ Processing on wx.EVT_TIMER event
@@ -1055,13 +1200,45 @@ class ReviseCSVFrame(wx.Frame):
             rData = ret # store received data
         if rData == None: return
         
-        if flag == "changeHDVal":
+        if flag == "exportVideo":
+            if len(rData) == 1:
+                self.bp_sTxt.SetLabel(rData[0])
+            elif len(rData) == 2:
+            # exporting video finished
+                self.timer["exportVideo"].Stop()
+                self.timer["exportVideo"] = None
+                self.th.join()
+                self.th = None
+                self.bp_sTxt.SetLabel("")
+                self.callback(rData, "finalizeSavingVideo")
+            elif len(rData) == 3:
+            # exporting in segments didn't finish
+                self.timer["exportVideo"].Stop()
+                self.timer["exportVideo"] = None
+                self.th.join()
+                self.th = None
+                if rData[2] == "serial":
+                # not all frames were written in segments;
+                #   write video serially
+                    self.bp_sTxt.SetLabel(rData[0])
+                    self.vRW.initWriter(self.savVidFP, 
+                                        rData[1], 
+                                        self.callback, 
+                                        self.makeDispImg,
+                                        self.bp_sTxt)
+                else:
+                # error
+                    self.bp_sTxt.SetLabel("")
+                    self.callback(rData, "failedSavingVideo")
+
+        elif flag == "changeHDVal":
             if len(rData) == 1:
                 self.bp_sTxt.SetLabel(rData[0])
             elif len(rData) == 2:
             # reached end of process
                 self.bp_sTxt.SetLabel(rData[0])
                 self.oData = rData[1]
+                self.updateSuspectFIs()
                 self.panel["gp"].Refresh() # draw graph
                 self.displayFrameImage(self.vRW.currFrame) # show current frame
                 self.flagBlockUI = False 
@@ -1191,9 +1368,10 @@ class ReviseCSVFrame(wx.Frame):
         if DEBUG: print("ReviseCSV.undo()")
 
         if self.backupOData is None: return
-        tmp = deepcopy(self.oData)
-        self.oData = deepcopy(self.backupOData)
+        tmp = self.oData
+        self.oData = self.backupOData
         self.backupOData = tmp
+        self.updateSuspectFIs()
         self.panel["gp"].Refresh() # re-draw graph
     
     #-------------------------------------------------------------------
@@ -1225,6 +1403,51 @@ class ReviseCSVFrame(wx.Frame):
             if type(fi) == int and fi >= 0 and fi <= self.endDataIdx:
                 self.jumpToFrame(fi)
             txt.SetValue("")
+        elif flag in ['prevSuspect', 'nextSuspect']:
+            sf = self.suspectFIs
+            if flag == 'nextSuspect':
+                i = np.searchsorted(sf, self.vRW.fi, side="right")
+            else:
+                i = np.searchsorted(sf, self.vRW.fi, side="left") - 1
+            if 0 <= i < len(sf):
+                self.jumpToFrame(int(sf[i]))
+            else:
+                self.bp_sTxt.SetLabel("No more suspect frame.")
+    
+    #-------------------------------------------------------------------
+    
+    def updateSuspectFIs(self):
+        """ Update sorted frame indices of suspect frames, 
+        where confidence of head direction is lower than the chosen 
+          threshold or head direction is not available.
+        Frames with manually fixed head direction are excluded.
+        
+        Args: None
+        
+        Returns:
+            None
+        """ 
+        if DEBUG: print("ReviseCSV.updateSuspectFIs()")
+
+        n = min(len(self.oData), self.endDataIdx+1)
+        if n <= 0:
+            self.suspectFIs = np.zeros(0, dtype=np.int64)
+        else:
+            cho = wx.FindWindowByName("suspectTh_cho", self.panel["tp"])
+            th = float(cho.GetString(cho.GetSelection()))
+            d = self.oData[:n]
+            isSuspect = (d[:,self.hdi] == "None")
+            if self.hdci != -1:
+                conf = d[:,self.hdci]
+                isConf = (conf != "None")
+                lowConf = np.zeros(n, dtype=bool)
+                lowConf[isConf] = conf[isConf].astype(np.float32) < th
+                isSuspect |= lowConf
+            isSuspect &= (d[:,self.mhdi] != "True")
+            self.suspectFIs = np.flatnonzero(isSuspect)
+        sTxt = wx.FindWindowByName("suspect_sTxt", self.panel["tp"])
+        sTxt.SetLabel("%i suspect frames"%(len(self.suspectFIs)))
+        self.panel["gp"].Refresh() # re-draw graph
     
     #-------------------------------------------------------------------
     
@@ -1271,11 +1494,21 @@ class ReviseCSVFrame(wx.Frame):
         """
         if DEBUG: print("ReviseCSV.callbackFunc()")
         
-        if flag == "finalizeSavingVideo":
-            msg = 'Saved.\n'
-            msg += self.savVidFP 
-            wx.MessageBox(msg, "Info", wx.OK|wx.ICON_INFORMATION)
-            self.jumpToFrame(0) 
+        if flag in ["finalizeSavingVideo", "failedSavingVideo"]:
+            if self.expInfo != None:
+            # full resolution video was exported; restore browsing reader
+                self.vRW.closeReader()
+                self.vRW = self.expInfo["vRW"]
+                self.frameR = self.expInfo["frameR"]
+                self.ratFImgDispImg = self.expInfo["ratFImgDispImg"]
+                self.expInfo = None
+            if flag == "finalizeSavingVideo":
+                msg = 'Saved.\n'
+                msg += self.savVidFP 
+                wx.MessageBox(msg, "Info", wx.OK|wx.ICON_INFORMATION)
+                self.jumpToFrame(0) 
+            else:
+                wx.MessageBox(rData[0], "Error", wx.OK|wx.ICON_ERROR)
         # show current frame
         self.displayFrameImage(self.vRW.currFrame, flagMakeDispImg=True) 
         self.flagBlockUI = False
@@ -1360,51 +1593,32 @@ class ReviseCSVFrame(wx.Frame):
         """ 
         if DEBUG: print("ReviseCSV.makeDispImg()")
 
-        img = frameImg.copy()
-        
         if self.ratFImgDispImg == None:
             self.ratFImgDispImg = calcI2DIRatio(self.vRW.currFrame, 
                                                 self.pi['mp']['sz'])
+        cis = [self.hdi, self.hxi, self.hyi, self.bxi, self.byi]
+        return drawHDData(frameImg, 
+                          self.vRW.fi, 
+                          self.vRW.nFrames, 
+                          self.oData[self.vRW.fi, cis],
+                          self.getDrawInfo())
+    
+    #-------------------------------------------------------------------
+    
+    def getDrawInfo(self):
+        """ Get info to draw data on frame image (drawHDData).
         
-        hD = self.oData[self.vRW.fi][self.hdi]
-        hD = str2num(hD, 'int')
-        if type(hD) == int:
-            pts = []
-            pts.append([self.oData[self.vRW.fi][self.hxi], 
-                        self.oData[self.vRW.fi][self.hyi]]) 
-            pts.append([self.oData[self.vRW.fi][self.bxi], 
-                        self.oData[self.vRW.fi][self.byi]])
-            for i in range(len(pts)):
-                for j in range(len(pts[i])):
-                    pts[i][j] = str2num(pts[i][j], 'int')
-                pts[i] = tuple(pts[i])
-            r = 1.0/self.ratFImgDispImg
-            lw = int(2 * r)
-            cr = int(3 * r)
-            if type(pts[0][0]) == int and type(pts[1][0]) == int:
-                # line from hPos to bPos
-                cv2.line(img, pts[0], pts[1], (0,255,0), lw)
-                # dot on hPos
-                cv2.circle(img, pts[0], cr, (0,125,255), -1)
-         
-        ### resize image
-        if self.ratFImgDispImg != 1.0:
-            img = cv2.resize(img, 
-                             (0,0), 
-                             fx=self.ratFImgDispImg, 
-                             fy=self.ratFImgDispImg)
-        ### write status (frame-index, number-of-frames, etc) 
-        status_msg = "%i/ %i, %s"%(self.vRW.fi, 
-                                   self.vRW.nFrames-1, 
-                                   self.oData[self.vRW.fi][self.hdi])
-        cv2.putText(img, # image
-                    status_msg, # string
-                    (5, 20), # bottom-left
-                    cv2.FONT_HERSHEY_PLAIN, # fontFace
-                    self.fImgFontScale, # fontScale
-                    self.fImgFontCol, # font color
-                    2) # thickness
-        return img
+        Args: None
+
+        Returns:
+            (dict): Drawing info.
+        """ 
+        if DEBUG: print("ReviseCSV.getDrawInfo()")
+
+        return dict(frameR=self.frameR,
+                    ratFImgDispImg=self.ratFImgDispImg,
+                    fImgFontScale=self.fImgFontScale,
+                    fImgFontCol=self.fImgFontCol)
     
     #-------------------------------------------------------------------
     
@@ -1453,15 +1667,29 @@ class ReviseCSVFrame(wx.Frame):
 
     #-------------------------------------------------------------------
     
-    def saveVideo(self):
+    def saveVideo(self, isFullRes=False):
         """ Save video (with revised head direction line)
         
-        Args: None
+        Args:
+            isFullRes (bool): Whether to save video in resolution of 
+              the original video. Otherwise, it's saved in the size of 
+              displayed image.
         
         Returns: None
         """
         if DEBUG: print("ReviseCSV.saveVideo()")
 
+        if isFullRes:
+            ### read the original video (instead of proxy video) 
+            ###   during exporting
+            self.expInfo = dict(vRW=self.vRW, 
+                                frameR=self.frameR, 
+                                ratFImgDispImg=self.ratFImgDispImg)
+            self.vRW = VideoRW(self)
+            self.vRW.useArena = False
+            self.vRW.initReader(self.videoFP)
+            self.frameR = 1.0
+            self.ratFImgDispImg = 1.0
         w = int(np.ceil(self.vRW.currFrame.shape[1]*self.ratFImgDispImg))
         h = int(np.ceil(self.vRW.currFrame.shape[0]*self.ratFImgDispImg))
         video_fSz = (w, h) # output video frame size
@@ -1469,15 +1697,109 @@ class ReviseCSVFrame(wx.Frame):
         if self.vRW.vRecVideoCodec in ['avc1', 'h264']: ext = ".mp4"
         elif self.vRW.vRecVideoCodec == 'xvid': ext = ".avi"
         self.savVidFP = self.csvFP.replace(".csv", "_rev_%s%s"%(timestamp, ext))
-        self.vRW.initWriter(self.savVidFP, 
-                            video_fSz, 
-                            self.callback, 
-                            self.makeDispImg,
-                            self.bp_sTxt)
+        if self.nExpProc > 1 and self.ffmpegFP != None and \
+          self.vRW.fCache is not None and \
+          self.vRW.nFrames >= self.expSegLen*2:
+            ### export segments of video in worker processes 
+            ###   and join them, in a thread;
+            ###   only with frame cache, because seeking in video 
+            ###   (CAP_PROP_POS_FRAMES) is not frame-accurate 
+            ###   for some codecs
+            self.timer["exportVideo"] = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER,
+                      lambda event: self.onTimer(event, "exportVideo"),
+                      self.timer["exportVideo"])
+            self.timer["exportVideo"].Start(50) 
+            self.th = Thread(target=self.exportVideoSegments, 
+                             args=(video_fSz, self.q2m,))
+            self.th.start()
+        else:
+            self.vRW.initWriter(self.savVidFP, 
+                                video_fSz, 
+                                self.callback, 
+                                self.makeDispImg,
+                                self.bp_sTxt)
         self.flagBlockUI = True 
     
     #-------------------------------------------------------------------
     
+    def exportVideoSegments(self, video_fSz, q2m):
+        """ Export video (with revised head direction line) 
+        in contiguous segments of frames, each of which is decoded,
+        drawn and encoded in a worker process (exportSegment).
+        Then, the segments are joined in order into one video file 
+          with FFmpeg, without re-encoding (joinVideos). 
+        When not all frames were written in segments, the main thread
+          is requested to write the video serially. When an error 
+          occurred, it's sent to the main thread.
+        
+        Args:
+            video_fSz (tuple): Output video frame size.
+            q2m (queue.Queue): Queue to send data to main thread.
+        
+        Returns: None
+        """
+        if DEBUG: print("ReviseCSV.exportVideoSegments()")
+
+        nFrames = self.vRW.nFrames
+        ### frame ranges of segments; a few segments per worker 
+        ###   for balancing load among workers
+        segLen = max(self.expSegLen, 
+                     int(np.ceil(nFrames / (self.nExpProc*4.0))))
+        ext = "." + self.savVidFP.split(".")[-1]
+        cis = [self.hdi, self.hxi, self.hyi, self.bxi, self.byi]
+        dInfo = self.getDrawInfo()
+        args = []
+        for fi0 in range(0, nFrames, segLen):
+            fi1 = min(nFrames, fi0+segLen) - 1
+            segFP = self.savVidFP[:-len(ext)] + "_seg%04i%s"%(len(args), ext)
+            args.append(dict(vFP=self.vRW.fPath,
+                             cacheScale=self.vRW.cacheScale,
+                             fi0=fi0,
+                             fi1=fi1,
+                             nFrames=nFrames,
+                             hdData=self.oData[fi0:fi1+1, cis].copy(),
+                             dInfo=dInfo,
+                             segFP=segFP,
+                             codec=self.vRW.vRecVideoCodec,
+                             fps=self.vRW.vRecFPS,
+                             video_fSz=video_fSz))
+        
+        segFPs = [a["segFP"] for a in args]
+        pool = None
+        try:
+            pool = Pool(min(self.nExpProc, len(args)))
+            nDone = 0
+            nWritten = 0
+            for n in pool.imap_unordered(exportSegment, args):
+                nDone += 1
+                nWritten += n
+                msg = "Writing video.. segments: %i/%i"%(nDone, len(args))
+                q2m.put((msg,), True, None)
+            pool.close()
+            pool.join()
+            if nWritten == nFrames:
+                q2m.put(("Joining segments..",), True, None)
+                joinVideos(segFPs, 
+                           self.savVidFP, 
+                           self.ffmpegFP, 
+                           self.vRW.vRecVideoCodec,
+                           self.vRW.vRecFPS,
+                           video_fSz)
+                rData = ("", None)
+            else:
+                msg = "Writing video (%i/%i frames in segments).."%(nWritten,
+                                                                   nFrames)
+                rData = (msg, video_fSz, "serial")
+        except Exception as e:
+            if pool != None: pool.terminate()
+            rData = ("Failed to export video.\n%s"%(str(e)), None, "error")
+        for fp in segFPs:
+            if path.isfile(fp): remove(fp)
+        q2m.put(rData, True, None)
+    
+    #-------------------------------------------------------------------
+    
     def playSnd(self, flag=""):
         """ Play sound 
 
@@ -1498,6 +1820,159 @@ class ReviseCSVFrame(wx.Frame):
 
 #=======================================================================
 
+def drawHDData(frameImg, fi, nFrames, hdData, dInfo):
+    """ Draw head direction data on a frame image and resize it, 
+    for UI or saving video.
+    
+    Args:
+        frameImg (numpy.ndarray): frame image.
+        fi (int): Frame-index.
+        nFrames (int): Number of frames.
+        hdData (numpy.ndarray): Data (strings) of head direction, 
+          head position (x, y) and base position (x, y) of the frame.
+        dInfo (dict): Drawing info (ReviseCSVFrame.getDrawInfo).
+
+    Returns:
+        img (numpy.ndarray): frame image with some drawing and resizing. 
+    """ 
+    if DEBUG: print("reviseCSV_HD.drawHDData()")
+
+    img = frameImg.copy()
+    frameR = dInfo["frameR"]
+    ratFImgDispImg = dInfo["ratFImgDispImg"]
+    
+    ### parse head direction, head position and base position 
+    vals, isInt = parse_int_col(hdData)
+    if isInt[0]:
+        pts = []
+        for i in range(1, len(hdData), 2):
+            pt = []
+            for j in range(i, i+2):
+                if not isInt[j]: pt.append(None)
+                elif frameR != 1.0:
+                # convert to coordinates of proxy video
+                    pt.append(int(round(vals[j]*frameR)))
+                else:
+                    pt.append(int(vals[j]))
+            pts.append(tuple(pt))
+        r = 1.0/ratFImgDispImg
+        lw = int(2 * r)
+        cr = int(3 * r)
+        if type(pts[0][0]) == int and type(pts[1][0]) == int:
+            # line from hPos to bPos
+            cv2.line(img, pts[0], pts[1], (0,255,0), lw)
+            # dot on hPos
+            cv2.circle(img, pts[0], cr, (0,125,255), -1)
+     
+    ### resize image
+    if ratFImgDispImg != 1.0:
+        img = cv2.resize(img, 
+                         (0,0), 
+                         fx=ratFImgDispImg, 
+                         fy=ratFImgDispImg)
+    ### write status (frame-index, number-of-frames, etc) 
+    status_msg = "%i/ %i, %s"%(fi, nFrames-1, hdData[0])
+    cv2.putText(img, # image
+                status_msg, # string
+                (5, 20), # bottom-left
+                cv2.FONT_HERSHEY_PLAIN, # fontFace
+                dInfo["fImgFontScale"], # fontScale
+                dInfo["fImgFontCol"], # font color
+                2) # thickness
+    return img
+
+#-----------------------------------------------------------------------
+
+def exportSegment(a):
+    """ Write a segment of frames with drawn data to a video file
+    (in a worker process).
+    Frames are read from frame cache of the video, so that frame-indices
+      match data exactly.
+
+    Args:
+        a (dict): Info of the segment; vFP, cacheScale, fi0, fi1, nFrames, 
+          hdData, dInfo, segFP, codec, fps and video_fSz.
+          (ReviseCSVFrame.exportVideoSegments)
+
+    Returns:
+        (int): Number of written frames.
+    """
+    if DEBUG: print("reviseCSV_HD.exportSegment()")
+
+    if path.isfile(a["segFP"]): remove(a["segFP"])
+    video_rec = cv2.VideoWriter(a["segFP"], 
+                                fourcc=cv2.VideoWriter_fourcc(*a["codec"]), 
+                                fps=a["fps"], 
+                                frameSize=a["video_fSz"], 
+                                isColor=True)
+    fCache = open_frame_cache(a["vFP"], a["cacheScale"])
+    nWritten = 0
+    for fi in range(a["fi0"], a["fi1"]+1):
+        if fCache is None or fi >= fCache.shape[0]: break
+        frame = np.array(fCache[fi])
+        img = drawHDData(frame, 
+                         fi, 
+                         a["nFrames"], 
+                         a["hdData"][fi-a["fi0"]], 
+                         a["dInfo"])
+        video_rec.write(img)
+        nWritten += 1
+    video_rec.release()
+    return nWritten
+
+#-----------------------------------------------------------------------
+
+def joinVideos(segFPs, outFP, ffmpegFP, codec, fps, video_fSz):
+    """ Join video files in order into one video file.
+    Files are concatenated with FFmpeg's concat demuxer 
+      without re-encoding (stream copy). When it failed,
+      frames are read and written again with OpenCV.
+
+    Args:
+        segFPs (list): File paths of videos to join.
+        outFP (str): File path of output video.
+        ffmpegFP (str): File path of FFmpeg executable.
+        codec (str): Video codec to re-encode.
+        fps (float): Frames per second to re-encode.
+        video_fSz (tuple): Frame size of videos.
+
+    Returns:
+        (bool): Whether videos were joined without re-encoding.
+    """
+    if DEBUG: print("reviseCSV_HD.joinVideos()")
+
+    if path.isfile(outFP): remove(outFP)
+    listFP = outFP + "_concat.txt"
+    with open(listFP, "w") as f:
+        for fp in segFPs:
+            f.write("file '%s'\n"%(path.abspath(fp).replace("'", "'\\''")))
+    cmd = [ffmpegFP, "-y", "-loglevel", "error", 
+           "-f", "concat", "-safe", "0", "-i", listFP, 
+           "-c", "copy", outFP]
+    try: ret = subprocess.run(cmd).returncode
+    except OSError: ret = -1
+    remove(listFP)
+    if ret == 0 and path.isfile(outFP): return True
+    
+    ### join by re-encoding
+    if path.isfile(outFP): remove(outFP)
+    video_rec = cv2.VideoWriter(outFP, 
+                                fourcc=cv2.VideoWriter_fourcc(*codec), 
+                                fps=fps, 
+                                frameSize=video_fSz, 
+                                isColor=True)
+    for fp in segFPs:
+        vCap = cv2.VideoCapture(fp)
+        while True:
+            ret, frame = vCap.read()
+            if not ret: break
+            video_rec.write(frame)
+        vCap.release()
+    video_rec.release()
+    return False
+
+#=======================================================================
+
 class ReviseCSVApp(wx.App):
     def OnInit(self):
         if DEBUG: print("ReviseCSVApp.OnInit()")
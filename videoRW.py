@@ -3,11 +3,14 @@
 import queue
 from threading import Thread 
 from os import path, remove
+from time import time
 
 import numpy as np
 import cv2, wx
 
 from fFuncNClasses import receiveDataFromQueue
+from frameCache import open_frame_cache
+from arena import load_arena, save_arena, crop_frame
 
 DEBUG = False 
 
@@ -29,9 +32,30 @@ class VideoRW:
         ##### [begin] setting up attributes -----
         self.p = parent
         self.fPath = "" # file path of video
-        self.vCap = None # VideoCapture object of OpenCV
+        self.rTh = None # long-lived reader thread, which owns 
+          # VideoCapture object of OpenCV
+        self.cmdQ = queue.Queue() # command queue from main to reader thread
+        self.rQ = queue.Queue() # queue from reader thread to main 
+          # for seek (progress and result)
+        self.nextQ = queue.Queue() # queue from reader thread to caller 
+          # of reading the next frame
+        self.seekID = 0 # ID of the latest seek request
+        self.progInterval = 0.1 # minimum interval (in seconds) between 
+          # progress reports of seek
+        self.fCache = None # memory-mapped frames of frame cache 
+          # (made with frameCache.py), when it's available for the video
+        self.cacheScale = 1.0 # scale of frame size of frame cache to use;
+          # 1.0 for analysis. a reduced one is used only for browsing
+          # in reviseCSV_HD.py, which scales coordinates of data (frameR)
         self.vCapFSz = (-1, -1) # frame size (w, h) of frame image 
           # of current video
+        self.vFullFSz = (-1, -1) # frame size (w, h) of decoded frame,
+          # before it's cropped to arena
+        self.arena = None # arena (arena.make_arena), to which frames are
+          # cropped right after decoding
+        self.useArena = True # whether to load arena of the video;
+          # False to read full frames (such as for reviseCSV_HD.py,
+          # of which data are in coordinates of the full frame)
         self.currFrame = None # current frame image (ndarray)
         self.nFrames = 0 # total number of frames
         self.fi = -1 # current frame index
@@ -42,6 +66,16 @@ class VideoRW:
         self.vRecVideoCodec = "avc1" # video codec for saving analysis screen 
           # (h264/avc1 (.mp4) or xvid (.avi))
         self.vRecFPS = 60 # fps for analysis video file
+        self.recTh = None # recorder thread, which resizes and encodes 
+          # frames of analysis video, given with writeFrame
+        self.recQ = None # bounded queue of frames to the recorder thread
+        self.recQSz = 32 # max. number of frames waiting in 'recQ'
+        self.recMaxWait = 0.0 # max. time (in seconds) to wait for space 
+          # in full 'recQ' before dropping a frame; 0 means not waiting,
+          # so that analysis is never stalled by the recorder
+        self.recDropPolicy = "oldest" # frame to drop when 'recQ' is full;
+          # 'oldest' (waiting longest in 'recQ') or 'newest' (being added)
+        self.nRecDropped = 0 # number of dropped frames of analysis video
         ##### [end] setting up attributes -----
 
     #-------------------------------------------------------------------
@@ -57,14 +91,40 @@ class VideoRW:
         """
         if DEBUG: print("VideoRW.initReader()") 
 
+        if self.rTh != None: self.closeReader()
         self.fPath = fPath
-        # init video capture
-        self.vCap = cv2.VideoCapture(fPath)
-        # get total number of frames
-        self.nFrames = int(self.vCap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.fi = -1 
+        self.rQ = queue.Queue()
+        self.fCache = open_frame_cache(fPath, self.cacheScale)
+        if self.fCache is not None:
+        # frame cache is available; frames are read directly from it
+            self.nFrames = self.fCache.shape[0]
+            self.vFullFSz = (self.fCache.shape[2], self.fCache.shape[1])
+        else:
+            # init video capture
+            vCap = cv2.VideoCapture(fPath)
+            # get total number of frames
+            self.nFrames = int(vCap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.vFullFSz = (int(vCap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                             int(vCap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            ### start reader thread
+            self.cmdQ = queue.Queue()
+            self.nextQ = queue.Queue()
+            self.rTh = Thread(target=self.runReader, 
+                              args=(vCap, self.cmdQ, self.rQ, self.nextQ,))
+            self.rTh.daemon = True
+            self.rTh.start()
+        if not "readFrames" in self.timer.keys():
+            ### timer for receiving seek progress and result; 
+            ###   created once and re-started for each seek
+            self.timer["readFrames"] = wx.Timer(self.p)
+            self.p.Bind(wx.EVT_TIMER,
+                        lambda event: self.onTimer(event, "readFrames"),
+                        self.timer["readFrames"])
+        if self.useArena: self.arena = load_arena(fPath, self.vFullFSz)
+        else: self.arena = None
         self.getFrame(-1) # read the 1st frame
-        # store frame size
+        # store frame size (of frame cropped to arena)
         self.vCapFSz = (self.currFrame.shape[1], self.currFrame.shape[0]) 
 
     #-------------------------------------------------------------------
@@ -112,12 +172,29 @@ class VideoRW:
             self.th = Thread(target=self.writeFrames, 
                              args=(self.video_rec, self.q2m, procFunc,))
             wx.CallLater(20, self.th.start)
+        else:
+            ### start recorder thread for frames given with writeFrame
+            self.recQ = queue.Queue(maxsize=self.recQSz)
+            self.nRecDropped = 0
+            self.recTh = Thread(target=self.runRecorder,
+                                args=(self.video_rec, 
+                                      self.recQ, 
+                                      tuple(video_fSz),))
+            self.recTh.start()
                 
     #-------------------------------------------------------------------
     
     def getFrame(self, targetFI=-1, callbackFunc=None, sTxt=None):
         """ Retrieve a frame image with a given index or 
         just the next frame when index is not given. 
+        Reading is done in the reader thread; the next frame is returned 
+          synchronously, while a frame with a given index is delivered to 
+          'callbackFunc'. When a new index is given before the previous 
+          one is reached, only the latest one is served.
+        When frame cache is available, frames are read from it directly.
+        Frames are cropped to arena (when it's set) in the main thread, 
+          so that frames in the reader thread stay intact, when 
+          arena is changed.
 
         Args:
             targetFI (int): Target frame index to retrieve.
@@ -127,70 +204,197 @@ class VideoRW:
               when navigating with thread.
 
         Returns:
-            ret (bool): Notifying whether the image retrieval was successful.
-            frame (numpy.ndarray): Frame image.
+            None
         """
         if DEBUG: print("VideoRW.getFrame()")
 
         if self.fi >= self.nFrames: return
         
-        if targetFI == -1:
-        # target index is not given
-            for i in range(self.fi, self.nFrames):
-                ret, frame = self.vCap.read() # read next frame
+        if self.fCache is not None:
+        # frame cache is used
+            if targetFI == -1:
                 self.fi += 1
-                if ret: break # stop reading, if it was successful
-            if ret:
-                self.currFrame = frame
-            else: # failed to retrieve frame
-                frame = np.zeros(self.vCapFSz) # return blank image
+                if self.fi < self.nFrames:
+                    self.currFrame = crop_frame(self.fCache[self.fi], 
+                                                self.arena,
+                                                True)
+            else:
+                self.seekID += 1
+                self.callbackFunc = callbackFunc
+                self.sTxt = sTxt
+                self.targetFI = targetFI
+                fi = min(targetFI, self.nFrames-1)
+                ### deliver the frame through the same route as the thread,
+                ###   so that callback is called after this function returns
+                frame = np.array(self.fCache[fi])
+                self.rQ.put((self.seekID, fi, frame), True, None)
+                if not self.timer["readFrames"].IsRunning():
+                    self.timer["readFrames"].Start(10) 
+
+        elif targetFI == -1:
+        # target index is not given
+            self.cmdQ.put(("next",), True, None)
+            fi, frame = self.nextQ.get(True, None)
+            self.fi = fi
+            if type(frame) == np.ndarray:
+                self.currFrame = crop_frame(frame, self.arena)
+                # decode the frame after this one, while it's processed
+                self.cmdQ.put(("prefetch",), True, None)
         else:
         # target index is given
-            if targetFI > self.fi:
-                nRead = targetFI - self.fi 
-            elif targetFI < self.fi:
-                self.vCap.release()
-                self.vCap = cv2.VideoCapture(self.fPath)
-                self.fi = -1 
-                nRead = targetFI + 1
-            else:
-                return
-            ### start thread to read
-            self.th = Thread(target=self.readFrames, 
-                             args=(self.fi, nRead, self.q2m,))
-            self.th.start()
+            self.seekID += 1
             self.callbackFunc = callbackFunc # store callback function
             self.sTxt = sTxt # wx.StaticText to show progress
             self.targetFI = targetFI
-            ### set timer for updating current frame index 
-            self.timer["readFrames"] = wx.Timer(self.p)
-            self.p.Bind(wx.EVT_TIMER,
-                        lambda event: self.onTimer(event, "readFrames"),
-                        self.timer["readFrames"])
-            self.timer["readFrames"].Start(10) 
+            self.cmdQ.put(("seek", targetFI, self.seekID), True, None)
+            if not self.timer["readFrames"].IsRunning():
+                self.timer["readFrames"].Start(10) 
     
     #-------------------------------------------------------------------
 
-    def readFrames(self, fi, n, q2m):
-        """ read frames from video
+    def runReader(self, vCap, cmdQ, rQ, nextQ):
+        """ Reader thread, which handles commands from main thread 
+        until 'close' command.
+        Commands:
+          ("next",): read the next frame and send it to 'nextQ'.
+          ("prefetch",): read the next frame in advance.
+          ("seek", targetFI, seekID): read frames until 'targetFI' and 
+            send the result to 'rQ'. Newer seek commands, arrived while 
+            reading, replace the target.
+          ("close",): release VideoCapture and finish the thread.
         
         Args:
-            fi (int): Current frame index
-            n (int): Number of frames to read
-            q2m (queue.Queue): Queue to send data to main
+            vCap (cv2.VideoCapture): VideoCapture of the video.
+            cmdQ (queue.Queue): Queue to receive commands.
+            rQ (queue.Queue): Queue to send seek progress/result.
+            nextQ (queue.Queue): Queue to send the next frame.
         
         Returns:
             None
         """
-        if DEBUG: print("VideoRW.readFrames()") 
+        if DEBUG: print("VideoRW.runReader()") 
         
-        for i in range(n):
-            ret, f = self.vCap.read()
-            if not ret: break
-            frame = f
-            q2m.put((fi,), True, None)
-            fi += 1
-        q2m.put((fi, frame), True, None)
+        st = dict(
+                    vCap=vCap, 
+                    fi=-1, # index of the last frame read from vCap
+                    frame=None, # the last frame read from vCap
+                    prev=(-1, None), # (index, frame) read before 'frame'
+                    pf=None, # prefetched frame (index, frame), which is 
+                      # the frame after the one, delivered to main
+                 ) # state of reader
+        pending = [] # commands, which arrived while seeking
+        while True:
+            if pending != []: cmd = pending.pop(0)
+            else: cmd = cmdQ.get(True, None)
+            
+            if cmd[0] == "close":
+                break
+
+            elif cmd[0] == "next":
+                if st["pf"] != None:
+                    nextQ.put(st["pf"], True, None)
+                    st["pf"] = None
+                else:
+                    ### read until a frame is successfully retrieved
+                    ret = False
+                    while not ret and st["fi"] < self.nFrames:
+                        ret = self.readNext(st)
+                    if ret: nextQ.put((st["fi"], st["frame"]), True, None)
+                    else: nextQ.put((st["fi"], None), True, None)
+
+            elif cmd[0] == "prefetch":
+                if st["pf"] == None and st["fi"] < self.nFrames-1:
+                    if self.readNext(st): st["pf"] = (st["fi"], st["frame"])
+            
+            elif cmd[0] == "seek":
+                ret = self.seek(st, cmd[1], cmd[2], cmdQ, rQ, pending)
+                if ret == "close": break
+
+        st["vCap"].release()
+    
+    #-------------------------------------------------------------------
+
+    def readNext(self, st):
+        """ Read the next frame in the reader thread. 
+        
+        Args:
+            st (dict): State of reader.
+        
+        Returns:
+            ret (bool): Whether reading was successful.
+        """
+        if DEBUG: print("VideoRW.readNext()") 
+        
+        ret, frame = st["vCap"].read()
+        st["prev"] = (st["fi"], st["frame"])
+        st["fi"] += 1
+        if ret: st["frame"] = frame
+        return ret
+    
+    #-------------------------------------------------------------------
+
+    def seek(self, st, targetFI, seekID, cmdQ, rQ, pending):
+        """ Read frames until the target frame in the reader thread.
+        
+        Args:
+            st (dict): State of reader.
+            targetFI (int): Target frame index.
+            seekID (int): ID of seek request.
+            cmdQ (queue.Queue): Queue to receive commands.
+            rQ (queue.Queue): Queue to send progress/result.
+            pending (list): List to store other commands, 
+              arrived while seeking.
+        
+        Returns:
+            (None/str): "close", when 'close' command arrived.
+        """
+        if DEBUG: print("VideoRW.seek()") 
+       
+        lastProgT = time()
+        isDone = False
+        while True:
+            if not isDone:
+                if targetFI == st["fi"] and type(st["frame"]) == np.ndarray:
+                # the last read (or prefetched) frame is the target
+                    rslt = (st["fi"], st["frame"])
+                    st["pf"] = None
+                    isDone = True
+                elif st["pf"] != None and targetFI == st["prev"][0]:
+                # the frame before the prefetched one (the current frame 
+                #   in main) is the target
+                    rslt = st["prev"]
+                    isDone = True
+                elif targetFI < st["fi"]:
+                # target is behind; re-open video
+                    st["vCap"].release()
+                    st["vCap"] = cv2.VideoCapture(self.fPath)
+                    st["fi"] = -1
+                    st["frame"] = None
+                    st["pf"] = None
+                else:
+                    st["pf"] = None
+                    if not self.readNext(st) and st["fi"] >= self.nFrames-1:
+                    # reached the end of video; 
+                    #   deliver the last retrieved frame
+                        rslt = (st["fi"], st["frame"])
+                        isDone = True
+                    if time()-lastProgT >= self.progInterval:
+                        rQ.put((seekID, st["fi"]), True, None)
+                        lastProgT = time()
+            
+            ### check newer commands
+            while True:
+                try: cmd = cmdQ.get_nowait()
+                except queue.Empty: break
+                if cmd[0] == "close": return "close"
+                elif cmd[0] == "seek":
+                # newer seek request; serve only the latest target
+                    targetFI, seekID = cmd[1], cmd[2]
+                    isDone = False
+                else:
+                    pending.append(cmd)
+            if isDone: break
+        rQ.put((seekID,) + rslt, True, None)
 
     #-------------------------------------------------------------------
     
@@ -220,17 +424,56 @@ class VideoRW:
     #-------------------------------------------------------------------
     
     def writeFrame(self, frame):
-        """ Write a single frame to VideoRecorder to save.
+        """ Pass a single frame to the recorder thread to save.
+        When the queue to the recorder is full (encoding is slower than 
+          analysis), a frame is dropped according to 'recDropPolicy',
+          after waiting up to 'recMaxWait' seconds.
+        The frame is not copied; it shouldn't be modified afterwards.
 
-        Args: None
+        Args:
+            frame (numpy.ndarray): Frame image to save.
 
-        Returns: None
+        Returns: 
+            (bool): Whether the frame was queued without dropping a frame.
         """
         if DEBUG: print("VideoRW.writeFrame()")
 
-        self.video_rec.write(
-                            cv2.resize(frame, self.writingVideoFrameSz)
-                            ) # write a frame
+        try:
+            if self.recMaxWait > 0: self.recQ.put(frame, True, self.recMaxWait)
+            else: self.recQ.put(frame, False)
+            return True
+        except queue.Full:
+            self.nRecDropped += 1
+            if self.recDropPolicy == "oldest":
+                ### drop the oldest frame to make room for this frame
+                try: self.recQ.get(False)
+                except queue.Empty: pass
+                try: self.recQ.put(frame, False)
+                except queue.Full: pass
+            return False
+    
+    #-------------------------------------------------------------------
+    
+    def runRecorder(self, video_rec, recQ, fSz):
+        """ Recorder thread, which resizes and writes frames, 
+        received from 'recQ', until None is received.
+
+        Args:
+            video_rec (cv2.VideoWriter)
+            recQ (queue.Queue): Queue to receive frames from main thread.
+            fSz (tuple): Frame size (w, h) of video.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("VideoRW.runRecorder()")
+
+        while True:
+            frame = recQ.get(True, None)
+            if frame is None: break # closing writer
+            if (frame.shape[1], frame.shape[0]) != fSz:
+                frame = cv2.resize(frame, fSz)
+            video_rec.write(frame) # write a frame
     
     #-------------------------------------------------------------------
 
@@ -246,6 +489,28 @@ class VideoRW:
         """
         #if DEBUG: print("VideoRW.onTimer()") 
 
+        if flag == "readFrames":
+        # navigating (reading frames) to a specific frame
+            ### receive data from reader thread, 
+            ###   ignoring data of outdated seek requests
+            rData = None
+            while True: 
+                ret = receiveDataFromQueue(self.rQ)
+                if ret == None: break
+                if ret[0] == self.seekID: rData = ret
+            if rData == None: return
+            if len(rData) == 2:
+                self.sTxt.SetLabel("Frame-index: %i"%(rData[1]))
+            elif len(rData) == 3:
+            # reached target frame index
+                self.fi = rData[1]
+                self.currFrame = crop_frame(rData[2], self.arena)
+                self.timer["readFrames"].Stop()
+                self.targetFI = -1
+                self.sTxt.SetLabel("-")
+                self.callbackFunc((self.fi, self.currFrame))
+            return
+        
         ### receive (last) data from queue
         rData = None
         while True: 
@@ -254,22 +519,7 @@ class VideoRW:
             rData = ret # store received data
         if rData == None: return
         
-        if flag == "readFrames":
-        # navigating (reading frames) to a specific frame
-            if len(rData) == 1:
-                self.sTxt.SetLabel("Frame-index: %i"%(rData[0]))
-            elif len(rData) == 2:
-            # reached target frame index
-                self.fi, self.currFrame = rData
-                self.timer["readFrames"].Stop()
-                self.timer["readFrames"] = None
-                self.targetFI = -1
-                self.sTxt.SetLabel("-")
-                self.th.join()
-                self.th = None
-                self.callbackFunc(rData)
-        
-        elif flag == "writeFrames":
+        if flag == "writeFrames":
             if len(rData) == 1:
                 if self.sTxt != None: self.sTxt.SetLabel(rData[0])
             elif len(rData) == 2:
@@ -280,6 +530,27 @@ class VideoRW:
                 self.callbackFunc(rData, "finalizeSavingVideo") 
     
     #-------------------------------------------------------------------
+    
+    def setArena(self, rect=None, poly=None):
+        """ Set arena of the current video and save it to its arena file.
+        When neither 'rect' nor 'poly' is given, arena is removed.
+        It's applied from the next frame, read with getFrame.
+
+        Args:
+            rect (None/tuple): (x, y, w, h) of arena in full frame.
+            poly (None/list): Vertices of polygon arena in full frame.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("VideoRW.setArena()")
+
+        save_arena(self.fPath, rect, poly)
+        self.arena = load_arena(self.fPath, self.vFullFSz)
+        if self.arena == None: self.vCapFSz = self.vFullFSz
+        else: self.vCapFSz = tuple(self.arena["rect"][2:])
+
+    #-------------------------------------------------------------------
 
     def closeReader(self):
         """ close videoCapture 
@@ -290,8 +561,15 @@ class VideoRW:
         """
         if DEBUG: print("VideoRW.closeReader()") 
         
-        self.vCap.release() # close video capture instance
-        self.vCap = None
+        if self.rTh != None:
+            ### finish reader thread, which releases video capture instance
+            self.cmdQ.put(("close",), True, None)
+            self.rTh.join()
+            self.rTh = None
+        if "readFrames" in self.timer.keys():
+            self.timer["readFrames"].Stop()
+        self.fCache = None
+        self.arena = None
         self.fPath = ""
         self.fi = -1
         self.nFrames = 0
@@ -307,6 +585,12 @@ class VideoRW:
         """
         if DEBUG: print("VideoRW.closeWriter()")
 
+        if self.recTh != None:
+            ### write all frames in queue, then finish recorder thread
+            self.recQ.put(None, True, None)
+            self.recTh.join()
+            self.recTh = None
+            self.recQ = None
         # finish recorder
         self.video_rec.release()
         self.video_rec = None